@@ -107,16 +107,26 @@ with DAG(
    
     def model_pusher(**kwargs):
         ti = kwargs["ti"]
-        from sensor.entity.artifact_entity import DataTransformationArtifact,DataValidationArtifact,ModelTrainerArtifact
+        from sensor.entity.artifact_entity import DataTransformationArtifact,DataValidationArtifact,ModelTrainerArtifact,ModelEvaluationArtifact
         data_transformation_artifact = ti.xcom_pull(task_ids="data_transformation", key="data_transformation_artifact")
         data_transformation_artifact = DataTransformationArtifact(**(data_transformation_artifact))
         
         model_trainer_artifact = ti.xcom_pull(task_ids="model_trainer", key="model_trainer_artifact")
         model_trainer_artifact = ModelTrainerArtifact(**(model_trainer_artifact))
+
+        data_validation_artifact = ti.xcom_pull(task_ids="data_validation", key="data_validation_artifact")
+        data_validation_artifact = DataValidationArtifact(**(data_validation_artifact))
+
+        model_eval_artifact = ti.xcom_pull(task_ids="model_evaluation", key="model_eval_artifact")
+        model_eval_artifact = ModelEvaluationArtifact(**(model_eval_artifact))
+        if not model_eval_artifact.is_model_accepted:
+            return
         
         model_pusher_artifact = training_pipeline.start_model_pusher(
             data_transformation_artifact=data_transformation_artifact,
-            model_trainer_artifact=model_trainer_artifact)
+            model_trainer_artifact=model_trainer_artifact,
+            data_validation_artifact=data_validation_artifact,
+            model_eval_artifact=model_eval_artifact)
         ti.xcom_push("model_pusher_artifact", model_pusher_artifact.__dict__)
 
     def push_data_to_s3(**kwargs):
@@ -125,7 +135,7 @@ with DAG(
         artifact_folder = "/app/artifact"
         saved_models = "/app/saved_models"
         os.system(f"aws s3 sync {artifact_folder} s3://{bucket_name}/artifact")
-        os.system(f"aws s3 sync {saved_models} s3://{bucket_name}/saved_models")
+        os.system(f"aws s3 sync {saved_models} s3://{bucket_name}/saved_models --exclude '.staging/*' --exclude '.manifest.lock'")
 
     data_ingestion_task = PythonOperator(
         task_id="data_ingestion",
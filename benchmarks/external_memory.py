@@ -0,0 +1,75 @@
+"""
+Training memory benchmark
+
+Saves a synthetic transformed train split as shards, then trains the xgboost
+model from it once per training mode, each in a fresh interpreter, and reports
+the wall time and peak resident memory of the run: in_memory fits
+XGBClassifier on the loaded arrays, native builds a QuantileDMatrix batch by
+batch and external_memory an ExtMemQuantileDMatrix cached on disk.
+
+usage: python -m benchmarks.external_memory [--rows 480000] [--features 170] [--modes in_memory native external_memory]
+"""
+import argparse
+import subprocess
+import sys
+import tempfile
+import time
+
+TRAINING_MODES = ("in_memory","native","external_memory")
+
+
+def train(mode:str,dir_path:str,batch_rows:int) -> float:
+    import os
+    import xgboost
+    from sensor.components.model_trainer import ModelTrainer
+    from sensor.ml.external_memory import TransformedDataIter,get_external_memory_dmatrix
+    from sensor.utils import load_transformed_data
+    start_time = time.perf_counter()
+    if mode=="in_memory":
+        x,y = load_transformed_data(dir_path=dir_path)
+        ModelTrainer.train_model(x=x,y=y)
+    elif mode=="native":
+        dtrain = xgboost.QuantileDMatrix(TransformedDataIter(dir_path=dir_path,batch_rows=batch_rows))
+        ModelTrainer.train_booster(dtrain=dtrain)
+    else:
+        dtrain = get_external_memory_dmatrix(dir_path=dir_path,cache_dir=os.path.join(dir_path,"cache"),
+            batch_rows=batch_rows)
+        ModelTrainer.train_booster(dtrain=dtrain)
+    return time.perf_counter()-start_time
+
+
+if __name__=="__main__":
+    parser = argparse.ArgumentParser(description="Compare the peak memory of the training modes")
+    parser.add_argument("--rows",type=int,default=480000)
+    parser.add_argument("--features",type=int,default=170)
+    parser.add_argument("--shard-rows",type=int,default=100000)
+    parser.add_argument("--batch-rows",type=int,default=100000)
+    parser.add_argument("--modes",nargs="+",default=list(TRAINING_MODES),choices=TRAINING_MODES)
+    parser.add_argument("--random-state",type=int,default=42)
+    #internal: train one mode on an existing directory and print its timings
+    parser.add_argument("--run",default=None,choices=TRAINING_MODES,help=argparse.SUPPRESS)
+    parser.add_argument("--dir",default=None,help=argparse.SUPPRESS)
+    args = parser.parse_args()
+
+    if args.run is not None:
+        from sensor.utils import get_peak_rss_mb
+        seconds = train(mode=args.run,dir_path=args.dir,batch_rows=args.batch_rows)
+        print(seconds,get_peak_rss_mb())
+        sys.exit(0)
+
+    import numpy as np
+    from sensor.utils import save_transformed_data
+    with tempfile.TemporaryDirectory() as dir_path:
+        rng = np.random.default_rng(args.random_state)
+        x = rng.standard_normal((args.rows,args.features),dtype=np.float32)
+        y = (x[:,0]+x[:,1]+rng.standard_normal(args.rows,dtype=np.float32)>3).astype(np.int8)
+        save_transformed_data(dir_path=dir_path,input_feature_arr=x,target_feature_arr=y,shard_rows=args.shard_rows)
+        print(f"train rows: {args.rows} features: {args.features} data: {x.nbytes/2**20:.0f} MB positive: {int(y.sum())}")
+        del x,y
+
+        print(f"{'mode':>16} {'train s':>8} {'peak MB':>8}")
+        for mode in args.modes:
+            result = subprocess.run([sys.executable,"-m","benchmarks.external_memory","--run",mode,"--dir",dir_path,
+                "--batch-rows",str(args.batch_rows)],capture_output=True,text=True,check=True)
+            seconds,peak_mb = map(float,result.stdout.split()[-2:])
+            print(f"{mode:>16} {seconds:>8.2f} {peak_mb:>8.0f}")
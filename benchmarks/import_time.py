@@ -0,0 +1,43 @@
+"""
+Cold start import benchmark
+
+Runs `python -X importtime -c "import <module>"` in a fresh interpreter and
+reports the total import time with the slowest imports, so regressions in
+the start up cost of airflow tasks and dag parsing can be tracked.
+
+usage: python benchmarks/import_time.py [--module sensor.pipeline.batch_prediction] [--top 15] [--max-ms 500]
+"""
+import argparse
+import subprocess
+import sys
+
+
+def measure_import_time(module:str) -> list:
+    result = subprocess.run([sys.executable,"-X","importtime","-c",f"import {module}"],
+        capture_output=True,text=True,check=True)
+    timings = []
+    for line in result.stderr.splitlines():
+        if not line.startswith("import time:") or "cumulative" in line:
+            continue
+        self_us,cumulative_us,name = line[len("import time:"):].split("|")
+        timings.append((name.rstrip(),int(self_us),int(cumulative_us)))
+    return timings
+
+
+if __name__=="__main__":
+    parser = argparse.ArgumentParser(description="Measure the cold import time of a module")
+    parser.add_argument("--module",default="sensor.pipeline.batch_prediction")
+    parser.add_argument("--top",type=int,default=15)
+    parser.add_argument("--max-ms",type=float,default=None,help="exit with status 1 above this total")
+    args = parser.parse_args()
+
+    timings = measure_import_time(module=args.module)
+    total_ms = next(cumulative for name,_,cumulative in timings if name.strip()==args.module)/1000
+    print(f"import {args.module}: {total_ms:.1f} ms")
+    print(f"{'cumulative ms':>14} {'self ms':>9}  module")
+    for name,self_us,cumulative_us in sorted(timings,key=lambda timing:timing[2],reverse=True)[:args.top]:
+        print(f"{cumulative_us/1000:>14.1f} {self_us/1000:>9.1f}  {name}")
+
+    if args.max_ms is not None and total_ms>args.max_ms:
+        print(f"import time {total_ms:.1f} ms is above the {args.max_ms} ms budget")
+        sys.exit(1)
@@ -0,0 +1,66 @@
+"""
+Class rebalancing benchmark
+
+Fits the data transformer once, then for every resampling strategy rebalances
+the training split, trains the xgboost model and reports the resampling and
+training wall time with the f1 score on the untouched test split.
+
+usage: python -m benchmarks.resampling [--data aps_failure_training_set1.csv] [--strategies none smote undersample smote_tomek]
+       without --data a synthetic imbalanced dataset of --rows rows is used
+"""
+import argparse
+import time
+
+
+def load_dataset(data_path:str,rows:int,random_state:int):
+    import numpy as np
+    import pandas as pd
+    if data_path is not None:
+        from sensor.entity.schema_entity import load_schema
+        from sensor.utils import read_dataframe
+        schema = load_schema(file_path="schema.yaml")
+        df = read_dataframe(file_path=data_path,schema_info=schema.schema_info)
+        x = df[schema.get_feature_columns(df.columns)]
+        y = (df[schema.target_column]=="pos").to_numpy(dtype=np.int8)
+        return x,y
+    from sklearn.datasets import make_classification
+    x,y = make_classification(n_samples=rows,n_features=160,n_informative=20,weights=[0.98],
+        flip_y=0.005,random_state=random_state)
+    return pd.DataFrame(x).add_prefix("f_"),y
+
+
+if __name__=="__main__":
+    from sensor.ml.resampling import RESAMPLING_STRATEGIES,get_resampler,get_scale_pos_weight
+    parser = argparse.ArgumentParser(description="Compare class rebalancing strategies")
+    parser.add_argument("--data",default=None,help="aps csv file, synthetic data when omitted")
+    parser.add_argument("--rows",type=int,default=60000)
+    parser.add_argument("--strategies",nargs="+",default=list(RESAMPLING_STRATEGIES),choices=RESAMPLING_STRATEGIES)
+    parser.add_argument("--n-jobs",type=int,default=None)
+    parser.add_argument("--random-state",type=int,default=42)
+    args = parser.parse_args()
+
+    from sklearn.metrics import f1_score
+    from sklearn.model_selection import train_test_split
+    from xgboost import XGBClassifier
+    from sensor.components.data_transformation import DataTransformation
+
+    x,y = load_dataset(data_path=args.data,rows=args.rows,random_state=args.random_state)
+    x_train,x_test,y_train,y_test = train_test_split(x,y,test_size=0.2,stratify=y,random_state=args.random_state)
+    transformer = DataTransformation.get_data_transformer_object().fit(x_train)
+    x_train,x_test = transformer.transform(x_train),transformer.transform(x_test)
+    print(f"train rows: {len(y_train)} positive: {int(y_train.sum())} test rows: {len(y_test)} positive: {int(y_test.sum())}")
+
+    print(f"{'strategy':>12} {'rows':>8} {'resample s':>11} {'fit s':>7} {'test f1':>8}")
+    for strategy in args.strategies:
+        resampler = get_resampler(strategy=strategy,random_state=args.random_state,n_jobs=args.n_jobs)
+        start_time = time.perf_counter()
+        x_resampled,y_resampled = (x_train,y_train) if resampler is None else resampler.fit_resample(x_train,y_train)
+        resample_time = time.perf_counter()-start_time
+
+        scale_pos_weight = get_scale_pos_weight(y=y_resampled) if strategy=="none" else None
+        start_time = time.perf_counter()
+        model = XGBClassifier(scale_pos_weight=scale_pos_weight).fit(x_resampled,y_resampled)
+        fit_time = time.perf_counter()-start_time
+
+        test_f1 = f1_score(y_true=y_test,y_pred=model.predict(x_test))
+        print(f"{strategy:>12} {len(y_resampled):>8} {resample_time:>11.2f} {fit_time:>7.2f} {test_f1:>8.4f}")
@@ -1,3 +0,0 @@
-from dotenv import load_dotenv
-print("Reading .env file")
-load_dotenv()
\ No newline at end of file
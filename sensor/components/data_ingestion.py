@@ -2,10 +2,20 @@ from sensor.exception import SensorException
 from sensor.logger import logging
 from sensor.entity.artifact_entity import DataIngestionArtifact
 from sensor.entity.config_entity import DataIngestionConfig
-from sensor.utils import export_collection_as_dataframe
+from sensor.utils import (export_collection_as_dataframe,
+                          export_collection_as_dataframe_in_batches,
+                          export_collection_as_dataframe_in_partitions,
+                          get_collection_watermark,
+                          read_yaml_file,write_yaml_file,
+                          write_dataframe,
+                          convert_columns_float,
+                          iter_dataframe_chunks,DataFrameChunkWriter,get_row_hashes)
+from sensor.entity.schema_entity import load_schema
+from bson import json_util
 from sklearn.model_selection import train_test_split
 import os,sys
 import numpy as np
+import pandas as pd
 
 class DataIngestion:
 
@@ -16,29 +26,201 @@ class DataIngestion:
         except Exception as e:
             raise SensorException(e, sys) from e
 
-    def initiate_data_ingestion(self) -> DataIngestionArtifact:
+    def export_data(self) -> pd.DataFrame:
+        try:
+            if self.data_ingestion_config.export_mode=="stream":
+                return export_collection_as_dataframe_in_batches(
+                    database_name=self.data_ingestion_config.database_name,
+                    collection_name=self.data_ingestion_config.collection_name,
+                    schema_file_path=self.data_ingestion_config.schema_file_path,
+                    batch_size=self.data_ingestion_config.export_batch_size)
+            if self.data_ingestion_config.export_mode=="partitioned":
+                return export_collection_as_dataframe_in_partitions(
+                    database_name=self.data_ingestion_config.database_name,
+                    collection_name=self.data_ingestion_config.collection_name,
+                    schema_file_path=self.data_ingestion_config.schema_file_path,
+                    n_workers=self.data_ingestion_config.export_n_workers,
+                    batch_size=self.data_ingestion_config.export_batch_size)
+            if self.data_ingestion_config.export_mode=="full":
+                return export_collection_as_dataframe(
+                    database_name=self.data_ingestion_config.database_name,
+                    collection_name=self.data_ingestion_config.collection_name)
+            raise Exception(f"Unknown export mode: {self.data_ingestion_config.export_mode}")
+        except Exception as e:
+            raise SensorException(e, sys) from e
+
+    def read_snapshot_state(self) -> dict:
+        try:
+            state_file_path = self.data_ingestion_config.snapshot_state_file_path
+            if not os.path.exists(state_file_path):
+                return {"watermark":None,"parts":[]}
+            state = read_yaml_file(file_path=state_file_path)
+            state["watermark"] = json_util.loads(state["watermark"])
+            return state
+        except Exception as e:
+            raise SensorException(e, sys) from e
+
+    def write_snapshot_state(self,watermark,parts:list) -> None:
         try:
-            logging.info("Exporting collection as dataframe")
-            df = export_collection_as_dataframe(
+            state_file_path = self.data_ingestion_config.snapshot_state_file_path
+            temp_file_path = f"{state_file_path}.tmp"
+            write_yaml_file(file_path=temp_file_path, data={
+                "watermark_field":self.data_ingestion_config.watermark_field,
+                "watermark":json_util.dumps(watermark),
+                "parts":parts,
+            })
+            #parts written before a crash are ignored until the state file lists them
+            os.replace(temp_file_path,state_file_path)
+        except Exception as e:
+            raise SensorException(e, sys) from e
+
+    def update_snapshot(self) -> tuple:
+        """
+        Append the documents above the stored watermark to the snapshot as a new part
+        return: tuple of all part file paths and of the part file paths appended by this run
+        """
+        try:
+            state = self.read_snapshot_state()
+            watermark_field = self.data_ingestion_config.watermark_field
+            new_watermark = get_collection_watermark(
                 database_name=self.data_ingestion_config.database_name,
-                 collection_name=self.data_ingestion_config.collection_name)
+                collection_name=self.data_ingestion_config.collection_name,
+                watermark_field=watermark_field)
+            logging.info(f"Previous watermark: {state['watermark']} current watermark: {new_watermark}")
+
+            if new_watermark is not None and new_watermark!=state["watermark"]:
+                watermark_range = {"$lte":new_watermark}
+                if state["watermark"] is not None:
+                    watermark_range["$gt"]=state["watermark"]
+                new_df = export_collection_as_dataframe_in_batches(
+                    database_name=self.data_ingestion_config.database_name,
+                    collection_name=self.data_ingestion_config.collection_name,
+                    schema_file_path=self.data_ingestion_config.schema_file_path,
+                    batch_size=self.data_ingestion_config.export_batch_size,
+                    query={watermark_field:watermark_range})
+                logging.info(f"Appending {len(new_df)} new rows to the snapshot")
+
+                part_name = f"part-{len(state['parts']):05d}.{self.data_ingestion_config.file_format}"
+                write_dataframe(df=new_df, file_path=os.path.join(self.data_ingestion_config.snapshot_dir,part_name))
+                state["parts"].append(part_name)
+                self.write_snapshot_state(watermark=new_watermark, parts=state["parts"])
+                new_part_names = [part_name]
+            else:
+                logging.info("No new documents since the previous run")
+                new_part_names = []
+
+            logging.info(f"Snapshot is made of {len(state['parts'])} parts")
+            return ([os.path.join(self.data_ingestion_config.snapshot_dir,part_name) for part_name in state["parts"]],
+                [os.path.join(self.data_ingestion_config.snapshot_dir,part_name) for part_name in new_part_names])
+        except Exception as e:
+            raise SensorException(e, sys) from e
+
+    def iter_snapshot_chunks(self,part_file_paths:list):
+        schema = load_schema(file_path=self.data_ingestion_config.schema_file_path)
+        for part_file_path in part_file_paths:
+            for chunk in iter_dataframe_chunks(file_path=part_file_path,
+                chunk_size=self.data_ingestion_config.split_chunk_size, schema_info=schema.schema_info):
+                yield convert_columns_float(df=chunk, dtypes=schema.dtypes, na_values=list(schema.na_values))
+
+    def get_stratified_hash_thresholds(self,get_chunks,target_column:str) -> dict:
+        try:
+            #only the row hashes and labels are kept, not the rows themselves
+            label_hashes = {}
+            for chunk in get_chunks():
+                row_hashes = get_row_hashes(df=chunk, key_columns=self.data_ingestion_config.split_key_columns)
+                for label,index in chunk.groupby(target_column,observed=True).indices.items():
+                    label_hashes.setdefault(label,[]).append(row_hashes[index])
+
+            thresholds = {}
+            for label,hashes in label_hashes.items():
+                hashes = np.concatenate(hashes)
+                n_test = int(round(self.data_ingestion_config.test_size*len(hashes)))
+                thresholds[label] = np.partition(hashes,n_test)[n_test] if n_test<len(hashes) else np.iinfo(np.uint64).max
+            logging.info(f"Per class hash thresholds: {thresholds}")
+            return thresholds
+        except Exception as e:
+            raise SensorException(e, sys) from e
+
+    def hash_train_test_split(self,get_chunks,target_column:str,get_new_chunks=None) -> None:
+        """
+        Assign every row to train or test by a stable hash of its key while streaming chunks
+        get_chunks: callable returning a fresh iterator of dataframe chunks
+        target_column: str label used when the split is stratified
+        get_new_chunks: callable returning the chunks appended by this run, their train rows
+        are also written to new_train_file_path
+        """
+        try:
+            thresholds = None
+            if self.data_ingestion_config.split_stratify:
+                #a hash quantile per class matches the class ratio exactly, but rows near a
+                #threshold move partition when it shifts with new data
+                thresholds = self.get_stratified_hash_thresholds(get_chunks=get_chunks, target_column=target_column)
+            test_threshold = np.uint64(min(int(self.data_ingestion_config.test_size*2**64),2**64-1))
+
+            def get_is_test(chunk:pd.DataFrame) -> np.ndarray:
+                row_hashes = get_row_hashes(df=chunk, key_columns=self.data_ingestion_config.split_key_columns)
+                if thresholds is None:
+                    return row_hashes<test_threshold
+                return row_hashes<chunk[target_column].astype(object).map(thresholds).to_numpy(dtype=np.uint64)
+
+            with DataFrameChunkWriter(file_path=self.data_ingestion_config.train_file_path) as train_writer, \
+                DataFrameChunkWriter(file_path=self.data_ingestion_config.test_file_path) as test_writer:
+                for chunk in get_chunks():
+                    is_test = get_is_test(chunk=chunk)
+                    train_writer.write(df=chunk[~is_test])
+                    test_writer.write(df=chunk[is_test])
+            logging.info(f"Hash split wrote {train_writer.n_rows} train and {test_writer.n_rows} test rows")
+
+            if get_new_chunks is not None:
+                with DataFrameChunkWriter(file_path=self.data_ingestion_config.new_train_file_path) as new_train_writer:
+                    for chunk in get_new_chunks():
+                        new_train_writer.write(df=chunk[~get_is_test(chunk=chunk)])
+                logging.info(f"Hash split wrote {new_train_writer.n_rows} new train rows")
+        except Exception as e:
+            raise SensorException(e, sys) from e
+
+    def initiate_data_ingestion(self) -> DataIngestionArtifact:
+        try:
+            schema = load_schema(file_path=self.data_ingestion_config.schema_file_path)
+            target_column = schema.target_column
 
-            logging.info("Replacing na with NAN")
-            df.replace({"na":np.NAN},inplace=True)
+            get_new_chunks = None
+            if self.data_ingestion_config.incremental:
+                logging.info("Updating the local snapshot with new documents")
+                part_file_paths,new_part_file_paths = self.update_snapshot()
+                get_chunks = lambda: self.iter_snapshot_chunks(part_file_paths=part_file_paths)
+                if len(new_part_file_paths)>0:
+                    get_new_chunks = lambda: self.iter_snapshot_chunks(part_file_paths=new_part_file_paths)
+            else:
+                logging.info(f"Exporting collection as dataframe using {self.data_ingestion_config.export_mode} mode")
+                df = self.export_data()
 
-            logging.info("Splitting dataframe into train and test")
-            train_df,test_df = train_test_split(df,test_size=self.data_ingestion_config.test_size)
+                #the batched exports already apply the schema dtypes, this is a no-op cast then
+                logging.info("Applying schema dtypes")
+                df = convert_columns_float(df=df, dtypes=schema.dtypes, na_values=list(schema.na_values))
+                get_chunks = lambda: iter([df])
 
-            logging.info("Creating dataset directory")
-            os.makedirs(self.data_ingestion_config.dataset_dir,exist_ok=True)
+            if self.data_ingestion_config.split_mode=="hash":
+                logging.info("Splitting data into train and test by row hash")
+                self.hash_train_test_split(get_chunks=get_chunks, target_column=target_column,
+                    get_new_chunks=get_new_chunks)
+            else:
+                logging.info("Splitting dataframe into train and test")
+                df = pd.concat(get_chunks(), ignore_index=True)
+                train_df,test_df = train_test_split(df,test_size=self.data_ingestion_config.test_size,
+                    random_state=self.data_ingestion_config.random_state)
 
-            logging.info("Saving train and test file.")
-            train_df.to_csv(self.data_ingestion_config.train_file_path, index=False, header=True)
-            test_df.to_csv(self.data_ingestion_config.test_file_path, index=False, header=True)
+                logging.info(f"Saving train and test file as {self.data_ingestion_config.file_format}.")
+                write_dataframe(df=train_df, file_path=self.data_ingestion_config.train_file_path)
+                write_dataframe(df=test_df, file_path=self.data_ingestion_config.test_file_path)
 
             logging.info("Preparing data ingestion artifact")
             data_ingestion_artifact = DataIngestionArtifact(train_file_path=self.data_ingestion_config.train_file_path, 
-            test_file_path=self.data_ingestion_config.test_file_path)
+            test_file_path=self.data_ingestion_config.test_file_path,
+            file_format=self.data_ingestion_config.file_format,
+            new_train_file_path=self.data_ingestion_config.new_train_file_path \
+                if os.path.exists(self.data_ingestion_config.new_train_file_path) else None,
+            incremental=self.data_ingestion_config.incremental)
             logging.info(f"Data ingestion artifact: {data_ingestion_artifact}")
             return data_ingestion_artifact
         except Exception as e:
@@ -7,10 +7,17 @@ import os,sys
 from typing import Optional
 import numpy as np 
 import pandas as pd 
-from sensor.utils import read_yaml_file,save_object,save_numpy_array_data
+from sensor.utils import (save_object,load_object,save_transformed_data,read_dataframe,
+                          iter_dataframe_chunks,open_transformed_features,write_transformed_rows,
+                          save_transformed_target,read_yaml_file)
+from sensor.entity.schema_entity import load_schema
 from sklearn.pipeline import Pipeline
 from sklearn.preprocessing import LabelEncoder
-from imblearn.combine import SMOTETomek
+from sensor.ml.resampling import get_resampler,resample_in_chunks
+from sensor.ml.transform import FusedTransform,set_robust_scaler_quantiles
+from sensor.ml.stats import get_file_statistics,load_reference_profile
+from sensor.ml.drift import get_reference_drift_report
+from sensor.ml.model_resolver import ModelResolver
 from sklearn.impute import SimpleImputer
 from sklearn.preprocessing import RobustScaler
 from typing import Optional
@@ -42,14 +49,129 @@ class DataTransformation:
     
 
 
-    def initiate_data_transformation(self,) -> DataTransformationArtifact:
+    def transform_in_chunks(self,transformer,df:pd.DataFrame) -> np.ndarray:
+        """
+        Transform rows chunk by chunk into one preallocated C-contiguous float32 array,
+        so the transformer temporaries are bounded by the chunk size
+        """
+        try:
+            chunk_size = self.data_transformation_config.transform_chunk_size
+            transformed_arr = np.empty((len(df),len(df.columns)),dtype=np.float32)
+            for start in range(0,len(df),chunk_size):
+                transformed_arr[start:start+chunk_size] = transformer.transform(df.iloc[start:start+chunk_size])
+            return transformed_arr
+        except Exception as e:
+            raise SensorException(e, sys) from e
+
+    def fit_transformer_in_chunks(self,file_path:str,feature_columns:list,schema_info:dict=None) -> Pipeline:
+        """
+        Fit the transformation pipeline without loading the file: the imputer is fitted on the first chunk
+        and the scaler quantiles are read from sketches of the imputed chunks, merged across workers
+        """
+        try:
+            chunk_size = self.data_transformation_config.transform_chunk_size
+            first_df = next(iter_dataframe_chunks(file_path=file_path, chunk_size=chunk_size,
+                schema_info=schema_info, columns=feature_columns))
+            transformation_pipleine = DataTransformation.get_data_transformer_object()
+            transformation_pipleine.fit(first_df)
+
+            imputer,scaler = transformation_pipleine.named_steps["Imputer"],transformation_pipleine.named_steps["RobustScaler"]
+            fill_values = dict(zip(feature_columns,imputer.statistics_.astype(np.float64)))
+            statistics = get_file_statistics(file_path=file_path, chunk_size=chunk_size, columns=feature_columns,
+                n_workers=self.data_transformation_config.fit_n_workers,
+                sketch_size=self.data_transformation_config.fit_sketch_size,
+                fill_values=fill_values, schema_info=schema_info)
+            logging.info(f"Fitting scaler from sketches of {statistics.n_rows} rows")
+            set_robust_scaler_quantiles(scaler=scaler, statistics=statistics, feature_names=feature_columns)
+            return transformation_pipleine
+        except Exception as e:
+            raise SensorException(e, sys) from e
+
+    def read_target_column(self,file_path:str,target_column:str,schema_info:dict=None) -> pd.Series:
+        try:
+            return pd.concat(iter_dataframe_chunks(file_path=file_path,
+                chunk_size=self.data_transformation_config.transform_chunk_size,
+                schema_info=schema_info, columns=[target_column]))[target_column]
+        except Exception as e:
+            raise SensorException(e, sys) from e
+
+    def transform_file_in_chunks(self,transformer,file_path:str,feature_columns:list,n_rows:int,dir_path:str,
+        schema_info:dict=None) -> None:
+        """
+        Write the transformed features of a file chunk by chunk into the x.npy, or the shards, of dir_path
+        """
+        try:
+            shards = open_transformed_features(dir_path=dir_path, n_rows=n_rows, n_columns=len(feature_columns),
+                shard_rows=self.data_transformation_config.transform_shard_rows)
+            start = 0
+            for df in iter_dataframe_chunks(file_path=file_path,chunk_size=self.data_transformation_config.transform_chunk_size,
+                schema_info=schema_info,columns=feature_columns):
+                write_transformed_rows(shards=shards, start=start, arr=transformer.transform(df))
+                start+=len(df)
+            if start!=n_rows:
+                raise Exception(f"Expected {n_rows} rows in {file_path}, read {start}")
+            for _,shard in shards:
+                shard.flush()
+            del shards
+        except Exception as e:
+            raise SensorException(e, sys) from e
+
+    def get_resampling_params(self) -> dict:
+        """
+        get_resampler arguments of the configured resampling
+        """
+        return {
+            "strategy":self.data_transformation_config.resampling_strategy,
+            "random_state":self.data_transformation_config.random_state,
+            "n_jobs":self.data_transformation_config.resampling_n_jobs,
+            "k_neighbors":self.data_transformation_config.resampling_k_neighbors,
+            "sampling_strategy":self.data_transformation_config.resampling_sampling_strategy,
+        }
+
+    def get_unresampled_train_path(self) -> Optional[str]:
+        """
+        Directory of the train rows before resampling, None without resampling
+        """
+        if self.data_transformation_config.resampling_strategy=="none":
+            return None
+        return self.data_transformation_config.transform_unresampled_train_path
+
+    def resample_train_data(self,input_feature_train_arr:np.ndarray,target_feature_train_arr:np.ndarray):
+        try:
+            logging.info(f"Balancing imbalance dataset with {self.data_transformation_config.resampling_strategy} resampling")
+            resampler = get_resampler(**self.get_resampling_params())
+
+            #only the training set is rebalanced, the test set keeps the real class ratio
+            if resampler is not None:
+                logging.info(f"Before resampling in training set Input: {input_feature_train_arr.shape} Target:{target_feature_train_arr.shape}")
+                input_feature_train_arr, target_feature_train_arr = resampler.fit_resample(input_feature_train_arr, target_feature_train_arr)
+                logging.info(f"After resampling in training set Input: {input_feature_train_arr.shape} Target:{target_feature_train_arr.shape}")
+            return input_feature_train_arr,target_feature_train_arr
+        except Exception as e:
+            raise SensorException(e, sys) from e
+
+    def resample_train_dir(self,train_dir:str) -> None:
+        """
+        Resample the transformed train rows of train_dir into transform_train_path batch by batch,
+        see sensor.ml.resampling.resample_in_chunks
+        """
+        try:
+            config = self.data_transformation_config
+            logging.info(f"Balancing imbalance dataset with {config.resampling_strategy} resampling "
+                f"in batches of {config.resampling_batch_rows} rows")
+            n_rows = resample_in_chunks(dir_path=train_dir, output_dir=config.transform_train_path,
+                batch_rows=config.resampling_batch_rows, shard_rows=config.transform_shard_rows,
+                **self.get_resampling_params())
+            logging.info(f"After resampling the training set has {n_rows} rows")
+        except Exception as e:
+            raise SensorException(e, sys) from e
+
+    def transform_in_memory(self,target_column:str,schema_info:dict):
         try:
-            schema_info = read_yaml_file(file_path=self.data_transformation_config.schema_file_path)
-            target_column = schema_info["target_column"]
             #reading training and testing file
             logging.info("reading training and testing file")
-            train_df = pd.read_csv(self.data_validation_artifact.train_file_path)
-            test_df = pd.read_csv(self.data_validation_artifact.test_file_path)
+            train_df = read_dataframe(file_path=self.data_validation_artifact.train_file_path, schema_info=schema_info)
+            test_df = read_dataframe(file_path=self.data_validation_artifact.test_file_path, schema_info=schema_info)
 
             logging.info("selecting input feature for train and test dataframe")
             input_feature_train_df=train_df.drop(target_column,axis=1)
@@ -72,42 +194,220 @@ class DataTransformation:
             transformation_pipleine.fit(input_feature_train_df)
 
 
+            logging.info("Compiling fitted pipeline into a fused transform")
+            fused_transformer = FusedTransform.from_pipeline(pipeline=transformation_pipleine)
+
             logging.info("Transforming input features")
-            input_feature_train_arr = transformation_pipleine.transform(input_feature_train_df)
-            input_feature_test_arr = transformation_pipleine.transform(input_feature_test_df)
+            input_feature_train_arr = self.transform_in_chunks(transformer=fused_transformer, df=input_feature_train_df)
+            input_feature_test_arr = self.transform_in_chunks(transformer=fused_transformer, df=input_feature_test_df)
 
-            logging.info("Balancing imbalance dataset")
-            smt = SMOTETomek(random_state=42)
+            if self.get_unresampled_train_path() is not None:
+                save_transformed_data(dir_path=self.get_unresampled_train_path(),
+                    input_feature_arr=input_feature_train_arr, target_feature_arr=target_feature_train_arr,
+                    shard_rows=self.data_transformation_config.transform_shard_rows)
+            input_feature_train_arr,target_feature_train_arr = self.resample_train_data(
+                input_feature_train_arr=input_feature_train_arr, target_feature_train_arr=target_feature_train_arr)
 
-            logging.info(f"Before resampling in training set Input: {input_feature_train_arr.shape} Target:{target_feature_train_arr.shape}")
-            input_feature_train_arr, target_feature_train_arr = smt.fit_resample(input_feature_train_arr, target_feature_train_arr)
-            logging.info(f"After resampling in training set Input: {input_feature_train_arr.shape} Target:{target_feature_train_arr.shape}")
+            logging.info("Saving data")
+            save_transformed_data(dir_path=self.data_transformation_config.transform_train_path,
+                input_feature_arr=input_feature_train_arr, target_feature_arr=target_feature_train_arr,
+                shard_rows=self.data_transformation_config.transform_shard_rows)
+            save_transformed_data(dir_path=self.data_transformation_config.transform_test_path,
+                input_feature_arr=input_feature_test_arr, target_feature_arr=target_feature_test_arr,
+                shard_rows=self.data_transformation_config.transform_shard_rows)
+            return transformation_pipleine,fused_transformer,label_encoder
+        except Exception as e:
+            raise SensorException(e, sys) from e
+
+    def transform_streaming(self,target_column:str,schema_info:dict):
+        """
+        Fit and transform without holding a data file in memory, only the labels are kept
+        """
+        try:
+            train_file_path = self.data_validation_artifact.train_file_path
+            test_file_path = self.data_validation_artifact.test_file_path
+
+            logging.info("Converting target cat column into numerical column using label encoder")
+            target_feature_train_df = self.read_target_column(file_path=train_file_path, target_column=target_column,
+                schema_info=schema_info)
+            target_feature_test_df = self.read_target_column(file_path=test_file_path, target_column=target_column,
+                schema_info=schema_info)
+            label_encoder = LabelEncoder()
+            label_encoder.fit(target_feature_train_df)
+            target_feature_train_arr = label_encoder.transform(target_feature_train_df).astype(np.int8)
+            target_feature_test_arr = label_encoder.transform(target_feature_test_df).astype(np.int8)
 
-            logging.info(f"Before resampling in testing set Input: {input_feature_test_arr.shape} Target:{target_feature_test_arr.shape}")
-            input_feature_test_arr, target_feature_test_arr = smt.fit_resample(input_feature_test_arr, target_feature_test_arr)
-            logging.info(f"After resampling in testing set Input: {input_feature_test_arr.shape} Target:{target_feature_test_arr.shape}")
+            first_df = next(iter_dataframe_chunks(file_path=train_file_path, chunk_size=1, schema_info=schema_info))
+            feature_columns = [column for column in first_df.columns if column!=target_column]
+            logging.info(f"Fitting transformation pipeline in chunks of {self.data_transformation_config.transform_chunk_size} rows")
+            transformation_pipleine = self.fit_transformer_in_chunks(file_path=train_file_path,
+                feature_columns=feature_columns, schema_info=schema_info)
 
-            train_arr = np.c_[input_feature_train_arr, target_feature_train_arr ]
-            test_arr = np.c_[input_feature_test_arr, target_feature_test_arr]
+            logging.info("Compiling fitted pipeline into a fused transform")
+            fused_transformer = FusedTransform.from_pipeline(pipeline=transformation_pipleine)
 
-            logging.info("Saving data")
-            save_numpy_array_data(file_path=self.data_transformation_config.transform_train_path, array=train_arr)
-            save_numpy_array_data(file_path=self.data_transformation_config.transform_test_path, array=train_arr)
+            logging.info("Transforming input features in chunks")
+            #with resampling the train rows are written as they are and resampled into transform_train_path below
+            train_dir = self.get_unresampled_train_path() or self.data_transformation_config.transform_train_path
+            for file_path,dir_path,target_feature_arr in (
+                (train_file_path,train_dir,target_feature_train_arr),
+                (test_file_path,self.data_transformation_config.transform_test_path,target_feature_test_arr)):
+                self.transform_file_in_chunks(transformer=fused_transformer, file_path=file_path,
+                    feature_columns=feature_columns, n_rows=len(target_feature_arr), dir_path=dir_path,
+                    schema_info=schema_info)
+                save_transformed_target(dir_path=dir_path, target_feature_arr=target_feature_arr,
+                    shard_rows=self.data_transformation_config.transform_shard_rows)
+
+            if self.data_transformation_config.resampling_strategy!="none":
+                self.resample_train_dir(train_dir=train_dir)
+            return transformation_pipleine,fused_transformer,label_encoder
+        except Exception as e:
+            raise SensorException(e, sys) from e
+
+    def get_training_kind(self,schema_info:dict=None) -> tuple:
+        """
+        Decide between a full retrain, an incremental run on the new train rows and reusing
+        the registry model when there are no new train rows
+        return: tuple of "full", "incremental" or "reuse", incremental runs since the last full retrain
+        and the registry model metadata to continue or reuse (None for a full retrain)
+        """
+        try:
+            config = self.data_transformation_config
+            if not config.incremental:
+                return "full",0,None
+            model_resolver = ModelResolver(model_registry=config.model_registry)
+            if model_resolver.get_latest_dir_path() is None:
+                logging.info("No registry model to continue, running a full retrain")
+                return "full",0,None
+
+            metadata_path = model_resolver.get_latest_metadata_path()
+            metadata = read_yaml_file(file_path=metadata_path) if os.path.exists(metadata_path) else {}
+            metadata["metadata_path"] = metadata_path
+            metadata["model_path"] = model_resolver.get_latest_model_path()
+            metadata["transformer_path"] = model_resolver.get_latest_transformer_path()
+            metadata["fused_transformer_path"] = model_resolver.get_latest_fused_transformer_path()
+            metadata["target_encoder_path"] = model_resolver.get_latest_target_encoder_path()
+            if self.data_validation_artifact.new_train_file_path is None:
+                if not self.data_validation_artifact.incremental:
+                    #a full export has no notion of new rows, the registry model may not have seen any of it
+                    logging.info("Data was not ingested incrementally, running a full retrain")
+                    return "full",0,None
+                #nothing was trained on, so the cadence does not advance either
+                logging.info("No new train rows, reusing the registry model")
+                return "reuse",metadata.get("incremental_runs",0),metadata
+
+            incremental_runs = metadata.get("incremental_runs",0)+1
+            if incremental_runs>=config.full_retrain_every:
+                logging.info(f"{incremental_runs-1} incremental runs since the last full retrain, running a full retrain")
+                return "full",0,None
+
+            reference_profile_path = model_resolver.get_latest_reference_profile_path()
+            if not os.path.exists(reference_profile_path):
+                logging.info("No registry reference profile to check the new rows against, running a full retrain")
+                return "full",0,None
+            drift_report = get_reference_drift_report(
+                reference_statistics=load_reference_profile(file_path=reference_profile_path),
+                data=iter_dataframe_chunks(file_path=self.data_validation_artifact.new_train_file_path,
+                    chunk_size=config.transform_chunk_size, schema_info=schema_info),
+                method=config.refit_drift_method, threshold=config.refit_drift_threshold)
+            drifted_share = np.mean([not result["same_distribution"] for result in drift_report.values()])
+            logging.info(f"{drifted_share:.1%} of the columns of the new train rows drifted from the registry profile")
+            if drifted_share>config.refit_drifted_share:
+                logging.info("Refitting the transformer, running a full retrain")
+                return "full",0,None
+
+            return "incremental",incremental_runs,metadata
+        except Exception as e:
+            raise SensorException(e, sys) from e
+
+    def transform_incremental(self,target_column:str,schema_info:dict,base_metadata:dict):
+        """
+        Transform the new train rows and the test set with the registry transformer,
+        the cost grows with the new rows and the test set only
+        """
+        try:
+            logging.info(f"Reusing the registry transformer: {base_metadata['transformer_path']}")
+            transformation_pipleine = load_object(file_path=base_metadata["transformer_path"])
+            fused_transformer = FusedTransform.from_pipeline(pipeline=transformation_pipleine)
+            label_encoder = load_object(file_path=base_metadata["target_encoder_path"])
+            feature_columns = list(transformation_pipleine.feature_names_in_)
+
+            train_dir = self.get_unresampled_train_path() or self.data_transformation_config.transform_train_path
+            for file_path,dir_path in (
+                (self.data_validation_artifact.new_train_file_path,train_dir),
+                (self.data_validation_artifact.test_file_path,self.data_transformation_config.transform_test_path)):
+                target_feature_arr = label_encoder.transform(self.read_target_column(file_path=file_path,
+                    target_column=target_column, schema_info=schema_info)).astype(np.int8)
+                self.transform_file_in_chunks(transformer=fused_transformer, file_path=file_path,
+                    feature_columns=feature_columns, n_rows=len(target_feature_arr), dir_path=dir_path,
+                    schema_info=schema_info)
+                save_transformed_target(dir_path=dir_path, target_feature_arr=target_feature_arr,
+                    shard_rows=self.data_transformation_config.transform_shard_rows)
+
+            if self.data_transformation_config.resampling_strategy!="none":
+                self.resample_train_dir(train_dir=train_dir)
+            return transformation_pipleine,fused_transformer,label_encoder
+        except Exception as e:
+            raise SensorException(e, sys) from e
+
+    def initiate_data_transformation(self,) -> DataTransformationArtifact:
+        try:
+            schema = load_schema(file_path=self.data_transformation_config.schema_file_path)
+            target_column = schema.target_column
+
+            training_kind,incremental_runs,base_metadata = self.get_training_kind(schema_info=schema.schema_info)
+            logging.info(f"Training kind: {training_kind}")
+
+            if training_kind=="reuse":
+                fused_transform_object_path = base_metadata["fused_transformer_path"]
+                data_transformation_artifact = DataTransformationArtifact(
+                    transform_object_path=base_metadata["transformer_path"],
+                    transform_train_path=self.data_transformation_config.transform_train_path,
+                    transform_test_path=self.data_transformation_config.transform_test_path,
+                    target_encoder_path=base_metadata["target_encoder_path"],
+                    resampling_strategy=self.data_transformation_config.resampling_strategy,
+                    fused_transform_object_path=fused_transform_object_path if os.path.exists(fused_transform_object_path) else None,
+                    training_kind=training_kind,
+                    base_model_path=base_metadata["model_path"],
+                    base_params=base_metadata.get("params"),
+                    base_metadata_path=base_metadata["metadata_path"],
+                    incremental_runs=incremental_runs)
+                logging.info(f"Data transformation artifact: {data_transformation_artifact}")
+                return data_transformation_artifact
+
+            if training_kind=="incremental":
+                transformation_pipleine,fused_transformer,label_encoder = self.transform_incremental(
+                    target_column=target_column, schema_info=schema.schema_info, base_metadata=base_metadata)
+            elif self.data_transformation_config.fit_mode=="streaming":
+                transformation_pipleine,fused_transformer,label_encoder = self.transform_streaming(
+                    target_column=target_column, schema_info=schema.schema_info)
+            else:
+                transformation_pipleine,fused_transformer,label_encoder = self.transform_in_memory(
+                    target_column=target_column, schema_info=schema.schema_info)
 
             logging.info("Save label encoder")
             save_object(file_path=self.data_transformation_config.target_encoder_path, obj=label_encoder)
 
             logging.info("Save transformation pipeline")
             save_object(file_path=self.data_transformation_config.transform_object_path, obj=transformation_pipleine)
+            save_object(file_path=self.data_transformation_config.fused_transform_object_path, obj=fused_transformer)
 
             data_transformation_artifact = DataTransformationArtifact(
                 transform_object_path=self.data_transformation_config.transform_object_path, 
                 transform_train_path=self.data_transformation_config.transform_train_path,
                 transform_test_path=self.data_transformation_config.transform_test_path,
-                target_encoder_path=self.data_transformation_config.target_encoder_path)
+                target_encoder_path=self.data_transformation_config.target_encoder_path,
+                resampling_strategy=self.data_transformation_config.resampling_strategy,
+                fused_transform_object_path=self.data_transformation_config.fused_transform_object_path,
+                transform_unresampled_train_path=self.get_unresampled_train_path(),
+                resampling_params=None if self.get_unresampled_train_path() is None else self.get_resampling_params(),
+                training_kind=training_kind,
+                base_model_path=None if base_metadata is None else base_metadata["model_path"],
+                base_params=None if base_metadata is None else base_metadata.get("params"),
+                base_metadata_path=None if base_metadata is None else base_metadata["metadata_path"],
+                incremental_runs=incremental_runs)
             logging.info(f"Data transformation artifact: {data_transformation_artifact}")
             return data_transformation_artifact
         except Exception as e:
             raise SensorException(e, sys) from e
     
-
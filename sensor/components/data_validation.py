@@ -3,12 +3,13 @@ from sensor.entity.config_entity import DataValidationConfig
 from sensor.entity.artifact_entity import DataIngestionArtifact,DataValidationArtifact
 from sensor.logger import logging
 from sensor.exception import SensorException
-import os,sys 
+import sys 
 from typing import Optional
-import numpy as np 
 import pandas as pd 
-from sensor.utils import read_yaml_file,write_yaml_file
-from scipy.stats import ks_2samp
+from sensor.utils import write_yaml_file,read_dataframe,write_dataframe,iter_dataframe_chunks,DataFrameChunkWriter
+from sensor.entity.schema_entity import load_schema
+from sensor.ml.drift import get_drift_report,get_sketch_drift_report
+from sensor.ml.stats import ColumnStatistics,save_reference_profile
 class DataValidation:
 
 
@@ -20,122 +21,218 @@ class DataValidation:
             self.data_validation_config=data_validation_config
             self.data_ingestion_artifact=data_ingestion_artifact
             self.validation_error = {}
+            self.schema = load_schema(file_path=self.data_validation_config.schema_file_path)
         except Exception as e:
             raise SensorException(e, sys) from e
 
-    def drop_missing_values_columns(self,df:pd.DataFrame,report_key_name:str) -> Optional[pd.DataFrame]:
+    def apply_validation_report(self,validation_report:dict,columns:list,report_key_prefix:str) -> list:
+        """
+        Record a schema validation report and decide which columns are kept
+        return: kept column names, raises when none is left or a required column is missing
+        """
         try:
             threshold = self.data_validation_config.missing_thresold
-            null_report = (df.isna().sum()*100)/df.shape[0]
-            logging.info(f"selecting column name which contains null above to {threshold}")
-            drop_column_names = null_report[null_report>threshold].index
-            logging.info(f"Columns to drop: {list(drop_column_names)}")
-            self.validation_error[report_key_name]=list(drop_column_names)
-            df.drop(list(drop_column_names),axis=1,inplace=True)
-
-            return None if len(df.columns)==0 else df
+            drop_column_names = validation_report["missing_values_columns"]
+            logging.info(f"Columns with null above {threshold} to drop: {drop_column_names}")
+            self.validation_error[f"{report_key_prefix}_missing_values_columns"]=drop_column_names
+            for key_name in ("invalid_dtype_columns","out_of_range_columns"):
+                if validation_report[key_name]:
+                    logging.info(f"{report_key_prefix} {key_name}: {validation_report[key_name]}")
+                    self.validation_error[f"{report_key_prefix}_{key_name}"]=validation_report[key_name]
+
+            kept_columns = [column for column in columns if column not in drop_column_names]
+            if len(kept_columns)==0:
+                logging.info(f"No column left in {report_key_prefix} df hence stopping this pipeline")
+                raise Exception(f"No column left in {report_key_prefix} df hence stopping this pipeline")
+
+            missing_required_column = validation_report["missing_required_columns"]
+            if missing_required_column:
+                logging.info(f"Missing required columns are  {missing_required_column}")
+                self.validation_error[f"{report_key_prefix}_required_column"]=missing_required_column
+                raise Exception(f"Required columns are not available in {report_key_prefix} df")
+            return kept_columns
         except Exception as e:
             raise SensorException(e, sys) from e
 
-    def is_required_columns_exists(self,df:pd.DataFrame,report_key_name:str) -> bool:
+    def validate_dataframe(self,df:pd.DataFrame,report_key_prefix:str) -> Optional[pd.DataFrame]:
+        """
+        Check required columns, the missing value threshold and dtypes in one pass
+        and drop the columns with too many missing values
+        """
         try:
-            schema_info = read_yaml_file(file_path=self.data_validation_config.schema_file_path)
-            requried_columns = schema_info["required_columns"]
-            logging.info(f"Required columns: {requried_columns}")
-            missing_required_column = [
-                column for column in requried_columns if column not in df.columns
-            ]
-            if not missing_required_column:
-                return True
-            logging.info(f"Missing required columns are  {missing_required_column}")
-            self.validation_error[report_key_name]=missing_required_column
-            return False
+            validation_report = self.schema.validate(df=df, missing_threshold=self.data_validation_config.missing_thresold)
+            kept_columns = self.apply_validation_report(validation_report=validation_report,
+                columns=list(df.columns), report_key_prefix=report_key_prefix)
+            df.drop([column for column in df.columns if column not in kept_columns],axis=1,inplace=True)
+            return df
+        except Exception as e:
+            raise SensorException(e, sys) from e
+
+    def get_column_statistics(self,file_path:str) -> ColumnStatistics:
+        """
+        Read a file chunk by chunk and merge the statistics of every column left after the schema drop columns
+        """
+        try:
+            statistics = ColumnStatistics(sketch_size=self.data_validation_config.sketch_size)
+            for df in iter_dataframe_chunks(file_path=file_path,chunk_size=self.data_validation_config.chunk_size,
+                schema_info=self.schema.schema_info):
+                statistics.update(df=self.drop_columns(df=df))
+            logging.info(f"Collected statistics of {statistics.n_rows} rows and {len(statistics.columns)} columns from {file_path}")
+            return statistics
         except Exception as e:
             raise SensorException(e, sys) from e
 
+    def validate_statistics(self,statistics:ColumnStatistics,report_key_prefix:str) -> list:
+        try:
+            validation_report = self.schema.validate_statistics(statistics=statistics,
+                missing_threshold=self.data_validation_config.missing_thresold)
+            return self.apply_validation_report(validation_report=validation_report,
+                columns=statistics.columns, report_key_prefix=report_key_prefix)
+        except Exception as e:
+            raise SensorException(e, sys) from e
+
+    def write_valid_chunks(self,file_path:str,valid_file_path:str,columns:list) -> int:
+        """
+        Copy the kept columns of a file to the valid directory chunk by chunk
+        return: int number of rows written
+        """
+        try:
+            with DataFrameChunkWriter(file_path=valid_file_path) as writer:
+                for df in iter_dataframe_chunks(file_path=file_path,chunk_size=self.data_validation_config.chunk_size,
+                    schema_info=self.schema.schema_info,columns=columns):
+                    writer.write(df=df)
+            return writer.n_rows
+        except Exception as e:
+            raise SensorException(e, sys) from e
+
+    def get_drift_threshold(self) -> float:
+        return {
+            "ks":self.data_validation_config.drift_pvalue_threshold,
+            "psi":self.data_validation_config.psi_threshold,
+            "wasserstein":self.data_validation_config.wasserstein_threshold,
+        }[self.data_validation_config.drift_method]
+
     def data_drift(self,base_df:pd.DataFrame,current_df:pd.DataFrame,report_key_name) -> None:
         try:
-            drift_report = {}
-            base_columns = base_df.columns
-            current_columns = current_df.columns
-
-            for base_column in base_columns:
-                base_data,current_data = base_df[base_column],current_df[base_column]
-                logging.info(f"Hypothesis {base_column}: {base_data.dtype}, {current_data.dtype} ")
-                same_distribution =ks_2samp(base_data,current_data)
-
-                if same_distribution.pvalue>0.05:
-                    #We are accepting null hypothesis
-                    drift_report[base_column]={
-                        "pvalues":float(same_distribution.pvalue),
-                        "same_distribution": True
-                    }
-                else:
-                    drift_report[base_column]={
-                        "pvalues":float(same_distribution.pvalue),
-                        "same_distribution":False
-                    }
-                    #different distribution
+            drift_report = get_drift_report(base_df=base_df, current_df=current_df[base_df.columns],
+                method=self.data_validation_config.drift_method,
+                threshold=self.get_drift_threshold(),
+                n_jobs=self.data_validation_config.drift_n_jobs,
+                block_size=self.data_validation_config.drift_block_size,
+                sample_size=self.data_validation_config.drift_sample_size,
+                random_state=self.data_validation_config.drift_random_state)
+            drifted_columns = [column for column,result in drift_report.items() if not result["same_distribution"]]
+            logging.info(f"Columns with a different distribution: {drifted_columns}")
+            self.validation_error[report_key_name]=drift_report
+        except Exception as e:
+            raise SensorException(e, sys) from e
+
+    def data_drift_from_statistics(self,base_statistics:ColumnStatistics,current_statistics:ColumnStatistics,
+        columns:list,report_key_name) -> None:
+        try:
+            drift_report = get_sketch_drift_report(base_statistics=base_statistics,current_statistics=current_statistics,
+                method=self.data_validation_config.drift_method,threshold=self.get_drift_threshold())
+            drift_report = {column:result for column,result in drift_report.items() if column in columns}
+            drifted_columns = [column for column,result in drift_report.items() if not result["same_distribution"]]
+            logging.info(f"Columns with a different distribution: {drifted_columns}")
             self.validation_error[report_key_name]=drift_report
         except Exception as e:
             raise SensorException(e, sys) from e
 
+    def save_reference_profile(self,statistics:ColumnStatistics) -> None:
+        try:
+            logging.info(f"Saving reference profile of {len(statistics.numeric_columns)} numeric columns")
+            save_reference_profile(statistics=statistics,file_path=self.data_validation_config.reference_profile_path,
+                n_bins=self.data_validation_config.reference_histogram_bins)
+        except Exception as e:
+            raise SensorException(e, sys) from e
+
     def drop_columns(self,df:pd.DataFrame)->pd.DataFrame:
         try:
-            schema_info = read_yaml_file(file_path=self.data_validation_config.schema_file_path)
-            drop_columns = schema_info["drop_columns"]
+            #columns may already be projected out during ingestion
+            drop_columns = [column for column in df.columns if column in self.schema.drop_columns]
             logging.info(f"Dropping column based on schema provided: {drop_columns}")
             df.drop(drop_columns,axis=1,inplace=True)
             return df
         except Exception as e:
             raise e
 
-    def initiate_data_validation(self) -> DataValidationArtifact:
+    def validate_in_chunks(self) -> None:
+        """
+        Validate train and test with one pass statistics and write the valid files chunk by chunk,
+        memory depends on the chunk size and not on the number of rows
+        """
         try:
-            train_df = pd.read_csv(self.data_ingestion_artifact.train_file_path)
-            test_df = pd.read_csv(self.data_ingestion_artifact.test_file_path)
+            train_statistics = self.get_column_statistics(file_path=self.data_ingestion_artifact.train_file_path)
+            test_statistics = self.get_column_statistics(file_path=self.data_ingestion_artifact.test_file_path)
 
-            train_df = self.drop_columns(df=train_df)
-            test_df = self.drop_columns(df=test_df)
+            train_columns = self.validate_statistics(statistics=train_statistics, report_key_prefix="train")
+            test_columns = self.validate_statistics(statistics=test_statistics, report_key_prefix="test")
 
-            train_df = self.drop_missing_values_columns(df=train_df, report_key_name="train_missing_values_columns")
-            test_df = self.drop_missing_values_columns(df=test_df, report_key_name="test_missing_values_columns")
+            if len(train_columns)!=len(test_columns):
+                raise Exception("Train and test df does not have equal columns")
 
+            self.data_drift_from_statistics(base_statistics=train_statistics, current_statistics=test_statistics,
+                columns=train_columns, report_key_name="train_test_drift")
+            self.save_reference_profile(statistics=train_statistics.select(columns=train_columns))
 
-            if train_df is None:
-                logging.info("No column left in train df hence stopping this pipeline")
-                raise Exception("No column left in train df hence stopping this pipeline")
+            write_yaml_file(file_path=self.data_validation_config.report_file_name, data=self.validation_error)
 
+            self.write_valid_chunks(file_path=self.data_ingestion_artifact.train_file_path,
+                valid_file_path=self.data_validation_config.valid_train_file_path, columns=train_columns)
+            self.write_valid_chunks(file_path=self.data_ingestion_artifact.test_file_path,
+                valid_file_path=self.data_validation_config.valid_test_file_path, columns=test_columns)
+            if self.data_ingestion_artifact.new_train_file_path is not None:
+                self.write_valid_chunks(file_path=self.data_ingestion_artifact.new_train_file_path,
+                    valid_file_path=self.data_validation_config.valid_new_train_file_path, columns=train_columns)
+        except Exception as e:
+            raise SensorException(e, sys) from e
 
-            if test_df is None:
-                logging.info("No column left in test df hence stopping this pipeline")
-                raise Exception("No column left in test df hence stopping this pipeline")
+    def validate_in_memory(self) -> None:
+        try:
+            train_df = read_dataframe(file_path=self.data_ingestion_artifact.train_file_path, schema_info=self.schema.schema_info)
+            test_df = read_dataframe(file_path=self.data_ingestion_artifact.test_file_path, schema_info=self.schema.schema_info)
 
-            is_exists = self.is_required_columns_exists(df=train_df, report_key_name="train_required_column")
-            if not is_exists:
-                raise Exception("Required columns are not available in train df")
+            train_df = self.drop_columns(df=train_df)
+            test_df = self.drop_columns(df=test_df)
 
-            is_exists = self.is_required_columns_exists(df=test_df, report_key_name="train_required_column")
-            if not is_exists:
-                raise Exception("Required columns are not available in test df")
+            train_df = self.validate_dataframe(df=train_df, report_key_prefix="train")
+            test_df = self.validate_dataframe(df=test_df, report_key_prefix="test")
 
             if len(train_df.columns)!=len(test_df.columns):
                 raise Exception("Train and test df does not have equal columns")
 
             self.data_drift(base_df=train_df, current_df=test_df, report_key_name="train_test_drift")
+            self.save_reference_profile(statistics=ColumnStatistics(sketch_size=self.data_validation_config.sketch_size).update(df=train_df))
 
             write_yaml_file(file_path=self.data_validation_config.report_file_name, data=self.validation_error)
 
-            os.makedirs(self.data_validation_config.valid_dir,exist_ok=True)
+            write_dataframe(df=train_df, file_path=self.data_validation_config.valid_train_file_path)
+            write_dataframe(df=test_df, file_path=self.data_validation_config.valid_test_file_path)
+            if self.data_ingestion_artifact.new_train_file_path is not None:
+                new_train_df = read_dataframe(file_path=self.data_ingestion_artifact.new_train_file_path,
+                    schema_info=self.schema.schema_info)
+                write_dataframe(df=new_train_df[train_df.columns], file_path=self.data_validation_config.valid_new_train_file_path)
+        except Exception as e:
+            raise SensorException(e, sys) from e
 
-            train_df.to_csv(self.data_validation_config.valid_train_file_path, header=True,index=False)
-            test_df.to_csv(self.data_validation_config.valid_test_file_path, header=True,index=False)
+    def initiate_data_validation(self) -> DataValidationArtifact:
+        try:
+            if self.data_validation_config.validation_mode=="chunked":
+                self.validate_in_chunks()
+            else:
+                self.validate_in_memory()
 
             return DataValidationArtifact(
                 report_file_path=self.data_validation_config.report_file_name,
                 train_file_path=self.data_validation_config.valid_train_file_path,
                 test_file_path=self.data_validation_config.valid_test_file_path,
                 status=True,
+                file_format=self.data_validation_config.file_format,
+                reference_profile_path=self.data_validation_config.reference_profile_path,
+                new_train_file_path=None if self.data_ingestion_artifact.new_train_file_path is None \
+                    else self.data_validation_config.valid_new_train_file_path,
+                incremental=self.data_ingestion_artifact.incremental,
             )
         except Exception as e:
             raise SensorException(e, sys) from e
@@ -3,10 +3,10 @@ from sensor.entity.artifact_entity import DataValidationArtifact,DataTransformat
 from sensor.logger import logging
 from sensor.exception import SensorException
 import os,sys 
-from sklearn.metrics import f1_score
-from sensor.utils import read_yaml_file,load_object
+from sensor.utils import read_dataframe,write_yaml_file
+from sensor.entity.schema_entity import load_schema
 from sensor.ml.model_resolver import ModelResolver
-import pandas as pd
+from sensor.ml.evaluation import evaluate_candidates,save_evaluation_cache
 class ModelEvaluation:
     
     def __init__(self,
@@ -24,68 +24,94 @@ class ModelEvaluation:
         except Exception as e:
             raise SensorException(e, sys) from e   
 
+    def get_candidates(self) -> list:
+        """
+        The current model, the latest registry versions (newest first) and the challengers
+        """
+        try:
+            candidates = [{
+                "name":"current",
+                "model_path":self.model_trainer_artifact.model_path,
+                "transformer_path":self.data_transformation_artifact.transform_object_path,
+                "fused_transformer_path":self.data_transformation_artifact.fused_transform_object_path,
+                "target_encoder_path":self.data_transformation_artifact.target_encoder_path,
+            }]
+            for dir_path in self.model_resolver.get_dir_paths()[:self.model_eval_config.n_registry_candidates]:
+                candidates.append(dict(self.model_resolver.get_object_paths(dir_path=dir_path),
+                    name=f"registry/{os.path.basename(dir_path)}"))
+            for dir_path in self.model_eval_config.challenger_dirs:
+                candidates.append(dict(self.model_resolver.get_object_paths(dir_path=dir_path),
+                    name=f"challenger/{dir_path}"))
+            return candidates
+        except Exception as e:
+            raise SensorException(e, sys) from e
+
     def initiate_model_evaluation(self) -> ModelEvaluationArtifact:
         try:
             
-            logging.info("if saved model folder has model the we will compare "
-            "which model is best trained or the model from saved model folder")
-            latest_dir_path = self.model_resolver.get_latest_dir_path()
-            if latest_dir_path is None:
-                model_eval_artifact = ModelEvaluationArtifact(is_model_accepted=True,
-                improved_accuracy=None)
+            if self.data_transformation_artifact.training_kind=="reuse":
+                logging.info("Registry model reused without new train rows, nothing to evaluate or push")
+                model_eval_artifact = ModelEvaluationArtifact(is_model_accepted=False, improved_accuracy=None)
                 logging.info(f"Model evaluation artifact: {model_eval_artifact}")
                 return model_eval_artifact
 
-            #Finding location of transformer, model and target encoder
-            logging.info("Finding location of transformer model and target encoder")
-            transformer_path = self.model_resolver.get_latest_transformer_path()
-            model_path = self.model_resolver.get_latest_model_path()
-            target_encoder_path = self.model_resolver.get_latest_target_encoder_path()
-
-
-            logging.info("Previous trained objects of transformer, model and target encoder")
-            #Previous trained  objects
-            transformer = load_object(file_path=transformer_path)
-            model = load_object(file_path=model_path)
-            target_encoder = load_object(file_path=target_encoder_path)
-
+            logging.info("if saved model folder has model the we will compare "
+            "which model is best trained or the model from saved model folder")
+            dir_paths = self.model_resolver.get_dir_paths()
+            latest_dir_path = dir_paths[0] if len(dir_paths) else None
+            #with an empty registry only the current model is scored, to cache its score for the next run
+            candidates = self.get_candidates() if latest_dir_path is not None else self.get_candidates()[:1]
+            logging.info(f"Scoring candidates: {[candidate['name'] for candidate in candidates]}")
 
-            logging.info("Currently trained model objects")
-            current_transformer = load_object(file_path=self.data_transformation_artifact.transform_object_path)
-            current_model  = load_object(file_path=self.model_trainer_artifact.model_path)
-            current_target_encoder = load_object(file_path=self.data_transformation_artifact.target_encoder_path)
+            schema = load_schema(file_path=self.model_eval_config.schema_file_path)
+            test_df = read_dataframe(file_path=self.data_validation_artifact.test_file_path, schema_info=schema.schema_info)
+            leaderboard,predictions = evaluate_candidates(candidates=candidates, test_df=test_df,
+                target_column=schema.target_column, n_workers=self.model_eval_config.n_workers,
+                threads_per_candidate=self.model_eval_config.threads_per_candidate)
+            write_yaml_file(file_path=self.model_eval_config.leaderboard_file_path, data={"leaderboard":leaderboard})
+            for entry in leaderboard:
+                logging.info(f"{entry['rank']}. {entry['name']} f1: {entry['f1_score']} "
+                f"({entry['scored_rows']} rows scored)")
 
-            test_df = pd.read_csv(self.data_validation_artifact.test_file_path)
-            schema_info = read_yaml_file(file_path=self.model_eval_config.schema_file_path)
-            target_column = schema_info['target_column']
+            #cache what was scored, registry versions and challengers in their own directory
+            entries = {entry["name"]:entry for entry in leaderboard}
+            for candidate in candidates:
+                if candidate["name"] not in predictions:
+                    continue
+                row_hashes,y_pred = predictions[candidate["name"]]
+                if candidate["name"]=="current":
+                    metadata_path = self.model_eval_config.metadata_file_path
+                    rows_path = self.model_eval_config.evaluation_rows_file_path
+                else:
+                    metadata_path,rows_path = candidate["metadata_path"],candidate["evaluation_rows_path"]
+                save_evaluation_cache(metadata_path=metadata_path, rows_path=rows_path,
+                entry=entries[candidate["name"]], row_hashes=row_hashes, y_pred=y_pred)
 
-            target_df=test_df[target_column]
-            y_true =target_encoder.transform(target_df)
+            if latest_dir_path is None:
+                model_eval_artifact = ModelEvaluationArtifact(is_model_accepted=True,
+                improved_accuracy=None, leaderboard_file_path=self.model_eval_config.leaderboard_file_path,
+                evaluation_metadata_path=self.model_eval_config.metadata_file_path,
+                evaluation_rows_file_path=self.model_eval_config.evaluation_rows_file_path)
+                logging.info(f"Model evaluation artifact: {model_eval_artifact}")
+                return model_eval_artifact
 
-            input_feature_name = list(transformer.feature_names_in_)
-            input_arr =transformer.transform(test_df[input_feature_name])
-            y_pred = model.predict(input_arr)
-            print(f"Prediction using previous model: {target_encoder.inverse_transform(y_pred[:5])}")
-            previous_model_score = f1_score(y_true=y_true, y_pred=y_pred)
+            scores = {entry["name"]:entry["f1_score"] for entry in leaderboard}
+            current_model_score = scores["current"]
+            previous_model_score = scores.get(f"registry/{os.path.basename(latest_dir_path)}")
+            if previous_model_score is None:
+                raise Exception(f"Latest registry version {latest_dir_path} has no model to compare with")
             logging.info(f"Accuracy using previous trained model: {previous_model_score}")
 
-            input_feature_name = list(current_transformer.feature_names_in_)
-            input_arr =current_transformer.transform(test_df[input_feature_name])
-            y_pred = current_model.predict(input_arr)
-            y_true =current_target_encoder.transform(target_df)
-            current_model_score = f1_score(y_true=y_true, y_pred=y_pred)
-            print(f"Prediction using trained model: {current_target_encoder.inverse_transform(y_pred[:5])}")
-
             diff = current_model_score-previous_model_score
             if diff<self.model_eval_config.change_threshold:
                 logging.info("Current trained model is not better than previous model")
                 raise Exception("Current trained model is not better than previous model")
 
             model_eval_artifact = ModelEvaluationArtifact(is_model_accepted=True,
-            improved_accuracy=diff)
+            improved_accuracy=diff, leaderboard_file_path=self.model_eval_config.leaderboard_file_path,
+            evaluation_metadata_path=self.model_eval_config.metadata_file_path,
+            evaluation_rows_file_path=self.model_eval_config.evaluation_rows_file_path)
             logging.info(f"Model eval artifact: {model_eval_artifact}")
             return model_eval_artifact
         except Exception as e:
             raise SensorException(e, sys) from e   
-
-
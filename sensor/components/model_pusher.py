@@ -2,19 +2,25 @@ from sensor.ml.model_resolver import ModelResolver
 from sensor.entity.config_entity import ModelPusherConfig
 from sensor.exception import SensorException
 import os,sys
-from sensor.utils import load_object,save_object
+import shutil
+from sensor.utils import load_object,save_object,write_yaml_file
 from sensor.logger import logging
-from sensor.entity.artifact_entity import DataTransformationArtifact,ModelTrainerArtifact,ModelPusherArtifact
+from sensor.entity.artifact_entity import DataTransformationArtifact,ModelTrainerArtifact,ModelPusherArtifact,DataValidationArtifact,ModelEvaluationArtifact
+from sensor.ml.evaluation import read_evaluation_cache,EVALUATION_METADATA_KEY
 class ModelPusher:
 
     def __init__(self,model_pusher_config:ModelPusherConfig,
                         data_transformation_artifact:DataTransformationArtifact,
-                        model_trainer_artifact:ModelTrainerArtifact):
+                        model_trainer_artifact:ModelTrainerArtifact,
+                        data_validation_artifact:DataValidationArtifact=None,
+                        model_eval_artifact:ModelEvaluationArtifact=None):
         try:
             logging.info(f"{'>>'*20} Model Pusher {'<<'*20}")
             self.model_pusher_config=model_pusher_config
             self.data_transformation_artifact=data_transformation_artifact
             self.model_trainer_artifact=model_trainer_artifact
+            self.data_validation_artifact=data_validation_artifact
+            self.model_eval_artifact=model_eval_artifact
             self.model_resolver = ModelResolver(model_registry=self.model_pusher_config.saved_model_dir)
         except Exception as e:
             raise SensorException(e, sys) from e
@@ -26,12 +32,17 @@ class ModelPusher:
             transformer = load_object(file_path=self.data_transformation_artifact.transform_object_path)
             model = load_object(file_path=self.model_trainer_artifact.model_path)
             target_encoder = load_object(file_path=self.data_transformation_artifact.target_encoder_path)
+            fused_transformer = None
+            if self.data_transformation_artifact.fused_transform_object_path is not None:
+                fused_transformer = load_object(file_path=self.data_transformation_artifact.fused_transform_object_path)
 
             #model pusher dir
             logging.info("Saving model into model pusher directory")
             save_object(file_path=self.model_pusher_config.pusher_transformer_path, obj=transformer)
             save_object(file_path=self.model_pusher_config.pusher_model_path, obj=model)
             save_object(file_path=self.model_pusher_config.pusher_target_encoder_path, obj=target_encoder)
+            if fused_transformer is not None:
+                save_object(file_path=self.model_pusher_config.pusher_fused_transformer_path, obj=fused_transformer)
 
 
             #saved model dir
@@ -39,10 +50,51 @@ class ModelPusher:
             transformer_path=self.model_resolver.get_latest_save_transformer_path()
             model_path=self.model_resolver.get_latest_save_model_path()
             target_encoder_path=self.model_resolver.get_latest_save_target_encoder_path()
+            reference_profile_save_path=self.model_resolver.get_latest_save_reference_profile_path()
+            fused_transformer_path=self.model_resolver.get_latest_save_fused_transformer_path()
+            metadata_path=self.model_resolver.get_latest_save_metadata_path()
+            evaluation_rows_path=self.model_resolver.get_latest_save_evaluation_rows_path()
 
             save_object(file_path=transformer_path, obj=transformer)
             save_object(file_path=model_path, obj=model)
             save_object(file_path=target_encoder_path, obj=target_encoder)
+            if fused_transformer is not None:
+                save_object(file_path=fused_transformer_path, obj=fused_transformer)
+
+            #reference sketches of the training data live next to the model they were trained with
+            reference_profile_path = None if self.data_validation_artifact is None \
+                else self.data_validation_artifact.reference_profile_path
+            if reference_profile_path is not None and os.path.exists(reference_profile_path):
+                logging.info("Saving reference profile with the model")
+                for file_path in (self.model_pusher_config.pusher_reference_profile_path,
+                    reference_profile_save_path):
+                    os.makedirs(os.path.dirname(file_path),exist_ok=True)
+                    shutil.copyfile(src=reference_profile_path, dst=file_path)
+
+            #how the model was trained, read back by the next run to continue it or retrain from scratch
+            metadata = {
+                "training_kind":self.data_transformation_artifact.training_kind,
+                "incremental_runs":self.data_transformation_artifact.incremental_runs,
+                "params":self.model_trainer_artifact.best_params,
+                "f1_train_score":float(self.model_trainer_artifact.f1_train_score),
+                "f1_test_score":float(self.model_trainer_artifact.f1_test_score),
+            }
+            #test scores cached by model evaluation, the next evaluation reuses them instead of re-scoring the model
+            evaluation_cache = None if self.model_eval_artifact is None \
+                else read_evaluation_cache(metadata_path=self.model_eval_artifact.evaluation_metadata_path)
+            if evaluation_cache is not None and os.path.exists(self.model_eval_artifact.evaluation_rows_file_path):
+                logging.info("Saving cached evaluation scores with the model")
+                metadata[EVALUATION_METADATA_KEY] = evaluation_cache
+                for file_path in (self.model_pusher_config.pusher_evaluation_rows_path,evaluation_rows_path):
+                    os.makedirs(os.path.dirname(file_path),exist_ok=True)
+                    shutil.copyfile(src=self.model_eval_artifact.evaluation_rows_file_path, dst=file_path)
+
+            for file_path in (self.model_pusher_config.pusher_metadata_path,metadata_path):
+                write_yaml_file(file_path=file_path, data=metadata)
+
+            #the version only becomes visible to the resolver once it is complete
+            self.model_resolver.publish_version(metrics={key:metadata[key] for key in
+                ("training_kind","f1_train_score","f1_test_score")})
 
             model_pusher_artifact = ModelPusherArtifact(pusher_model_dir=self.model_pusher_config.pusher_model_dir,
             saved_model_dir=self.model_pusher_config.saved_model_dir)
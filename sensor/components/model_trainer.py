@@ -3,9 +3,16 @@ from sensor.entity.artifact_entity import DataTransformationArtifact,ModelTraine
 from sensor.logger import logging
 from sensor.exception import SensorException
 import os,sys 
+import shutil
+import time
+import xgboost
 from xgboost import XGBClassifier
 from sklearn.metrics import f1_score
-from sensor.utils import load_numpy_array_data,save_object
+from sensor.utils import load_transformed_data,load_transformed_target,save_object,load_object,get_peak_rss_mb,read_yaml_file
+from sensor.ml.resampling import get_scale_pos_weight
+from sensor.ml.search import successive_halving_search
+from sensor.ml.cross_validation import cross_validate
+from sensor.ml.external_memory import get_external_memory_dmatrix,predict_in_batches,TransformedDataIter
 
 class ModelTrainer:
 
@@ -23,49 +30,232 @@ class ModelTrainer:
 
     
     @staticmethod
-    def train_model(x,y):
+    def train_model(x,y,scale_pos_weight:float=None,params:dict=None,nthread:int=None,tree_method:str="hist",
+        xgb_model:xgboost.Booster=None):
         try:
-            xgb_clf =  XGBClassifier()
-            xgb_clf.fit(x,y)
+            xgb_clf =  XGBClassifier(scale_pos_weight=scale_pos_weight,n_jobs=nthread,tree_method=tree_method,**(params or {}))
+            xgb_clf.fit(x,y,xgb_model=xgb_model)
             return xgb_clf
         except Exception as e:
             raise SensorException(e, sys) from e
 
+    @staticmethod
+    def train_booster(dtrain:xgboost.DMatrix,scale_pos_weight:float=None,params:dict=None,nthread:int=None,
+        tree_method:str="hist",xgb_model:xgboost.Booster=None) -> xgboost.Booster:
+        """
+        Train with the native api, params are XGBClassifier parameters so both paths fit the same model,
+        xgb_model is a booster to keep boosting instead of starting from scratch
+        """
+        try:
+            params = dict(params or {})
+            num_boost_round = params.pop("n_estimators",100)
+            booster_params = {"objective":"binary:logistic","tree_method":tree_method,**params}
+            if scale_pos_weight is not None:
+                booster_params["scale_pos_weight"] = scale_pos_weight
+            if nthread is not None:
+                booster_params["nthread"] = nthread
+            return xgboost.train(booster_params,dtrain,num_boost_round=num_boost_round,xgb_model=xgb_model)
+        except Exception as e:
+            raise SensorException(e, sys) from e
+
+    @staticmethod
+    def get_classifier(booster:xgboost.Booster) -> XGBClassifier:
+        """
+        The XGBClassifier train_model would have produced, so evaluation and batch prediction load it unchanged
+        """
+        try:
+            xgb_clf = XGBClassifier()
+            xgb_clf.load_model(bytearray(booster.save_raw(raw_format="ubj")))
+            return xgb_clf
+        except Exception as e:
+            raise SensorException(e, sys) from e
+
+    def search_hyperparameters(self,scale_pos_weight:float=None):
+        """
+        Successive halving search on a validation split of the transformed train data
+        return: parameters for the final fit, with n_estimators set where the best trial stopped, and all trials
+        """
+        try:
+            config = self.model_trainer_config
+            logging.info(f"Searching hyperparameters with {config.search_n_workers} workers of {config.search_threads_per_trial} threads")
+            #validation rows are taken before resampling, only the training part of the split is resampled
+            best_trial,search_trials = successive_halving_search(
+                train_dir=self.data_transformation_artifact.transform_unresampled_train_path or \
+                    self.data_transformation_artifact.transform_train_path,
+                search_space=config.search_space,
+                n_candidates=config.search_n_candidates,
+                min_rounds=config.search_min_rounds,
+                max_rounds=config.search_max_rounds,
+                eta=config.search_eta,
+                n_workers=config.search_n_workers,
+                threads_per_trial=config.search_threads_per_trial,
+                validation_fraction=config.search_validation_fraction,
+                early_stopping_rounds=config.search_early_stopping_rounds,
+                time_budget_seconds=config.search_time_budget_seconds,
+                scale_pos_weight=scale_pos_weight,
+                random_state=config.random_state,
+                batch_rows=config.external_memory_batch_rows,
+                resampling_params=self.data_transformation_artifact.resampling_params)
+            best_params = dict(best_trial["params"],n_estimators=best_trial["best_iteration"]+1)
+            logging.info(f"Best parameters: {best_params}")
+            return best_params,search_trials
+        except Exception as e:
+            raise SensorException(e, sys) from e
+
+    def cross_validate(self,params:dict=None,scale_pos_weight:float=None) -> dict:
+        """
+        k-fold F1 of the training parameters on the transformed train data before resampling,
+        see sensor.ml.cross_validation
+        """
+        try:
+            config = self.model_trainer_config
+            x_train,y_train = load_transformed_data(dir_path=self.data_transformation_artifact.transform_unresampled_train_path or \
+                self.data_transformation_artifact.transform_train_path, mmap_mode=config.mmap_mode)
+            cv_params = dict(params or {},tree_method=config.tree_method)
+            if scale_pos_weight is not None:
+                cv_params["scale_pos_weight"] = scale_pos_weight
+            return cross_validate(x=x_train, y=y_train, params=cv_params, n_folds=config.cv_n_folds,
+                n_workers=config.cv_n_workers, threads_per_fold=config.cv_threads_per_fold,
+                batch_rows=config.external_memory_batch_rows, random_state=config.random_state,
+                resampling_params=self.data_transformation_artifact.resampling_params)
+        except Exception as e:
+            raise SensorException(e, sys) from e
+
     def initiate_model_trainer(self,) -> ModelTrainerArtifact:
         try:
-            logging.info("Loading train and test array.")
-            train_arr = load_numpy_array_data(file_path=self.data_transformation_artifact.transform_train_path)
-            test_arr = load_numpy_array_data(file_path=self.data_transformation_artifact.transform_test_path)
+            config = self.model_trainer_config
+            if self.data_transformation_artifact.training_kind=="reuse":
+                logging.info(f"No new train rows, reusing {self.data_transformation_artifact.base_model_path}")
+                metadata = read_yaml_file(file_path=self.data_transformation_artifact.base_metadata_path)
+                model_trainer_artifact = ModelTrainerArtifact(model_path=self.data_transformation_artifact.base_model_path,
+                    f1_train_score=metadata["f1_train_score"], f1_test_score=metadata["f1_test_score"],
+                    best_params=self.data_transformation_artifact.base_params, phase_timings={})
+                logging.info(f"Model trainer artifact: {model_trainer_artifact}")
+                return model_trainer_artifact
 
+            train_dir = self.data_transformation_artifact.transform_train_path
+            test_dir = self.data_transformation_artifact.transform_test_path
 
-            logging.info(
-                "Splitting input and target feature from both train and test arr."
-            )
-            x_train,y_train = train_arr[:,:-1],train_arr[:,-1]
-            x_test,y_test = test_arr[:,:-1],test_arr[:,-1]
+            #without resampling the positive class is weighted by the class ratio instead
+            scale_pos_weight = None
+            if self.data_transformation_artifact.resampling_strategy=="none":
+                scale_pos_weight = get_scale_pos_weight(y=load_transformed_target(dir_path=train_dir))
+                logging.info(f"Training with scale_pos_weight: {scale_pos_weight}")
 
+            best_params,search_trials,phase_timings = None,None,{}
+            #an incremental run keeps boosting the registry model with its parameters on the new rows only
+            xgb_model,train_params = None,None
+            if self.data_transformation_artifact.training_kind=="incremental":
+                logging.info(f"Continuing {self.data_transformation_artifact.base_model_path} for {config.incremental_rounds} rounds")
+                xgb_model = load_object(file_path=self.data_transformation_artifact.base_model_path).get_booster()
+                best_params = self.data_transformation_artifact.base_params
+                train_params = dict(best_params or {},n_estimators=config.incremental_rounds)
+            elif config.search_mode=="successive_halving":
+                start_time = time.perf_counter()
+                best_params,search_trials = self.search_hyperparameters(scale_pos_weight=scale_pos_weight)
+                train_params = best_params
+                phase_timings["search"] = time.perf_counter()-start_time
 
-            logging.info("Train the model")
-            model = ModelTrainer.train_model(x=x_train,y=y_train)
+            if config.training_mode=="native":
+                #one quantized matrix per split, reused for training and scoring instead of
+                #converting the arrays again on every predict call
+                logging.info(f"Train the booster with {config.nthread} threads")
+                start_time = time.perf_counter()
+                dtrain = xgboost.QuantileDMatrix(TransformedDataIter(dir_path=train_dir,batch_rows=config.external_memory_batch_rows),
+                    nthread=config.nthread)
+                dtest = xgboost.QuantileDMatrix(TransformedDataIter(dir_path=test_dir,batch_rows=config.external_memory_batch_rows),
+                    ref=dtrain, nthread=config.nthread)
+                phase_timings["build_matrix"] = time.perf_counter()-start_time
 
-            logging.info("Calculating f1 train score")
-            yhat_train = model.predict(x_train)
-            f1_train_score  =f1_score(y_true=y_train, y_pred=yhat_train)
+                start_time = time.perf_counter()
+                booster = ModelTrainer.train_booster(dtrain=dtrain, scale_pos_weight=scale_pos_weight, params=train_params,
+                    nthread=config.nthread, tree_method=config.tree_method, xgb_model=xgb_model)
+                model = ModelTrainer.get_classifier(booster=booster)
+                phase_timings["train"] = time.perf_counter()-start_time
 
+                logging.info("Calculating f1 train and test score")
+                start_time = time.perf_counter()
+                #same threshold as XGBClassifier.predict
+                f1_train_score = f1_score(y_true=dtrain.get_label(), y_pred=booster.predict(dtrain)>0.5)
+                phase_timings["score_train"] = time.perf_counter()-start_time
+                start_time = time.perf_counter()
+                f1_test_score = f1_score(y_true=dtest.get_label(), y_pred=booster.predict(dtest)>0.5)
+                phase_timings["score_test"] = time.perf_counter()-start_time
+                del dtrain,dtest
+            elif config.training_mode=="external_memory":
+                logging.info(f"Train the model in external memory, batches of {config.external_memory_batch_rows} rows")
+                start_time = time.perf_counter()
+                dtrain = get_external_memory_dmatrix(dir_path=train_dir, cache_dir=config.external_memory_cache_dir,
+                    batch_rows=config.external_memory_batch_rows, nthread=config.nthread)
+                phase_timings["build_matrix"] = time.perf_counter()-start_time
 
-            logging.info("Calculating f1 test score")
-            yhat_test = model.predict(x_test)
-            f1_test_score  =f1_score(y_true=y_test, y_pred=yhat_test)
+                start_time = time.perf_counter()
+                booster = ModelTrainer.train_booster(dtrain=dtrain, scale_pos_weight=scale_pos_weight, params=train_params,
+                    nthread=config.nthread, tree_method=config.tree_method, xgb_model=xgb_model)
+                model = ModelTrainer.get_classifier(booster=booster)
+                phase_timings["train"] = time.perf_counter()-start_time
+                del dtrain
+                shutil.rmtree(config.external_memory_cache_dir, ignore_errors=True)
 
+                logging.info("Calculating f1 train and test score batch by batch")
+                start_time = time.perf_counter()
+                y_train,yhat_train = predict_in_batches(model=model, dir_path=train_dir, batch_rows=config.external_memory_batch_rows)
+                f1_train_score = f1_score(y_true=y_train, y_pred=yhat_train)
+                phase_timings["score_train"] = time.perf_counter()-start_time
+                start_time = time.perf_counter()
+                y_test,yhat_test = predict_in_batches(model=model, dir_path=test_dir, batch_rows=config.external_memory_batch_rows)
+                f1_test_score = f1_score(y_true=y_test, y_pred=yhat_test)
+                phase_timings["score_test"] = time.perf_counter()-start_time
+            else:
+                logging.info("Loading train and test array.")
+                start_time = time.perf_counter()
+                x_train,y_train = load_transformed_data(dir_path=train_dir, mmap_mode=config.mmap_mode)
+                x_test,y_test = load_transformed_data(dir_path=test_dir, mmap_mode=config.mmap_mode)
+                phase_timings["load"] = time.perf_counter()-start_time
+
+                logging.info("Train the model")
+                start_time = time.perf_counter()
+                model = ModelTrainer.train_model(x=x_train,y=y_train,scale_pos_weight=scale_pos_weight,params=train_params,
+                    nthread=config.nthread,tree_method=config.tree_method,xgb_model=xgb_model)
+                phase_timings["train"] = time.perf_counter()-start_time
+
+                logging.info("Calculating f1 train score")
+                start_time = time.perf_counter()
+                yhat_train = model.predict(x_train)
+                f1_train_score  =f1_score(y_true=y_train, y_pred=yhat_train)
+                phase_timings["score_train"] = time.perf_counter()-start_time
+
+
+                logging.info("Calculating f1 test score")
+                start_time = time.perf_counter()
+                yhat_test = model.predict(x_test)
+                f1_test_score  =f1_score(y_true=y_test, y_pred=yhat_test)
+                phase_timings["score_test"] = time.perf_counter()-start_time
+
+            phase_timings = {phase:round(seconds,3) for phase,seconds in phase_timings.items()}
+            logging.info(f"Phase timings in seconds: {phase_timings}")
+            logging.info(f"Peak RSS after training in {config.training_mode} mode: {get_peak_rss_mb():.0f} MB")
             logging.info(f"train score:{f1_train_score} and tests score {f1_test_score}")
 
+            #the gates use the fold means when cross validating, a single split is noisy
+            cv_scores = None
+            gate_train_score,gate_test_score = f1_train_score,f1_test_score
+            if config.cv_mode=="kfold":
+                if self.data_transformation_artifact.training_kind=="incremental":
+                    logging.info("Skipping cross validation of an incremental run")
+                else:
+                    start_time = time.perf_counter()
+                    cv_scores = self.cross_validate(params=train_params, scale_pos_weight=scale_pos_weight)
+                    phase_timings["cross_validation"] = round(time.perf_counter()-start_time,3)
+                    gate_train_score,gate_test_score = cv_scores["f1_train_mean"],cv_scores["f1_valid_mean"]
+
             logging.info("Checking if our model is underfitting or not")
-            if f1_test_score<self.model_trainer_config.expected_score:
+            if gate_test_score<self.model_trainer_config.expected_score:
                 raise Exception(f"Model is not good as it is not able to give \
-                expected accuracy: {self.model_trainer_config.expected_score}: model actual score: {f1_test_score}")
+                expected accuracy: {self.model_trainer_config.expected_score}: model actual score: {gate_test_score}")
 
             logging.info("Checking if our model is overfiiting or not")
-            diff = abs(f1_train_score-f1_test_score)
+            diff = abs(gate_train_score-gate_test_score)
 
             if diff>self.model_trainer_config.overfitting_threshold:
                 raise Exception(f"Train and test score diff: {diff} is more than overfitting threshold {self.model_trainer_config.overfitting_threshold}")
@@ -78,7 +268,9 @@ class ModelTrainer:
             #prepare artifact
             logging.info("Prepare the artifact")
             model_trainer_artifact  = ModelTrainerArtifact(model_path=self.model_trainer_config.model_path, 
-            f1_train_score=f1_train_score, f1_test_score=f1_test_score)
+            f1_train_score=f1_train_score, f1_test_score=f1_test_score,
+            best_params=best_params, search_trials=search_trials, phase_timings=phase_timings,
+            cv_scores=cv_scores)
             logging.info(f"Model trainer artifact: {model_trainer_artifact}")
             return model_trainer_artifact
         except Exception as e:
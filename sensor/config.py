@@ -1,13 +1,48 @@
-
-from dataclasses import dataclass
+from dataclasses import dataclass,field
 import os
-import pymongo
+import threading
 MONGO_DB_URL_ENV_KEY="MONGO_DB_URL"
 
 @dataclass
 class EnvironmentVariable:
-    mongo_db_url:str=os.getenv(MONGO_DB_URL_ENV_KEY)
+    mongo_db_url:str=field(default_factory=lambda:os.getenv(MONGO_DB_URL_ENV_KEY))
+
+
+_lock = threading.Lock()
+_env_var = None
+_mongo_client = None
+_mongo_client_pid = None
+
+
+def get_env_var() -> EnvironmentVariable:
+    global _env_var
+    with _lock:
+        if _env_var is None:
+            from dotenv import load_dotenv
+            load_dotenv()
+            _env_var = EnvironmentVariable()
+        return _env_var
+
+
+def get_mongo_client():
+    """
+    Process wide pooled mongo client, created on first use
+    A forked worker gets its own client as pymongo clients are not fork safe
+    """
+    global _mongo_client,_mongo_client_pid
+    env_var = get_env_var()
+    with _lock:
+        if _mongo_client is None or _mongo_client_pid!=os.getpid():
+            import pymongo
+            _mongo_client = pymongo.MongoClient(env_var.mongo_db_url)
+            _mongo_client_pid = os.getpid()
+        return _mongo_client
 
 
-env_var = EnvironmentVariable()
-mongo_client = pymongo.MongoClient(env_var.mongo_db_url)
\ No newline at end of file
+def __getattr__(name):
+    #keeps `from sensor.config import mongo_client` working without connecting at import time
+    if name=="mongo_client":
+        return get_mongo_client()
+    if name=="env_var":
+        return get_env_var()
+    raise AttributeError(f"module {__name__!r} has no attribute {name!r}")
@@ -5,6 +5,11 @@ from dataclasses import dataclass
 class DataIngestionArtifact:
     train_file_path:str 
     test_file_path:str
+    file_format:str
+    new_train_file_path:str = None
+    #True when the rows were ingested incrementally, only then does a missing new_train_file_path
+    #mean that no new train rows arrived
+    incremental:bool = False
 
 @dataclass
 class DataValidationArtifact:
@@ -12,6 +17,10 @@ class DataValidationArtifact:
     train_file_path:str 
     test_file_path:str 
     status:bool
+    file_format:str
+    reference_profile_path:str = None
+    new_train_file_path:str = None
+    incremental:bool = False
 
 @dataclass
 class DataTransformationArtifact:
@@ -19,18 +28,41 @@ class DataTransformationArtifact:
     transform_train_path:str 
     transform_test_path:str 
     target_encoder_path:str
+    resampling_strategy:str = None
+    fused_transform_object_path:str = None
+    #set when the train rows are resampled: the rows before resampling and the get_resampler arguments,
+    #so validation splits keep the real class ratio and only their training part is resampled
+    transform_unresampled_train_path:str = None
+    resampling_params:dict = None
+    #full, incremental or reuse, an incremental run continues boosting base_model_path and
+    #reuse keeps it as is when there are no new train rows
+    training_kind:str = "full"
+    base_model_path:str = None
+    base_params:dict = None
+    base_metadata_path:str = None
+    #incremental runs since the last full retrain, this one included
+    incremental_runs:int = 0
 
 @dataclass
 class ModelTrainerArtifact:
     model_path:str 
     f1_train_score:float 
     f1_test_score:float
+    best_params:dict = None
+    search_trials:list = None
+    phase_timings:dict = None
+    #per fold F1 with their mean and std when cross validating
+    cv_scores:dict = None
 
 
 @dataclass
 class ModelEvaluationArtifact:
     is_model_accepted:bool
     improved_accuracy:float
+    leaderboard_file_path:str = None
+    #evaluation cache of the current model, test scores by dataset hash and per row predictions
+    evaluation_metadata_path:str = None
+    evaluation_rows_file_path:str = None
 
 @dataclass
 class ModelPusherArtifact:
@@ -4,8 +4,12 @@ from sensor.exception import SensorException
 TRAIN_FILE_NAME = "train.csv"
 TEST_FILE_NAME = "test.csv"
 TRANSFORMER_OBJECT_FILE_NAME = "transformer.pkl"
+FUSED_TRANSFORMER_OBJECT_FILE_NAME = "fused_transformer.pkl"
 TARGET_ENCODER_OBJECT_FILE_NAME = "target_encoder.pkl"
 MODEL_FILE_NAME = "model.pkl"
+REFERENCE_PROFILE_FILE_NAME = "reference_profile.json"
+MODEL_METADATA_FILE_NAME = "metadata.yaml"
+EVALUATION_ROWS_FILE_NAME = "evaluation_rows.npz"
 
 class TrainingPipelineConfig:
     def __init__(self):
@@ -16,29 +20,96 @@ class DataIngestionConfig:
     def __init__(self,training_pipeline_config:TrainingPipelineConfig):
         try:
             data_ingestion_dir = os.path.join(training_pipeline_config.artifact_dir,"data_ingestion")
+            #csv, parquet or feather, csv is handy for debugging
+            self.file_format = "parquet"
             self.dataset_dir = os.path.join(data_ingestion_dir,"dataset")
-            self.train_file_path = os.path.join(self.dataset_dir ,TRAIN_FILE_NAME)
-            self.test_file_path = os.path.join(self.dataset_dir,TEST_FILE_NAME)
+            self.train_file_path = os.path.join(self.dataset_dir ,TRAIN_FILE_NAME.replace("csv",self.file_format))
+            self.test_file_path = os.path.join(self.dataset_dir,TEST_FILE_NAME.replace("csv",self.file_format))
+            #train rows of the snapshot parts appended by this run, used for incremental training
+            self.new_train_file_path = os.path.join(self.dataset_dir,"new_"+TRAIN_FILE_NAME.replace("csv",self.file_format))
             self.database_name="sensor"
             self.collection_name="sensor_readings"
             self.test_size = 0.2
+            self.schema_file_path=os.path.join("schema.yaml")
+            #stream: batched cursor with schema projection, partitioned: _id ranges
+            #read by a process pool, full: single find() call
+            self.export_mode = "stream"
+            self.export_batch_size = 10000
+            self.export_n_workers = os.cpu_count()
+            #incremental ingestion only exports documents above the stored watermark
+            #and appends them to a snapshot kept across pipeline runs
+            self.incremental = False
+            self.watermark_field = "_id"
+            self.snapshot_dir = os.path.join("snapshot",self.database_name,self.collection_name)
+            self.snapshot_state_file_path = os.path.join(self.snapshot_dir,"snapshot.yaml")
+            #hash: streaming split by a stable row hash, a row keeps its partition across runs
+            #random: in memory train_test_split
+            self.split_mode = "hash"
+            #the default fixed hash threshold keeps the class ratio in expectation and every row in its
+            #partition forever; split_stratify matches the ratio exactly with per class hash quantiles,
+            #which shift as data grows and move rows near them between train and test
+            self.split_stratify = False
+            #columns identifying a record, None hashes the whole row
+            self.split_key_columns = None
+            self.split_chunk_size = 50000
+            self.random_state = 42
         except Exception as e:
             raise SensorException(e, sys) from e
 
 
+def validate_incremental_config(data_ingestion_config:DataIngestionConfig,data_transformation_config) -> None:
+    """
+    Reject incremental flags that cannot work together: only an incremental hash split ingestion
+    writes the new train rows an incremental transformation trains on
+    """
+    if data_ingestion_config.incremental and data_ingestion_config.split_mode!="hash":
+        raise ValueError("Incremental ingestion needs split_mode='hash', a random split neither keeps "
+            "rows in their partition nor writes the new train rows")
+    if data_ingestion_config.incremental and data_ingestion_config.split_stratify:
+        raise ValueError("Incremental ingestion needs split_stratify=False, the per class hash quantiles "
+            "move rows the registry model trained on into the test set")
+    if data_transformation_config.incremental and not data_ingestion_config.incremental:
+        raise ValueError("DataTransformationConfig.incremental needs DataIngestionConfig.incremental, "
+            "otherwise no run ever trains incrementally")
+
+
 class DataValidationConfig:
     def __init__(self,training_pipeline_config:TrainingPipelineConfig):
         try:
             data_validation_dir = os.path.join(training_pipeline_config.artifact_dir,"data_validation")
+            #csv, parquet or feather, csv is handy for debugging
+            self.file_format = "parquet"
+            train_file_name = TRAIN_FILE_NAME.replace("csv",self.file_format)
+            test_file_name = TEST_FILE_NAME.replace("csv",self.file_format)
             self.valid_dir = os.path.join(data_validation_dir,"valid")
             self.invalid_dir = os.path.join(data_validation_dir,"invalid")
-            self.valid_train_file_path = os.path.join(self.valid_dir,TRAIN_FILE_NAME)
-            self.invalid_train_file_path= os.path.join(self.invalid_dir,TRAIN_FILE_NAME)
-            self.valid_test_file_path = os.path.join(self.valid_dir,TEST_FILE_NAME)
-            self.invalid_test_file_path= os.path.join(self.invalid_dir,TEST_FILE_NAME)
+            self.valid_train_file_path = os.path.join(self.valid_dir,train_file_name)
+            self.invalid_train_file_path= os.path.join(self.invalid_dir,train_file_name)
+            self.valid_test_file_path = os.path.join(self.valid_dir,test_file_name)
+            self.invalid_test_file_path= os.path.join(self.invalid_dir,test_file_name)
+            self.valid_new_train_file_path = os.path.join(self.valid_dir,"new_"+train_file_name)
             self.report_file_name = os.path.join(data_validation_dir,"report","report.yaml")
             self.schema_file_path=os.path.join("schema.yaml")
             self.missing_thresold = 70
+            #ks: p-value above drift_pvalue_threshold means same distribution
+            #psi and wasserstein: cheaper statistics compared with their own threshold
+            self.drift_method = "ks"
+            self.drift_pvalue_threshold = 0.05
+            self.psi_threshold = 0.2
+            self.wasserstein_threshold = 0.1
+            self.drift_n_jobs = 1
+            self.drift_block_size = 32
+            #rows sampled with a fixed seed above this size, None compares every row
+            self.drift_sample_size = None
+            self.drift_random_state = 42
+            #chunked: one pass statistics over fixed size chunks, drift from quantile sketches
+            #in_memory: load both files and compare every row
+            self.validation_mode = "chunked"
+            self.chunk_size = 50000
+            self.sketch_size = 256
+            #sketches and histograms of the valid train data, shipped with the model for production drift checks
+            self.reference_profile_path = os.path.join(data_validation_dir,"reference_profile",REFERENCE_PROFILE_FILE_NAME)
+            self.reference_histogram_bins = 10
         except Exception as e:
             raise SensorException(e, sys) from e
 
@@ -48,11 +119,45 @@ class DataTransformationConfig:
             data_transformation_dir = os.path.join(training_pipeline_config.artifact_dir,"data_transformation")
             self.transform_obj_dir = os.path.join(data_transformation_dir,"transformer")
             self.transform_object_path = os.path.join(self.transform_obj_dir,TRANSFORMER_OBJECT_FILE_NAME)
+            #inference copy of the fitted pipeline, see sensor.ml.transform.FusedTransform
+            self.fused_transform_object_path = os.path.join(self.transform_obj_dir,FUSED_TRANSFORMER_OBJECT_FILE_NAME)
             self.transform_data = os.path.join(data_transformation_dir,"transform_data")
-            self.transform_train_path = os.path.join(self.transform_data,TRAIN_FILE_NAME.replace("csv","npz"))
-            self.transform_test_path = os.path.join(self.transform_data,TEST_FILE_NAME.replace("csv","npz"))
+            #directories holding x.npy (float32 features) and y.npy (int8 labels)
+            self.transform_train_path = os.path.join(self.transform_data,"train")
+            #train rows before resampling, validation splits of the search and the folds are cut from these
+            self.transform_unresampled_train_path = os.path.join(self.transform_data,"train_unresampled")
+            self.transform_test_path = os.path.join(self.transform_data,"test")
+            #rows transformed at a time into the float32 output
+            self.transform_chunk_size = 10000
+            #rows per x_00000.npy/y_00000.npy shard for external memory training, None writes one x.npy
+            self.transform_shard_rows = None
+            #in_memory: load train and test and fit the exact sklearn pipeline
+            #streaming: fit from quantile sketches and transform chunk by chunk into the output files,
+            #bounded memory but the sketched medians and scales are approximate (about 1-2% scale error)
+            self.fit_mode = "in_memory"
+            self.fit_n_workers = os.cpu_count()
+            self.fit_sketch_size = 1024
             self.target_encoder_path = os.path.join(data_transformation_dir,"target_encoder",TARGET_ENCODER_OBJECT_FILE_NAME)
             self.schema_file_path=os.path.join("schema.yaml")
+            #smote_tomek, smote, undersample or none, the test set is never resampled
+            #none trains xgboost with scale_pos_weight instead, see benchmarks/resampling.py
+            self.resampling_strategy = "smote_tomek"
+            self.resampling_sampling_strategy = "auto"
+            self.resampling_k_neighbors = 5
+            self.resampling_n_jobs = os.cpu_count()
+            #rows read, generated or searched at a time when the streaming fit resamples from disk
+            self.resampling_batch_rows = 50000
+            self.random_state = 42
+            #incremental: reuse the registry transformer and transform only the new train rows, so the
+            #trainer keeps boosting the registry model; a full retrain runs every full_retrain_every runs,
+            #when there is no registry model or new rows, or when the new rows drift from the registry profile
+            self.incremental = False
+            self.full_retrain_every = 4
+            self.refit_drift_method = "psi"
+            self.refit_drift_threshold = 0.2
+            #share of drifted columns above which the transformer is refitted (and the model retrained)
+            self.refit_drifted_share = 0.1
+            self.model_registry = os.path.join("saved_models")
         except Exception as e:
             raise SensorException(e, sys) from e
 
@@ -64,13 +169,65 @@ class ModelTrainerConfig:
             self.model_path = os.path.join(model_trainer_dir,"model",MODEL_FILE_NAME)
             self.expected_score = 0.7
             self.overfitting_threshold = 0.1
+            #"r" memory maps the transformed arrays, None loads private copies
+            self.mmap_mode = "r"
+            #in_memory: fit XGBClassifier on the loaded arrays
+            #native: one QuantileDMatrix per split reused by training and scoring
+            #external_memory: stream the transformed files (or their shards) into an on-disk quantized matrix
+            self.training_mode = "native"
+            #threads of this task, lower it when other Airflow tasks share the node
+            self.nthread = os.cpu_count()
+            self.tree_method = "hist"
+            #rows copied at a time into the native and external memory matrices
+            self.external_memory_batch_rows = 100000
+            self.external_memory_cache_dir = os.path.join(model_trainer_dir,"cache")
+            #"successive_halving" searches the hyperparameters below before the final fit, "none" uses xgboost defaults
+            self.search_mode = "none"
+            self.search_space = {
+                "max_depth":[3,4,6,8],
+                "learning_rate":{"low":0.02,"high":0.3,"log":True},
+                "subsample":[0.6,0.8,1.0],
+                "colsample_bytree":[0.5,0.75,1.0],
+                "min_child_weight":[1,3,5,10],
+            }
+            self.search_n_candidates = 27
+            self.search_min_rounds = 50
+            self.search_max_rounds = 1350
+            self.search_eta = 3
+            self.search_n_workers = os.cpu_count()
+            #threads of every trial, search_n_workers*search_threads_per_trial should not exceed the cpus
+            self.search_threads_per_trial = 1
+            self.search_validation_fraction = 0.2
+            self.search_early_stopping_rounds = 20
+            #no new rung is started after this many seconds, keeps the search inside the weekly run window
+            self.search_time_budget_seconds = 3600
+            #kfold: the underfitting and overfitting gates use the mean F1 of cv_n_folds folds trained
+            #cv_n_workers at a time from one shared memory copy of the train features, none: the test split
+            self.cv_mode = "none"
+            self.cv_n_folds = 5
+            self.cv_n_workers = os.cpu_count()
+            self.cv_threads_per_fold = 1
+            #boosting rounds added to the registry model by an incremental run
+            self.incremental_rounds = 20
+            self.random_state = 42
         except Exception as e:
             raise SensorException(e, sys) from e
 
 class ModelEvaluationConfig:
     def __init__(self,training_pipeline_config:TrainingPipelineConfig):
+        model_evaluation_dir = os.path.join(training_pipeline_config.artifact_dir,"model_evaluation")
         self.change_threshold = 0.01
         self.schema_file_path=os.path.join("schema.yaml")
+        #the current model is ranked against the latest n_registry_candidates registry versions and the
+        #challengers (directories laid out like a registry version), it is still accepted against the latest version
+        self.n_registry_candidates = 3
+        self.challenger_dirs = []
+        self.n_workers = os.cpu_count()
+        self.threads_per_candidate = 1
+        self.leaderboard_file_path = os.path.join(model_evaluation_dir,"leaderboard.yaml")
+        #cached test scores and per row predictions of the current model, pushed with it into the registry
+        self.metadata_file_path = os.path.join(model_evaluation_dir,MODEL_METADATA_FILE_NAME)
+        self.evaluation_rows_file_path = os.path.join(model_evaluation_dir,EVALUATION_ROWS_FILE_NAME)
 
 
 class ModelPusherConfig:
@@ -81,7 +238,11 @@ class ModelPusherConfig:
         self.pusher_model_dir = os.path.join(self.model_pusher_dir,"saved_models")
         self.pusher_model_path = os.path.join(self.pusher_model_dir,MODEL_FILE_NAME)
         self.pusher_transformer_path = os.path.join(self.pusher_model_dir,TRANSFORMER_OBJECT_FILE_NAME)
+        self.pusher_fused_transformer_path = os.path.join(self.pusher_model_dir,FUSED_TRANSFORMER_OBJECT_FILE_NAME)
         self.pusher_target_encoder_path = os.path.join(self.pusher_model_dir,TARGET_ENCODER_OBJECT_FILE_NAME)
+        self.pusher_reference_profile_path = os.path.join(self.pusher_model_dir,REFERENCE_PROFILE_FILE_NAME)
+        self.pusher_metadata_path = os.path.join(self.pusher_model_dir,MODEL_METADATA_FILE_NAME)
+        self.pusher_evaluation_rows_path = os.path.join(self.pusher_model_dir,EVALUATION_ROWS_FILE_NAME)
 
 
 class BatchPredictionConfig:
@@ -91,6 +252,10 @@ class BatchPredictionConfig:
             self.inbox_dir = os.path.join("data","inbox")
             self.outbox_dir = os.path.join("data","outbox")
             self.archive_dir = os.path.join("data","archive")
+            self.schema_file_path=os.path.join("schema.yaml")
+            #inbox files are compared with the reference profile of the model, see DataValidationConfig
+            self.drift_method = "psi"
+            self.drift_threshold = 0.2
             os.makedirs(self.outbox_dir ,exist_ok=True)
             os.makedirs(self.archive_dir,exist_ok=True)
         except Exception as e:
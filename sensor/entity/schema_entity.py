@@ -0,0 +1,120 @@
+from dataclasses import dataclass,field
+from functools import lru_cache
+import os,sys
+from sensor.exception import SensorException
+from sensor.utils import read_yaml_file,get_schema_dtypes
+
+
+@dataclass(frozen=True)
+class Schema:
+    schema_info:dict
+    target_column:str
+    drop_columns:frozenset
+    required_columns:tuple
+    required_column_set:frozenset
+    na_values:tuple
+    dtypes:dict
+    #column name to (min, max), either bound may be None
+    column_ranges:dict = field(default_factory=dict)
+
+    @classmethod
+    def from_dict(cls,schema_info:dict) -> "Schema":
+        try:
+            column_ranges = {column:(bounds.get("min"),bounds.get("max"))
+                for column,bounds in schema_info.get("column_ranges",{}).items()}
+            return cls(schema_info=schema_info,
+                target_column=schema_info["target_column"],
+                drop_columns=frozenset(schema_info["drop_columns"]),
+                required_columns=tuple(schema_info["required_columns"]),
+                required_column_set=frozenset(schema_info["required_columns"]),
+                na_values=tuple(schema_info.get("na_values",[])),
+                dtypes=get_schema_dtypes(schema_info=schema_info),
+                column_ranges=column_ranges)
+        except Exception as e:
+            raise SensorException(e, sys) from e
+
+    def get_feature_columns(self,columns) -> list:
+        return [column for column in columns if column!=self.target_column and column not in self.drop_columns]
+
+    def validate(self,df,missing_threshold:float) -> dict:
+        """
+        Check a dataframe against the schema in one pass over its columns
+        df: pd.DataFrame data to check, schema drop columns are ignored
+        missing_threshold: float percentage of missing values above which a column is reported
+        return: dict with missing_values_columns, missing_required_columns (required columns absent
+        or above the missing threshold), invalid_dtype_columns and out_of_range_columns
+        """
+        import pandas as pd
+        try:
+            columns = [column for column in df.columns if column not in self.drop_columns]
+            missing_share = df[columns].isna().mean()*100 if len(df) else pd.Series(0.0,index=columns)
+            return self._check(missing_share=missing_share,dtypes=df[columns].dtypes,
+                get_ranges=lambda range_columns:df[range_columns].agg(["min","max"]),
+                missing_threshold=missing_threshold)
+        except Exception as e:
+            raise SensorException(e, sys) from e
+
+    def validate_statistics(self,statistics,missing_threshold:float) -> dict:
+        """
+        Same checks as validate on the merged statistics of a chunk stream
+        statistics: sensor.ml.stats.ColumnStatistics of the data to check
+        missing_threshold: float percentage of missing values above which a column is reported
+        return: dict with the same keys as validate
+        """
+        import pandas as pd
+        try:
+            columns = [column for column in statistics.columns if column not in self.drop_columns]
+            summary = statistics.get_numeric_summary()
+            return self._check(missing_share=statistics.missing_percentage[columns],
+                dtypes=pd.Series(statistics.dtypes)[columns],
+                get_ranges=lambda range_columns:summary.loc[range_columns,["min","max"]].T,
+                missing_threshold=missing_threshold)
+        except Exception as e:
+            raise SensorException(e, sys) from e
+
+    def _check(self,missing_share,dtypes,get_ranges,missing_threshold:float) -> dict:
+        import pandas as pd
+        missing_values_columns = missing_share.index[missing_share>missing_threshold].tolist()
+
+        kept_columns = set(missing_share.index).difference(missing_values_columns)
+        missing_required_columns = [column for column in self.required_columns if column not in kept_columns]
+
+        invalid_dtype_columns = {}
+        for column,dtype in dtypes.items():
+            expected_dtype = self.dtypes.get(column)
+            if expected_dtype is not None and pd.api.types.is_float_dtype(expected_dtype) \
+                and not pd.api.types.is_numeric_dtype(pd.api.types.pandas_dtype(dtype)):
+                invalid_dtype_columns[column] = f"expected {expected_dtype} got {dtype}"
+
+        out_of_range_columns = {}
+        range_columns = [column for column in self.column_ranges if column in kept_columns
+            and column not in invalid_dtype_columns]
+        if range_columns:
+            observed = get_ranges(range_columns)
+            for column in range_columns:
+                lower,upper = self.column_ranges[column]
+                observed_min,observed_max = observed.at["min",column],observed.at["max",column]
+                if (lower is not None and observed_min<lower) or (upper is not None and observed_max>upper):
+                    out_of_range_columns[column] = [float(observed_min),float(observed_max)]
+
+        return {
+            "missing_values_columns":missing_values_columns,
+            "missing_required_columns":missing_required_columns,
+            "invalid_dtype_columns":invalid_dtype_columns,
+            "out_of_range_columns":out_of_range_columns,
+        }
+
+
+@lru_cache(maxsize=None)
+def _load_schema(file_path:str,modified_time:float) -> Schema:
+    return Schema.from_dict(schema_info=read_yaml_file(file_path=file_path))
+
+
+def load_schema(file_path:str) -> Schema:
+    """
+    Parse schema.yaml once per process, the cache is refreshed when the file changes
+    """
+    try:
+        return _load_schema(file_path=os.path.abspath(file_path),modified_time=os.path.getmtime(file_path))
+    except Exception as e:
+        raise SensorException(e, sys) from e
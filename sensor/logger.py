@@ -7,13 +7,22 @@ LOG_FILE_NAME = f"{datetime.now().strftime('%m%d%Y__%H%M%S')}.log"
 
 LOG_DIR = "logs"
 
-os.makedirs(LOG_DIR,exist_ok=True)
-
 LOG_FILE_PATH = os.path.join(LOG_DIR,LOG_FILE_NAME)
 
 
+class LazyFileHandler(logging.FileHandler):
+    """File handler which creates the log directory and file on the first record"""
+
+    def __init__(self,filename:str):
+        super().__init__(filename,delay=True)
+
+    def _open(self):
+        os.makedirs(os.path.dirname(self.baseFilename),exist_ok=True)
+        return super()._open()
+
+
 logging.basicConfig(
-filename=LOG_FILE_PATH,
+handlers=[LazyFileHandler(LOG_FILE_PATH)],
 format="[ %(asctime)s] %(lineno)d %(name)s - %(levelname)s %(message)s",
 level = logging.INFO
-)
\ No newline at end of file
+)
@@ -0,0 +1,150 @@
+from sensor.exception import SensorException
+from sensor.logger import logging
+from concurrent.futures import ProcessPoolExecutor
+from multiprocessing import shared_memory
+import sys
+import time
+import numpy as np
+import xgboost
+
+#set in every fold worker by _init_cv_worker, a view of the one shared copy of the features
+_cv_data = {}
+
+
+def _attach_shared_memory(name:str) -> shared_memory.SharedMemory:
+    try:
+        return shared_memory.SharedMemory(name=name,track=False)
+    except TypeError:
+        #python<3.13 registers attached segments with the resource tracker too, the creating process
+        #owns the segment and unlinks it, so attaching must not register it again
+        from multiprocessing import resource_tracker
+        register = resource_tracker.register
+        resource_tracker.register = lambda name,rtype: None
+        try:
+            return shared_memory.SharedMemory(name=name)
+        finally:
+            resource_tracker.register = register
+
+
+def _init_cv_worker(shm_name:str,shape:tuple,dtype:str,y:np.ndarray) -> None:
+    shm = _attach_shared_memory(name=shm_name)
+    _cv_data["shm"] = shm
+    _cv_data["x"] = np.ndarray(shape,dtype=dtype,buffer=shm.buf)
+    _cv_data["y"] = y
+
+
+class _IndexedDataIter(xgboost.DataIter):
+    """
+    Rows of x selected by index, fed to xgboost one batch at a time so a fold never copies its training rows
+    """
+
+    def __init__(self,x:np.ndarray,y:np.ndarray,index:np.ndarray,batch_rows:int):
+        self.x,self.y,self.index,self.batch_rows = x,y,index,batch_rows
+        self._start = 0
+        super().__init__()
+
+    def next(self,input_data) -> bool:
+        if self._start>=len(self.index):
+            return False
+        batch_index = self.index[self._start:self._start+self.batch_rows]
+        input_data(data=self.x[batch_index],label=self.y[batch_index])
+        self._start+=self.batch_rows
+        return True
+
+    def reset(self) -> None:
+        self._start = 0
+
+
+def _predict_rows(booster:xgboost.Booster,x:np.ndarray,index:np.ndarray,batch_rows:int) -> np.ndarray:
+    return np.concatenate([booster.inplace_predict(x[index[start:start+batch_rows]])
+        for start in range(0,len(index),batch_rows)])>0.5
+
+
+def _run_fold(fold:int,train_index:np.ndarray,valid_index:np.ndarray,params:dict,n_threads:int,
+    batch_rows:int,resampling_params:dict=None) -> dict:
+    from sklearn.metrics import f1_score
+    from sensor.ml.resampling import get_resampler
+    x,y = _cv_data["x"],_cv_data["y"]
+    start_time = time.perf_counter()
+    params = dict(params)
+    num_boost_round = params.pop("n_estimators",100)
+    resampler = None if resampling_params is None else get_resampler(**dict(resampling_params,n_jobs=n_threads))
+    if resampler is None:
+        train_iter = _IndexedDataIter(x=x,y=y,index=train_index,batch_rows=batch_rows)
+    else:
+        #only the training rows of the fold are resampled, the validation fold keeps the real class ratio
+        x_fit,y_fit = resampler.fit_resample(x[train_index],y[train_index])
+        train_iter = _IndexedDataIter(x=x_fit,y=y_fit,index=np.arange(len(y_fit)),batch_rows=batch_rows)
+    dtrain = xgboost.QuantileDMatrix(train_iter,nthread=n_threads)
+    del train_iter
+    booster = xgboost.train({"objective":"binary:logistic","nthread":n_threads,**params},dtrain,num_boost_round=num_boost_round)
+    del dtrain
+    return {
+        "fold":fold,
+        "f1_train":float(f1_score(y_true=y[train_index],y_pred=_predict_rows(booster,x,train_index,batch_rows))),
+        "f1_valid":float(f1_score(y_true=y[valid_index],y_pred=_predict_rows(booster,x,valid_index,batch_rows))),
+        "fit_seconds":round(time.perf_counter()-start_time,3),
+    }
+
+
+def cross_validate(x:np.ndarray,y:np.ndarray,params:dict=None,n_folds:int=5,n_workers:int=1,threads_per_fold:int=1,
+    batch_rows:int=100000,random_state:int=42,resampling_params:dict=None) -> dict:
+    """
+    Stratified k-fold F1 of an xgboost model. The features are copied once into shared memory and
+    every fold worker trains from a view of it, so memory does not grow with the number of folds
+    x: np.ndarray 2d features before any resampling, a memory mapped array is read once into shared memory
+    y: np.ndarray encoded labels
+    params: dict XGBClassifier parameters (tree_method, scale_pos_weight, n_estimators, ...)
+    n_folds: int folds, n_workers: int folds trained at the same time
+    threads_per_fold: int xgboost threads of every fold
+    batch_rows: int rows copied at a time into the fold matrices and predictions
+    resampling_params: dict get_resampler arguments, the training rows of every fold are resampled in
+    its worker so no synthetic row is built from a validation fold, train F1 is scored on the real rows
+    return: dict with the per fold scores and the mean and std of train and validation F1
+    """
+    from sklearn.model_selection import StratifiedKFold
+    try:
+        start_time = time.perf_counter()
+        y = np.asarray(y)
+        folds = list(StratifiedKFold(n_splits=n_folds,shuffle=True,random_state=random_state).split(np.zeros(len(y)),y))
+        fold_args = [(fold,np.sort(train_index),np.sort(valid_index),params or {},threads_per_fold,batch_rows,resampling_params)
+            for fold,(train_index,valid_index) in enumerate(folds)]
+
+        shm = shared_memory.SharedMemory(create=True,size=max(x.nbytes,1))
+        try:
+            shared_x = np.ndarray(x.shape,dtype=x.dtype,buffer=shm.buf)
+            for start in range(0,len(x),batch_rows):
+                shared_x[start:start+batch_rows] = x[start:start+batch_rows]
+            del shared_x
+            logging.info(f"Cross validating {n_folds} folds with {n_workers} workers of {threads_per_fold} threads "
+                f"over {x.nbytes/2**20:.0f} MB of shared features")
+            initargs = (shm.name,x.shape,x.dtype.str,y)
+            if n_workers>1:
+                with ProcessPoolExecutor(max_workers=n_workers,initializer=_init_cv_worker,initargs=initargs) as executor:
+                    fold_scores = list(executor.map(_run_fold,*zip(*fold_args)))
+            else:
+                _init_cv_worker(*initargs)
+                try:
+                    fold_scores = [_run_fold(*args) for args in fold_args]
+                finally:
+                    _cv_data.pop("x",None)
+                    _cv_data.pop("shm").close()
+        finally:
+            shm.close()
+            shm.unlink()
+
+        f1_train = np.array([scores["f1_train"] for scores in fold_scores])
+        f1_valid = np.array([scores["f1_valid"] for scores in fold_scores])
+        cv_scores = {
+            "folds":fold_scores,
+            "f1_train_mean":float(f1_train.mean()),
+            "f1_train_std":float(f1_train.std()),
+            "f1_valid_mean":float(f1_valid.mean()),
+            "f1_valid_std":float(f1_valid.std()),
+            "seconds":round(time.perf_counter()-start_time,3),
+        }
+        logging.info(f"Cross validation F1 valid {cv_scores['f1_valid_mean']:.4f} +- {cv_scores['f1_valid_std']:.4f}, "
+            f"train {cv_scores['f1_train_mean']:.4f} +- {cv_scores['f1_train_std']:.4f}")
+        return cv_scores
+    except Exception as e:
+        raise SensorException(e, sys) from e
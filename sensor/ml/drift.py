@@ -0,0 +1,246 @@
+from sensor.exception import SensorException
+from sensor.logger import logging
+from concurrent.futures import ProcessPoolExecutor
+import sys
+import numpy as np
+import pandas as pd
+from sensor.ml.stats import ColumnStatistics
+
+DRIFT_METHODS = ("ks","psi","wasserstein")
+
+
+def _sorted_cdf_difference(base:np.ndarray,current:np.ndarray):
+    """
+    Sort every column of the pooled samples once and walk the empirical cdfs together
+    base: np.ndarray (n_columns, n_base) with NaN for missing values, one contiguous row per column
+    current: np.ndarray (n_columns, n_current) with NaN for missing values
+    return: sorted values, F_base-F_current after each sorted value, mask of the last value of every tie,
+    valid sample sizes of base and current
+    """
+    base_is_valid,current_is_valid = ~np.isnan(base),~np.isnan(current)
+    n_base,n_current = base_is_valid.sum(axis=1),current_is_valid.sum(axis=1)
+    with np.errstate(divide="ignore",invalid="ignore"):
+        weights = np.concatenate([base_is_valid/n_base[:,None],-(current_is_valid/n_current[:,None])],axis=1)
+    #missing values sort last as +inf (much faster to sort than NaN) and carry no weight,
+    #the order inside a tie does not matter because the cdfs are only compared at the last value of a tie
+    values = np.concatenate([base,current],axis=1)
+    values[np.isnan(values)] = np.inf
+    order = np.argsort(values,axis=1)
+    sorted_values = np.take_along_axis(values,order,axis=1)
+    cdf_difference = np.cumsum(np.nan_to_num(np.take_along_axis(weights,order,axis=1)),axis=1)
+
+    is_last_of_tie = np.ones(sorted_values.shape,dtype=bool)
+    is_last_of_tie[:,:-1] = sorted_values[:,:-1]!=sorted_values[:,1:]
+    return sorted_values,cdf_difference,is_last_of_tie,n_base,n_current
+
+
+def ks_statistic(base:np.ndarray,current:np.ndarray):
+    """
+    Two sample Kolmogorov-Smirnov test for every column, ignoring NaN
+    base, current: np.ndarray (n_columns, n_rows)
+    return: statistics and asymptotic two sided p-values, NaN where a column has no values
+    """
+    #scipy.stats takes longer to import than anything else in the package, only load it for a test
+    from scipy.stats import kstwo
+    _,cdf_difference,is_last_of_tie,n_base,n_current = _sorted_cdf_difference(base=base,current=current)
+    statistic = np.where(is_last_of_tie,np.abs(cdf_difference),0).max(axis=1)
+    with np.errstate(divide="ignore",invalid="ignore"):
+        effective_n = np.round(n_base*n_current/(n_base+n_current))
+        pvalue = np.clip(kstwo.sf(statistic,np.maximum(effective_n,1)),0,1)
+    is_empty = (n_base==0)|(n_current==0)
+    return np.where(is_empty,np.nan,statistic),np.where(is_empty,np.nan,pvalue)
+
+
+def wasserstein_statistic(base:np.ndarray,current:np.ndarray):
+    """
+    First Wasserstein distance for every column, ignoring NaN, scaled by the base standard deviation
+    base, current: np.ndarray (n_columns, n_rows)
+    """
+    sorted_values,cdf_difference,_,n_base,n_current = _sorted_cdf_difference(base=base,current=current)
+    with np.errstate(divide="ignore",invalid="ignore"):
+        deltas = np.diff(sorted_values,axis=1)
+        deltas[~np.isfinite(deltas)] = 0
+        distance = (np.abs(cdf_difference[:,:-1])*deltas).sum(axis=1)
+        base_mean = np.nansum(base,axis=1)/n_base
+        scale = np.sqrt(np.nansum((base-base_mean[:,None])**2,axis=1)/n_base)
+        distance = np.where(scale>0,distance/scale,distance)
+    return np.where((n_base==0)|(n_current==0),np.nan,distance)
+
+
+def psi_statistic(base:np.ndarray,current:np.ndarray,n_bins:int=10,eps:float=1e-4):
+    """
+    Population stability index for every column over base quantile bins, ignoring NaN
+    base, current: np.ndarray (n_columns, n_rows)
+    """
+    statistic = np.full(len(base),np.nan)
+    for index,(base_column,current_column) in enumerate(zip(base,current)):
+        base_column = base_column[~np.isnan(base_column)]
+        current_column = current_column[~np.isnan(current_column)]
+        if len(base_column)==0 or len(current_column)==0:
+            continue
+        edges = np.unique(np.quantile(base_column,np.linspace(0,1,n_bins+1)[1:-1]))
+        base_share = np.bincount(np.searchsorted(edges,base_column,side="right"),minlength=len(edges)+1)/len(base_column)
+        current_share = np.bincount(np.searchsorted(edges,current_column,side="right"),minlength=len(edges)+1)/len(current_column)
+        base_share,current_share = np.maximum(base_share,eps),np.maximum(current_share,eps)
+        statistic[index] = ((current_share-base_share)*np.log(current_share/base_share)).sum()
+    return statistic
+
+
+def _drift_block(base:np.ndarray,current:np.ndarray,method:str):
+    if method=="ks":
+        return ks_statistic(base=base,current=current)
+    if method=="wasserstein":
+        return wasserstein_statistic(base=base,current=current),None
+    return psi_statistic(base=base,current=current),None
+
+
+def _to_numeric_frames(base_df:pd.DataFrame,current_df:pd.DataFrame):
+    base_df,current_df = base_df.copy(deep=False),current_df.copy(deep=False)
+    for column in base_df.columns:
+        if not pd.api.types.is_numeric_dtype(base_df[column]):
+            #ordinal codes over shared categories give the same ks statistic as the labels
+            categories = pd.Index(pd.concat([base_df[column],current_df[column]]).dropna().unique()).sort_values()
+            base_df[column] = pd.Categorical(base_df[column],categories=categories).codes
+            current_df[column] = pd.Categorical(current_df[column],categories=categories).codes
+            base_df[column] = base_df[column].where(base_df[column]>=0)
+            current_df[column] = current_df[column].where(current_df[column]>=0)
+    return base_df,current_df
+
+
+def _subsample(arr:np.ndarray,sample_size:int,random_state:int) -> np.ndarray:
+    if sample_size is None or len(arr)<=sample_size:
+        return arr
+    index = np.sort(np.random.default_rng(random_state).choice(len(arr),size=sample_size,replace=False))
+    return arr[index]
+
+
+def get_drift_report(base_df:pd.DataFrame,current_df:pd.DataFrame,method:str="ks",threshold:float=0.05,
+    n_jobs:int=1,block_size:int=32,sample_size:int=None,random_state:int=42) -> dict:
+    """
+    Compare the distribution of every base column with the same column of current
+    base_df: pd.DataFrame reference data
+    current_df: pd.DataFrame data to compare
+    method: str ks (p-value above threshold means same distribution), psi or wasserstein
+    (statistic below threshold means same distribution)
+    threshold: float decision threshold for the method
+    n_jobs: int processes used for column blocks, 1 computes in process
+    block_size: int columns per block
+    sample_size: int rows sampled with a fixed seed from frames above this size, None uses all rows
+    random_state: int seed used for sampling
+    return: dict column name to drift result
+    """
+    try:
+        if method not in DRIFT_METHODS:
+            raise Exception(f"Unknown drift method: {method}, expected one of {DRIFT_METHODS}")
+        columns = list(base_df.columns)
+        base_df,current_df = _to_numeric_frames(base_df=base_df[columns],current_df=current_df[columns])
+        #one contiguous row per column so every column is sorted in place
+        base = _subsample(base_df.to_numpy(dtype=np.float64),sample_size=sample_size,random_state=random_state).T.copy()
+        current = _subsample(current_df.to_numpy(dtype=np.float64),sample_size=sample_size,random_state=random_state).T.copy()
+        logging.info(f"Computing {method} drift on {len(columns)} columns with {base.shape[1]} base and {current.shape[1]} current rows")
+
+        blocks = [slice(start,start+block_size) for start in range(0,len(columns),block_size)]
+        if n_jobs>1 and len(blocks)>1:
+            with ProcessPoolExecutor(max_workers=n_jobs) as executor:
+                results = list(executor.map(_drift_block,[base[block] for block in blocks],
+                    [current[block] for block in blocks],[method]*len(blocks)))
+        else:
+            results = [_drift_block(base[block],current[block],method) for block in blocks]
+        statistic = np.concatenate([result[0] for result in results])
+
+        drift_report = {}
+        if method=="ks":
+            pvalue = np.concatenate([result[1] for result in results])
+            for column,column_pvalue in zip(columns,pvalue):
+                drift_report[column]={
+                    "pvalues":float(column_pvalue),
+                    "same_distribution":bool(column_pvalue>threshold)
+                }
+        else:
+            for column,column_statistic in zip(columns,statistic):
+                drift_report[column]={
+                    "statistic":float(column_statistic),
+                    "same_distribution":bool(column_statistic<threshold)
+                }
+        return drift_report
+    except Exception as e:
+        raise SensorException(e, sys) from e
+
+
+def _sketch_drift_statistic(base_sketch,current_sketch,method:str,n_bins:int=10,eps:float=1e-4):
+    from scipy.stats import kstwo
+    if method=="psi":
+        edges = np.unique(base_sketch.quantile(np.linspace(0,1,n_bins+1)[1:-1]))
+        base_share = np.diff(np.concatenate([[0],base_sketch.cdf(edges),[1]]))
+        current_share = np.diff(np.concatenate([[0],current_sketch.cdf(edges),[1]]))
+        base_share,current_share = np.maximum(base_share,eps),np.maximum(current_share,eps)
+        return ((current_share-base_share)*np.log(current_share/base_share)).sum(),None
+
+    #both cdfs are piecewise linear between centroids, so the union of centroids is enough
+    grid = np.unique(np.concatenate([[base_sketch.min,base_sketch.max,current_sketch.min,current_sketch.max],
+        base_sketch.centroids,current_sketch.centroids]))
+    cdf_difference = base_sketch.cdf(grid)-current_sketch.cdf(grid)
+    if method=="ks":
+        statistic = np.abs(cdf_difference).max()
+        effective_n = max(round(base_sketch.count*current_sketch.count/(base_sketch.count+current_sketch.count)),1)
+        return statistic,float(np.clip(kstwo.sf(statistic,effective_n),0,1))
+    return (np.abs(cdf_difference[:-1])*np.diff(grid)).sum(),None
+
+
+def get_sketch_drift_report(base_statistics,current_statistics,method:str="ks",threshold:float=0.05) -> dict:
+    """
+    Approximate get_drift_report from the quantile sketches of two statistics accumulators
+    base_statistics: ColumnStatistics of the reference data
+    current_statistics: ColumnStatistics of the data to compare
+    method: str ks, psi or wasserstein, decided against threshold as in get_drift_report
+    threshold: float decision threshold for the method
+    return: dict column name to drift result for the numeric columns of base
+    """
+    try:
+        if method not in DRIFT_METHODS:
+            raise Exception(f"Unknown drift method: {method}, expected one of {DRIFT_METHODS}")
+        base_scale = dict(zip(base_statistics.numeric_columns,np.sqrt(base_statistics.variance)))
+        drift_report = {}
+        for column,base_sketch in base_statistics.sketches.items():
+            current_sketch = current_statistics.sketches.get(column)
+            if current_sketch is None or base_sketch.count==0 or current_sketch.count==0:
+                statistic,pvalue = np.nan,np.nan
+            else:
+                statistic,pvalue = _sketch_drift_statistic(base_sketch=base_sketch,current_sketch=current_sketch,method=method)
+                if method=="wasserstein" and base_scale[column]>0:
+                    statistic = statistic/base_scale[column]
+            if method=="ks":
+                drift_report[column]={
+                    "pvalues":float(pvalue),
+                    "same_distribution":bool(pvalue>threshold)
+                }
+            else:
+                drift_report[column]={
+                    "statistic":float(statistic),
+                    "same_distribution":bool(statistic<threshold)
+                }
+        return drift_report
+    except Exception as e:
+        raise SensorException(e, sys) from e
+
+
+def get_reference_drift_report(reference_statistics,data,method:str="psi",threshold:float=0.2) -> dict:
+    """
+    Compare new data with a saved reference profile, cost grows with the new data only
+    reference_statistics: ColumnStatistics loaded with load_reference_profile
+    data: pd.DataFrame or iterable of pd.DataFrame chunks
+    method: str ks, psi or wasserstein
+    threshold: float decision threshold for the method
+    return: dict column name to drift result for the numeric reference columns present in data
+    """
+    try:
+        chunks = [data] if isinstance(data,pd.DataFrame) else data
+        current_statistics = ColumnStatistics(sketch_size=reference_statistics.sketch_size)
+        for df in chunks:
+            columns = [column for column in reference_statistics.numeric_columns if column in df.columns]
+            current_statistics.update(df=df[columns])
+        logging.info(f"Comparing {current_statistics.n_rows} rows with a reference profile of {reference_statistics.n_rows} rows")
+        return get_sketch_drift_report(base_statistics=reference_statistics.select(columns=current_statistics.columns),
+            current_statistics=current_statistics,method=method,threshold=threshold)
+    except Exception as e:
+        raise SensorException(e, sys) from e
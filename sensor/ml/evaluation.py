@@ -0,0 +1,183 @@
+from sensor.exception import SensorException
+from sensor.logger import logging
+from sensor.utils import load_object,read_yaml_file,write_yaml_file,get_row_hashes
+from sensor.ml.transform import load_transformer,get_transformer_fingerprint
+from concurrent.futures import ThreadPoolExecutor
+import hashlib
+import os,sys
+import time
+import numpy as np
+import pandas as pd
+from sklearn.metrics import f1_score
+
+#metadata.yaml key of the cached scores of a model
+EVALUATION_METADATA_KEY = "evaluation"
+
+
+def get_dataset_hash(row_hashes:np.ndarray) -> str:
+    """
+    Content hash of a dataset from its row hashes, independent of the row order
+    """
+    return hashlib.sha256(np.sort(row_hashes).tobytes()).hexdigest()[:16]
+
+
+def read_evaluation_cache(metadata_path:str) -> dict:
+    """
+    Cached scores of a model: transformer_fingerprint, scores by dataset hash and rows_dataset_hash,
+    the dataset whose per row predictions are saved next to the metadata. None when nothing is cached
+    """
+    try:
+        if metadata_path is None or not os.path.exists(metadata_path):
+            return None
+        return (read_yaml_file(file_path=metadata_path) or {}).get(EVALUATION_METADATA_KEY)
+    except Exception as e:
+        raise SensorException(e, sys) from e
+
+
+def save_evaluation_cache(metadata_path:str,rows_path:str,entry:dict,row_hashes:np.ndarray,y_pred:np.ndarray) -> dict:
+    """
+    Add the score of a leaderboard entry to the cache of its model and replace the saved per row predictions
+    metadata_path: str metadata.yaml of the model, created when missing
+    rows_path: str .npz file of row hashes and predictions
+    entry: dict leaderboard entry of the model
+    return: the updated cache
+    """
+    try:
+        metadata = (read_yaml_file(file_path=metadata_path) or {}) if os.path.exists(metadata_path) else {}
+        cache = metadata.get(EVALUATION_METADATA_KEY) or {}
+        if cache.get("transformer_fingerprint")!=entry["transformer_fingerprint"]:
+            cache = {"transformer_fingerprint":entry["transformer_fingerprint"],"scores":{}}
+        cache["scores"][entry["dataset_hash"]] = {"f1_score":entry["f1_score"],"n_rows":int(len(row_hashes))}
+        cache["rows_dataset_hash"] = entry["dataset_hash"]
+        os.makedirs(os.path.dirname(rows_path),exist_ok=True)
+        with open(rows_path,"wb") as file_obj:
+            np.savez(file_obj,row_hash=row_hashes,y_pred=np.asarray(y_pred,dtype=np.int8))
+        metadata[EVALUATION_METADATA_KEY] = cache
+        write_yaml_file(file_path=metadata_path,data=metadata)
+        return cache
+    except Exception as e:
+        raise SensorException(e, sys) from e
+
+
+def _get_known_predictions(rows_path:str,row_hashes:np.ndarray) -> tuple:
+    """
+    Saved predictions of the rows already scored, (known mask, predictions with -1 for the new rows)
+    """
+    y_pred = np.full(len(row_hashes),-1,dtype=np.int8)
+    if rows_path is None or not os.path.exists(rows_path):
+        return np.zeros(len(row_hashes),dtype=bool),y_pred
+    with np.load(rows_path) as rows:
+        saved_hashes,saved_pred = rows["row_hash"],rows["y_pred"]
+    order = np.argsort(saved_hashes)
+    saved_hashes,saved_pred = saved_hashes[order],saved_pred[order]
+    position = np.minimum(np.searchsorted(saved_hashes,row_hashes),max(len(saved_hashes)-1,0))
+    known = saved_hashes[position]==row_hashes if len(saved_hashes) else np.zeros(len(row_hashes),dtype=bool)
+    y_pred[known] = saved_pred[position[known]]
+    return known,y_pred
+
+
+def _load_preprocessing(candidate:dict) -> tuple:
+    transformer = load_transformer(transformer_path=candidate["transformer_path"],
+        fused_transformer_path=candidate.get("fused_transformer_path"))
+    target_encoder = load_object(file_path=candidate["target_encoder_path"])
+    return transformer,target_encoder,get_transformer_fingerprint(transformer=transformer)
+
+
+def evaluate_candidates(candidates:list,test_df:pd.DataFrame,target_column:str,n_workers:int=1,
+    threads_per_candidate:int=None) -> tuple:
+    """
+    F1 of several models on one test set. A candidate whose cache holds a score for the content hash
+    of the test set is not loaded at all; otherwise only the rows missing from its saved predictions
+    are scored. The rows to score are transformed once per transformer fingerprint and the same array
+    is handed to every candidate sharing it; loading and scoring run in a thread pool, xgboost
+    releases the GIL while predicting
+    candidates: list of dict with name, model_path, transformer_path, fused_transformer_path and target_encoder_path,
+        optionally metadata_path and evaluation_rows_path of the cache
+    test_df: pd.DataFrame test rows with the target column
+    target_column: str label column
+    n_workers: int threads loading and scoring candidates
+    threads_per_candidate: int xgboost threads of every model, None keeps the saved setting
+    return: leaderboard, list of dict sorted by f1_score with the rank of every candidate, and the
+        row hashes and per row predictions of the candidates scored in this call by name
+    """
+    try:
+        with ThreadPoolExecutor(max_workers=n_workers) as executor:
+            start_time = time.perf_counter()
+            row_hashes = get_row_hashes(df=test_df,sort_columns=True)
+            dataset_hash = get_dataset_hash(row_hashes=row_hashes)
+            caches = list(executor.map(lambda candidate:read_evaluation_cache(candidate.get("metadata_path")),candidates))
+
+            leaderboard,to_score = [],[]
+            for candidate,cache in zip(candidates,caches):
+                if cache is not None and dataset_hash in (cache.get("scores") or {}):
+                    leaderboard.append({
+                        "name":candidate["name"],
+                        "model_path":candidate["model_path"],
+                        "transformer_fingerprint":cache["transformer_fingerprint"],
+                        "dataset_hash":dataset_hash,
+                        "f1_score":float(cache["scores"][dataset_hash]["f1_score"]),
+                        "scored_rows":0,
+                        "seconds":0.0,
+                    })
+                else:
+                    to_score.append((candidate,cache))
+            preprocessing = list(executor.map(lambda item:_load_preprocessing(item[0]),to_score))
+
+            #rows each candidate still has to score, the predictions it already saved fill in the rest
+            known_predictions = []
+            for (candidate,cache),(_,_,fingerprint) in zip(to_score,preprocessing):
+                if cache is not None and cache.get("transformer_fingerprint")==fingerprint:
+                    known_predictions.append(_get_known_predictions(candidate.get("evaluation_rows_path"),row_hashes))
+                else:
+                    known_predictions.append(_get_known_predictions(None,row_hashes))
+
+            #one transformed matrix per distinct transformer over the rows any of its candidates needs
+            transformers,needed = {},{}
+            for (transformer,_,fingerprint),(known,_) in zip(preprocessing,known_predictions):
+                transformers.setdefault(fingerprint,transformer)
+                needed[fingerprint] = needed.get(fingerprint,np.zeros(len(test_df),dtype=bool))|~known
+            def transform(item):
+                fingerprint,transformer = item
+                row_index = np.flatnonzero(needed[fingerprint])
+                rows = test_df.iloc[row_index][list(transformer.feature_names_in_)]
+                return fingerprint,(row_index,transformer.transform(rows) if len(row_index) else None)
+            matrices = dict(executor.map(transform,transformers.items()))
+            labels = {}
+            for _,target_encoder,_ in preprocessing:
+                classes = tuple(target_encoder.classes_)
+                if classes not in labels:
+                    labels[classes] = target_encoder.transform(test_df[target_column])
+            logging.info(f"{len(leaderboard)} of {len(candidates)} candidates cached for dataset {dataset_hash}, "
+                f"transformed {sum(len(row_index) for row_index,_ in matrices.values())} rows for "
+                f"{len(matrices)} distinct transformers in {time.perf_counter()-start_time:.2f}s")
+
+            def score(item):
+                (candidate,_),(_,target_encoder,fingerprint),(known,y_pred) = item
+                start_time = time.perf_counter()
+                y_pred = y_pred.copy()
+                row_index,matrix = matrices[fingerprint]
+                new_index = np.flatnonzero(~known)
+                if len(new_index):
+                    model = load_object(file_path=candidate["model_path"])
+                    if threads_per_candidate is not None:
+                        model.set_params(n_jobs=threads_per_candidate)
+                    y_pred[new_index] = model.predict(matrix[np.searchsorted(row_index,new_index)])
+                return {
+                    "name":candidate["name"],
+                    "model_path":candidate["model_path"],
+                    "transformer_fingerprint":fingerprint,
+                    "dataset_hash":dataset_hash,
+                    "f1_score":float(f1_score(y_true=labels[tuple(target_encoder.classes_)],y_pred=y_pred)),
+                    "scored_rows":int(len(new_index)),
+                    "seconds":round(time.perf_counter()-start_time,3),
+                },y_pred
+            scored = list(executor.map(score,zip(to_score,preprocessing,known_predictions)))
+
+        leaderboard.extend(entry for entry,_ in scored)
+        leaderboard.sort(key=lambda entry:entry["f1_score"],reverse=True)
+        for rank,entry in enumerate(leaderboard,start=1):
+            entry["rank"] = rank
+        predictions = {entry["name"]:(row_hashes,y_pred) for entry,y_pred in scored}
+        return leaderboard,predictions
+    except Exception as e:
+        raise SensorException(e, sys) from e
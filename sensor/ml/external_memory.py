@@ -0,0 +1,76 @@
+from sensor.exception import SensorException
+from sensor.utils import get_transformed_file_paths,load_numpy_array_data
+import os,sys
+import numpy as np
+import xgboost
+
+
+class TransformedDataIter(xgboost.DataIter):
+    """
+    Feeds the x/y files of a transformed data directory to xgboost batch by batch.
+    Features are memory mapped, so only the batch being copied is resident.
+    index: sorted rows to feed, all rows when None
+    """
+
+    def __init__(self,dir_path:str,batch_rows:int=100000,cache_prefix:str=None,index:np.ndarray=None):
+        self.file_paths = get_transformed_file_paths(dir_path=dir_path)
+        self.batch_rows = batch_rows
+        #(shard, rows of the shard) per batch, a slice when every row is fed
+        self._batches = []
+        offset = 0
+        for shard,(_,y_path) in enumerate(self.file_paths):
+            n_rows = len(load_numpy_array_data(file_path=y_path,mmap_mode="r"))
+            if index is None:
+                self._batches.extend((shard,slice(start,start+batch_rows)) for start in range(0,n_rows,batch_rows))
+            else:
+                shard_index = index[np.searchsorted(index,offset):np.searchsorted(index,offset+n_rows)]-offset
+                self._batches.extend((shard,shard_index[start:start+batch_rows]) for start in range(0,len(shard_index),batch_rows))
+            offset+=n_rows
+        self._position = 0
+        super().__init__(cache_prefix=cache_prefix)
+
+    def next(self,input_data) -> bool:
+        if self._position==len(self._batches):
+            return False
+        shard,rows = self._batches[self._position]
+        x_path,y_path = self.file_paths[shard]
+        x = load_numpy_array_data(file_path=x_path,mmap_mode="r")
+        y = load_numpy_array_data(file_path=y_path,mmap_mode="r")
+        input_data(data=np.ascontiguousarray(x[rows]),label=np.asarray(y[rows]))
+        self._position+=1
+        return True
+
+    def reset(self) -> None:
+        self._position = 0
+
+
+def get_external_memory_dmatrix(dir_path:str,cache_dir:str,batch_rows:int=100000,max_bin:int=256,
+    nthread:int=None) -> xgboost.ExtMemQuantileDMatrix:
+    """
+    Quantized training matrix built from a transformed data directory without loading it,
+    the gradient index pages are cached on disk under cache_dir
+    """
+    try:
+        os.makedirs(cache_dir,exist_ok=True)
+        data_iter = TransformedDataIter(dir_path=dir_path,batch_rows=batch_rows,
+            cache_prefix=os.path.join(cache_dir,"cache"))
+        return xgboost.ExtMemQuantileDMatrix(data_iter,max_bin=max_bin,nthread=nthread)
+    except Exception as e:
+        raise SensorException(e, sys) from e
+
+
+def predict_in_batches(model,dir_path:str,batch_rows:int=100000) -> tuple:
+    """
+    Labels and predicted labels of a transformed data directory, predicted one memory mapped batch at a time
+    return: tuple of true and predicted labels
+    """
+    try:
+        y_true,y_pred = [],[]
+        for x_path,y_path in get_transformed_file_paths(dir_path=dir_path):
+            x = load_numpy_array_data(file_path=x_path,mmap_mode="r")
+            y_true.append(load_numpy_array_data(file_path=y_path))
+            for start in range(0,len(x),batch_rows):
+                y_pred.append(model.predict(x[start:start+batch_rows]))
+        return np.concatenate(y_true),np.concatenate(y_pred)
+    except Exception as e:
+        raise SensorException(e, sys) from e
@@ -1,35 +1,223 @@
 from sensor.exception import SensorException
+from sensor.logger import logging
 import os,sys
+import fcntl
+import hashlib
+import json
+from contextlib import contextmanager
+from datetime import datetime
 from typing import Optional
 from sensor.entity.config_entity import (TRANSFORMER_OBJECT_FILE_NAME,
+                                        FUSED_TRANSFORMER_OBJECT_FILE_NAME,
                                         MODEL_FILE_NAME,
-                                        TARGET_ENCODER_OBJECT_FILE_NAME)
+                                        TARGET_ENCODER_OBJECT_FILE_NAME,
+                                        REFERENCE_PROFILE_FILE_NAME,
+                                        MODEL_METADATA_FILE_NAME,
+                                        EVALUATION_ROWS_FILE_NAME)
+
+MANIFEST_FILE_NAME = "manifest.json"
+MANIFEST_LOCK_FILE_NAME = ".manifest.lock"
+#versions are written here and renamed into the registry once complete
+STAGING_DIR_NAME = ".staging"
+#objects hashed when a version is published, metadata.yaml and the evaluation cache are updated afterwards
+HASHED_OBJECTS = ("model_path","transformer_path","fused_transformer_path","target_encoder_path","reference_profile_path")
 
 class ModelResolver:
+    """
+    Versions of the model registry. manifest.json indexes the published versions with their
+    paths, object hashes and metrics; a new version is allocated under a file lock, written in
+    a staging directory and published by renaming it into the registry. Scanning the version
+    directories is only used to rebuild a missing manifest
+    """
 
 
     def __init__(self,model_registry:str = "saved_models",
                 transformer_dir_name="transformer",
                 target_encoder_dir_name = "target_encoder",
-                model_dir_name = "model" ):
+                model_dir_name = "model",
+                reference_profile_dir_name = "reference_profile"):
         try:
             self.model_registry=model_registry
             os.makedirs(self.model_registry,exist_ok=True)
             self.transformer_dir_name = transformer_dir_name
             self.target_encoder_dir_name=target_encoder_dir_name
             self.model_dir_name=model_dir_name
+            self.reference_profile_dir_name=reference_profile_dir_name
+            self.manifest_path = os.path.join(self.model_registry,MANIFEST_FILE_NAME)
+            self._manifest = None
+            self._manifest_stat = None
+            #version allocated by this resolver and not published yet
+            self._save_version = None
+
+        except Exception as e:
+            raise SensorException(e, sys) from e
+
+    @contextmanager
+    def _lock(self):
+        with open(os.path.join(self.model_registry,MANIFEST_LOCK_FILE_NAME),"a") as lock_file:
+            fcntl.flock(lock_file,fcntl.LOCK_EX)
+            try:
+                yield
+            finally:
+                fcntl.flock(lock_file,fcntl.LOCK_UN)
+
+    def _write_manifest(self,manifest:dict) -> None:
+        tmp_path = f"{self.manifest_path}.{os.getpid()}.tmp"
+        with open(tmp_path,"w") as file_obj:
+            json.dump(manifest,file_obj,indent=2)
+            file_obj.flush()
+            os.fsync(file_obj.fileno())
+        os.replace(tmp_path,self.manifest_path)
+        self._manifest,self._manifest_stat = None,None
+
+    def _read_manifest(self) -> Optional[dict]:
+        """
+        Manifest on disk, re-read only when the file was replaced since the last read
+        """
+        try:
+            stat = os.stat(self.manifest_path)
+        except FileNotFoundError:
+            return None
+        if self._manifest is None or self._manifest_stat!=(stat.st_ino,stat.st_mtime_ns):
+            with open(self.manifest_path) as file_obj:
+                self._manifest = json.load(file_obj)
+            self._manifest_stat = (stat.st_ino,stat.st_mtime_ns)
+        return self._manifest
 
+    def _hash_objects(self,dir_path:str) -> dict:
+        hashes = {}
+        for name,file_path in self.get_object_paths(dir_path=dir_path).items():
+            if name in HASHED_OBJECTS and os.path.exists(file_path):
+                sha256 = hashlib.sha256()
+                with open(file_path,"rb") as file_obj:
+                    for chunk in iter(lambda: file_obj.read(2**20),b""):
+                        sha256.update(chunk)
+                hashes[name] = sha256.hexdigest()
+        return hashes
+
+    def _scan_registry(self) -> dict:
+        """
+        Manifest of the version directories holding a model, the slow path of a missing manifest
+        """
+        import yaml
+        versions,allocated = {},[-1]
+        staging_dir = os.path.join(self.model_registry,STAGING_DIR_NAME)
+        for dir_name in os.listdir(staging_dir) if os.path.isdir(staging_dir) else []:
+            if dir_name.isdigit():
+                allocated.append(int(dir_name))
+        for dir_name in os.listdir(self.model_registry):
+            if not dir_name.isdigit():
+                continue
+            allocated.append(int(dir_name))
+            dir_path = os.path.join(self.model_registry,dir_name)
+            if not os.path.exists(os.path.join(dir_path,self.model_dir_name,MODEL_FILE_NAME)):
+                continue
+            metrics = {}
+            metadata_path = os.path.join(dir_path,MODEL_METADATA_FILE_NAME)
+            if os.path.exists(metadata_path):
+                with open(metadata_path) as file_obj:
+                    metadata = yaml.safe_load(file_obj) or {}
+                metrics = {key:metadata[key] for key in ("f1_train_score","f1_test_score") if key in metadata}
+            versions[str(int(dir_name))] = {"dir_name":dir_name,"hashes":self._hash_objects(dir_path=dir_path),
+                "metrics":metrics,"published_at":None}
+        return {
+            "latest_version":max(map(int,versions),default=None),
+            "next_version":max(allocated)+1,
+            "versions":versions,
+        }
+
+    def rebuild_manifest(self) -> dict:
+        """
+        Re-index the registry from its version directories, for a lost manifest or versions copied in by hand
+        """
+        try:
+            with self._lock():
+                manifest = self._scan_registry()
+                current = self._read_manifest()
+                if current is not None:
+                    #never hand out a version number twice
+                    manifest["next_version"] = max(manifest["next_version"],current["next_version"])
+                self._write_manifest(manifest=manifest)
+            logging.info(f"Rebuilt {self.manifest_path} with {len(manifest['versions'])} versions")
+            return manifest
+        except Exception as e:
+            raise SensorException(e, sys) from e
+
+    def _get_manifest_locked(self) -> dict:
+        manifest = self._read_manifest()
+        if manifest is None:
+            logging.info(f"{self.manifest_path} not found, scanning the registry")
+            self._write_manifest(manifest=self._scan_registry())
+            manifest = self._read_manifest()
+        return manifest
+
+    def get_manifest(self) -> dict:
+        try:
+            manifest = self._read_manifest()
+            if manifest is None:
+                with self._lock():
+                    manifest = self._get_manifest_locked()
+            return manifest
         except Exception as e:
             raise SensorException(e, sys) from e
 
     def get_latest_dir_path(self) -> Optional[str]:
         try:
-            dir_names = os.listdir(self.model_registry)
-            if len(dir_names)==0:
+            manifest = self.get_manifest()
+            if manifest["latest_version"] is None:
                 return None
-            dir_names = list(map(int,dir_names))
-            latest_dir_name = max(dir_names)
-            return os.path.join(self.model_registry,f"{latest_dir_name}")
+            version = manifest["versions"][str(manifest["latest_version"])]
+            return os.path.join(self.model_registry,version["dir_name"])
+        except Exception as e:
+            raise SensorException(e, sys) from e
+    
+    def get_dir_paths(self) -> list:
+        """
+        Registry version directories holding a model, newest first
+        """
+        try:
+            versions = self.get_manifest()["versions"]
+            return [os.path.join(self.model_registry,versions[version]["dir_name"])
+                for version in sorted(versions,key=int,reverse=True)]
+        except Exception as e:
+            raise SensorException(e, sys) from e
+
+    def get_object_paths(self,dir_path:str) -> dict:
+        """
+        Paths of the objects saved in one registry version directory
+        """
+        return {
+            "model_path":os.path.join(dir_path,self.model_dir_name,MODEL_FILE_NAME),
+            "transformer_path":os.path.join(dir_path,self.transformer_dir_name,TRANSFORMER_OBJECT_FILE_NAME),
+            "fused_transformer_path":os.path.join(dir_path,self.transformer_dir_name,FUSED_TRANSFORMER_OBJECT_FILE_NAME),
+            "target_encoder_path":os.path.join(dir_path,self.target_encoder_dir_name,TARGET_ENCODER_OBJECT_FILE_NAME),
+            "reference_profile_path":os.path.join(dir_path,self.reference_profile_dir_name,REFERENCE_PROFILE_FILE_NAME),
+            "metadata_path":os.path.join(dir_path,MODEL_METADATA_FILE_NAME),
+            "evaluation_rows_path":os.path.join(dir_path,EVALUATION_ROWS_FILE_NAME),
+        }
+
+    def publish_version(self,metrics:dict=None) -> str:
+        """
+        Move the version written through the get_latest_save_* paths into the registry and index it
+        metrics: dict stored with the version in the manifest
+        return: published version directory
+        """
+        try:
+            if self._save_version is None:
+                raise Exception("No version was allocated to publish")
+            version,staging_path = self._save_version,self.get_latest_save_dir_path()
+            dir_path = os.path.join(self.model_registry,f"{version}")
+            hashes = self._hash_objects(dir_path=staging_path)
+            with self._lock():
+                manifest = self._get_manifest_locked()
+                os.rename(staging_path,dir_path)
+                manifest["versions"][f"{version}"] = {"dir_name":f"{version}","hashes":hashes,"metrics":metrics or {},
+                    "published_at":datetime.now().isoformat()}
+                manifest["latest_version"] = max(version,manifest["latest_version"] if manifest["latest_version"] is not None else -1)
+                self._write_manifest(manifest=manifest)
+            self._save_version = None
+            logging.info(f"Published model registry version {dir_path}")
+            return dir_path
         except Exception as e:
             raise SensorException(e, sys) from e
     
@@ -51,6 +239,15 @@ class ModelResolver:
         except Exception as e:
             raise SensorException(e, sys) from e
 
+    def get_latest_fused_transformer_path(self):
+        try:
+            latest_dir = self.get_latest_dir_path()
+            if latest_dir is None:
+                raise Exception("Transformer is not available")
+            return os.path.join(latest_dir,self.transformer_dir_name,FUSED_TRANSFORMER_OBJECT_FILE_NAME)
+        except Exception as e:
+            raise SensorException(e, sys) from e
+
     def get_latest_target_encoder_path(self):
         try:
             latest_dir = self.get_latest_dir_path()
@@ -60,14 +257,37 @@ class ModelResolver:
         except Exception as e:
             raise SensorException(e, sys) from e
 
+    def get_latest_reference_profile_path(self):
+        try:
+            latest_dir = self.get_latest_dir_path()
+            if latest_dir is None:
+                raise Exception("Reference profile is not available")
+            return os.path.join(latest_dir,self.reference_profile_dir_name,REFERENCE_PROFILE_FILE_NAME)
+        except Exception as e:
+            raise SensorException(e, sys) from e
 
-    def get_latest_save_dir_path(self) -> str:
+    def get_latest_metadata_path(self):
         try:
             latest_dir = self.get_latest_dir_path()
             if latest_dir is None:
-                return os.path.join(self.model_registry, 0)
-            latest_dir_num = int(os.path.basename(self.get_latest_dir_path()))
-            return os.path.join(self.model_registry,f"{latest_dir_num+1}")
+                raise Exception("Model metadata is not available")
+            return os.path.join(latest_dir,MODEL_METADATA_FILE_NAME)
+        except Exception as e:
+            raise SensorException(e, sys) from e
+
+
+    def get_latest_save_dir_path(self) -> str:
+        """
+        Staging directory of the next version, allocated once per resolver so concurrent pushers never share one
+        """
+        try:
+            if self._save_version is None:
+                with self._lock():
+                    manifest = self._get_manifest_locked()
+                    self._save_version = manifest["next_version"]
+                    manifest["next_version"]+=1
+                    self._write_manifest(manifest=manifest)
+            return os.path.join(self.model_registry,STAGING_DIR_NAME,f"{self._save_version}")
         except Exception as e:
             raise SensorException(e, sys) from e
 
@@ -85,9 +305,37 @@ class ModelResolver:
         except Exception as e:
             raise SensorException(e, sys) from e
 
+    def get_latest_save_fused_transformer_path(self):
+        try:
+            latest_dir = self.get_latest_save_dir_path()
+            return os.path.join(latest_dir,self.transformer_dir_name,FUSED_TRANSFORMER_OBJECT_FILE_NAME)
+        except Exception as e:
+            raise SensorException(e, sys) from e
+
     def get_latest_save_target_encoder_path(self):
         try:
             latest_dir = self.get_latest_save_dir_path()
             return os.path.join(latest_dir,self.target_encoder_dir_name,TARGET_ENCODER_OBJECT_FILE_NAME)
         except Exception as e:
             raise SensorException(e, sys) from e
+
+    def get_latest_save_reference_profile_path(self):
+        try:
+            latest_dir = self.get_latest_save_dir_path()
+            return os.path.join(latest_dir,self.reference_profile_dir_name,REFERENCE_PROFILE_FILE_NAME)
+        except Exception as e:
+            raise SensorException(e, sys) from e
+
+    def get_latest_save_metadata_path(self):
+        try:
+            latest_dir = self.get_latest_save_dir_path()
+            return os.path.join(latest_dir,MODEL_METADATA_FILE_NAME)
+        except Exception as e:
+            raise SensorException(e, sys) from e
+
+    def get_latest_save_evaluation_rows_path(self):
+        try:
+            latest_dir = self.get_latest_save_dir_path()
+            return os.path.join(latest_dir,EVALUATION_ROWS_FILE_NAME)
+        except Exception as e:
+            raise SensorException(e, sys) from e
@@ -0,0 +1,227 @@
+from sensor.exception import SensorException
+from sensor.utils import (get_transformed_file_paths,load_numpy_array_data,load_transformed_target,
+                          open_transformed_features,write_transformed_rows,save_transformed_target)
+import os,sys
+import shutil
+import tempfile
+import numpy as np
+
+RESAMPLING_STRATEGIES = ("none","smote","undersample","smote_tomek")
+
+
+def get_resampler(strategy:str,random_state:int=42,n_jobs:int=None,k_neighbors:int=5,sampling_strategy="auto"):
+    """
+    Build the class rebalancing step applied to the training set only
+    strategy: str none (no resampling, the model weights the positive class instead),
+    smote (synthetic minority rows, neighbours searched over the minority class with n_jobs workers),
+    undersample (random rows of the majority class are dropped) or smote_tomek (smote then removal of
+    tomek links, exact neighbour search over every row)
+    random_state: int seed of the resampler
+    n_jobs: int workers of the neighbour searches
+    k_neighbors: int neighbours used to create synthetic rows
+    sampling_strategy: str or float target minority/majority ratio, see imblearn
+    return: object with fit_resample or None for strategy none
+    """
+    try:
+        if strategy not in RESAMPLING_STRATEGIES:
+            raise Exception(f"Unknown resampling strategy: {strategy}, expected one of {RESAMPLING_STRATEGIES}")
+        if strategy=="none":
+            return None
+        if strategy=="undersample":
+            from imblearn.under_sampling import RandomUnderSampler
+            return RandomUnderSampler(sampling_strategy=sampling_strategy,random_state=random_state)
+
+        from imblearn.over_sampling import SMOTE
+        from sklearn.neighbors import NearestNeighbors
+        smote = SMOTE(sampling_strategy=sampling_strategy,random_state=random_state,
+            k_neighbors=NearestNeighbors(n_neighbors=k_neighbors+1,n_jobs=n_jobs))
+        if strategy=="smote":
+            return smote
+        from imblearn.combine import SMOTETomek
+        from imblearn.under_sampling import TomekLinks
+        return SMOTETomek(smote=smote,tomek=TomekLinks(n_jobs=n_jobs),random_state=random_state)
+    except Exception as e:
+        raise SensorException(e, sys) from e
+
+
+class TransformedRows:
+    """
+    Rows of one or more transformed data directories seen as one memory mapped matrix,
+    only the rows taken or the batch being iterated are resident
+    """
+
+    def __init__(self,dir_paths:list):
+        self.shards,offset = [],0
+        for dir_path in dir_paths:
+            for x_path,_ in get_transformed_file_paths(dir_path=dir_path):
+                x = load_numpy_array_data(file_path=x_path,mmap_mode="r")
+                self.shards.append((offset,x))
+                offset+=len(x)
+        self.n_rows = offset
+        self.n_columns = self.shards[0][1].shape[1]
+
+    def take(self,index:np.ndarray) -> np.ndarray:
+        """
+        Rows of a sorted index
+        """
+        parts = []
+        for offset,x in self.shards:
+            low,high = np.searchsorted(index,[offset,offset+len(x)])
+            if low<high:
+                parts.append(x[index[low:high]-offset])
+        return np.concatenate(parts) if parts else np.empty((0,self.n_columns),dtype=np.float32)
+
+    def iter_batches(self,batch_rows:int):
+        """
+        (first row, rows) of consecutive batches
+        """
+        for offset,x in self.shards:
+            for start in range(0,len(x),batch_rows):
+                yield offset+start,np.asarray(x[start:start+batch_rows])
+
+
+def get_nearest_rows(rows:TransformedRows,query_index:np.ndarray,n_jobs:int=None,batch_rows:int=50000) -> np.ndarray:
+    """
+    Nearest other row of every query row, an exact search that fits one batch of rows at a time
+    and queries it with every batch of query rows, keeping the closest row found so far
+    rows: TransformedRows to search
+    query_index: np.ndarray sorted rows to find the neighbour of
+    return: np.ndarray row index of the nearest neighbour of every query row
+    """
+    from sklearn.neighbors import NearestNeighbors
+    best_distance = np.full(len(query_index),np.inf)
+    best_index = np.full(len(query_index),-1,dtype=np.int64)
+    for start,x in rows.iter_batches(batch_rows=batch_rows):
+        nearest_neighbors = NearestNeighbors(n_neighbors=min(2,len(x)),algorithm="brute",n_jobs=n_jobs).fit(x)
+        for query_start in range(0,len(query_index),batch_rows):
+            query_rows = query_index[query_start:query_start+batch_rows]
+            distance,index = nearest_neighbors.kneighbors(rows.take(query_rows))
+            index+=start
+            #a query row inside the batch finds itself first, its second neighbour is the nearest other row
+            is_self = index[:,0]==query_rows
+            if index.shape[1]==1:
+                distance,index = np.where(is_self,np.inf,distance[:,0]),index[:,0]
+            else:
+                column = is_self.astype(np.intp)
+                distance,index = distance[np.arange(len(index)),column],index[np.arange(len(index)),column]
+            closer = distance<best_distance[query_start:query_start+batch_rows]
+            best_distance[query_start:query_start+batch_rows][closer] = distance[closer]
+            best_index[query_start:query_start+batch_rows][closer] = index[closer]
+    return best_index
+
+
+def get_tomek_link_rows(rows:TransformedRows,y:np.ndarray,minority_label,n_jobs:int=None,batch_rows:int=50000) -> np.ndarray:
+    """
+    Rows of the other classes forming a tomek link (mutual nearest neighbours of different classes)
+    with a row of minority_label, the rows TomekLinks removes after smote
+    return: np.ndarray sorted row index
+    """
+    minority_index = np.flatnonzero(y==minority_label)
+    nearest = get_nearest_rows(rows=rows,query_index=minority_index,n_jobs=n_jobs,batch_rows=batch_rows)
+    candidates = np.unique(nearest[y[nearest]!=minority_label])
+    if len(candidates)==0:
+        return candidates
+    candidate_nearest = get_nearest_rows(rows=rows,query_index=candidates,n_jobs=n_jobs,batch_rows=batch_rows)
+    position = np.minimum(np.searchsorted(minority_index,candidate_nearest),len(minority_index)-1)
+    is_link = (y[candidate_nearest]==minority_label)&(nearest[position]==candidates)
+    return candidates[is_link]
+
+
+def write_smote_rows(rows:TransformedRows,y:np.ndarray,dir_path:str,random_state:np.random.RandomState,
+    n_jobs:int=None,k_neighbors:int=5,sampling_strategy="auto",batch_rows:int=50000) -> np.ndarray:
+    """
+    Write the synthetic rows of SMOTE into dir_path batch by batch: a row interpolated between a random
+    row of the oversampled class and one of its k_neighbors nearest neighbours. Only the rows of the
+    class being oversampled and one batch of synthetic rows are held in memory
+    return: np.ndarray labels of the synthetic rows, empty when none are needed
+    """
+    from imblearn.utils import check_sampling_strategy
+    from sklearn.neighbors import NearestNeighbors
+    targets = {label:int(n_samples) for label,n_samples in
+        check_sampling_strategy(sampling_strategy,y,"over-sampling").items() if n_samples>0}
+    if not targets:
+        return np.empty(0,dtype=np.int8)
+    shards = open_transformed_features(dir_path=dir_path,n_rows=sum(targets.values()),n_columns=rows.n_columns)
+    start,labels = 0,[]
+    for label,n_samples in targets.items():
+        x_class = rows.take(np.flatnonzero(y==label))
+        neighbors = NearestNeighbors(n_neighbors=k_neighbors+1,n_jobs=n_jobs).fit(x_class).kneighbors(
+            x_class,return_distance=False)[:,1:]
+        for batch_start in range(0,n_samples,batch_rows):
+            n_batch = min(batch_rows,n_samples-batch_start)
+            base = random_state.randint(len(x_class),size=n_batch)
+            neighbor = neighbors[base,random_state.randint(k_neighbors,size=n_batch)]
+            gap = random_state.uniform(size=(n_batch,1)).astype(np.float32)
+            write_transformed_rows(shards=shards,start=start,arr=x_class[base]+gap*(x_class[neighbor]-x_class[base]))
+            start+=n_batch
+        labels.append(np.full(n_samples,label,dtype=np.int8))
+    for _,shard in shards:
+        shard.flush()
+    del shards
+    return np.concatenate(labels)
+
+
+def resample_in_chunks(dir_path:str,output_dir:str,strategy:str,random_state:int=42,n_jobs:int=None,k_neighbors:int=5,
+    sampling_strategy="auto",batch_rows:int=50000,shard_rows:int=None) -> int:
+    """
+    Resample a transformed data directory into output_dir without loading it, the bounded memory
+    counterpart of get_resampler: the rows are memory mapped and read back one batch at a time,
+    only the labels, the rows of the oversampled class and the neighbour search state are kept.
+    Kept rows come first in their order, then the synthetic rows, like imblearn
+    dir_path: str transformed data directory to resample
+    output_dir: str directory receiving the resampled rows, different from dir_path
+    strategy, random_state, n_jobs, k_neighbors, sampling_strategy: see get_resampler
+    batch_rows: int rows read, generated or searched at a time
+    shard_rows: int rows per shard of output_dir, None writes a single x.npy
+    return: int rows written
+    """
+    try:
+        from imblearn.utils import check_sampling_strategy
+        if strategy not in RESAMPLING_STRATEGIES:
+            raise Exception(f"Unknown resampling strategy: {strategy}, expected one of {RESAMPLING_STRATEGIES}")
+        y = load_transformed_target(dir_path=dir_path)
+        rows = TransformedRows(dir_paths=[dir_path])
+        random_state = np.random.RandomState(random_state)
+        keep = np.arange(len(y))
+        synthetic_dir = tempfile.mkdtemp(prefix="smote_",dir=os.path.dirname(os.path.abspath(output_dir)))
+        try:
+            if strategy=="undersample":
+                targets = check_sampling_strategy(sampling_strategy,y,"under-sampling")
+                keep = np.sort(np.concatenate([random_state.choice(np.flatnonzero(y==label),size=int(targets[label]),replace=False)
+                    if label in targets else np.flatnonzero(y==label) for label in np.unique(y)]))
+            elif strategy in ("smote","smote_tomek"):
+                y_synthetic = write_smote_rows(rows=rows,y=y,dir_path=synthetic_dir,random_state=random_state,
+                    n_jobs=n_jobs,k_neighbors=k_neighbors,sampling_strategy=sampling_strategy,batch_rows=batch_rows)
+                if len(y_synthetic):
+                    rows = TransformedRows(dir_paths=[dir_path,synthetic_dir])
+                    keep = np.arange(len(y)+len(y_synthetic))
+                if strategy=="smote_tomek":
+                    #links are cleaned on the class that was not oversampled, whatever the counts after smote
+                    labels,counts = np.unique(y,return_counts=True)
+                    y = np.concatenate([y,y_synthetic])
+                    keep = np.setdiff1d(keep,get_tomek_link_rows(rows=rows,y=y,minority_label=labels[np.argmin(counts)],
+                        n_jobs=n_jobs,batch_rows=batch_rows))
+                else:
+                    y = np.concatenate([y,y_synthetic])
+
+            shards = open_transformed_features(dir_path=output_dir,n_rows=len(keep),n_columns=rows.n_columns,
+                shard_rows=shard_rows)
+            for start in range(0,len(keep),batch_rows):
+                write_transformed_rows(shards=shards,start=start,arr=rows.take(keep[start:start+batch_rows]))
+            for _,shard in shards:
+                shard.flush()
+            del shards,rows
+            save_transformed_target(dir_path=output_dir,target_feature_arr=y[keep],shard_rows=shard_rows)
+        finally:
+            shutil.rmtree(synthetic_dir,ignore_errors=True)
+        return len(keep)
+    except Exception as e:
+        raise SensorException(e, sys) from e
+
+
+def get_scale_pos_weight(y:np.ndarray) -> float:
+    """
+    Ratio of negative to positive rows, the xgboost weight of the positive class when nothing is resampled
+    """
+    n_positive = int(np.count_nonzero(y==1))
+    return float(len(y)-n_positive)/n_positive if n_positive else 1.0
@@ -0,0 +1,162 @@
+from sensor.exception import SensorException
+from sensor.logger import logging
+from concurrent.futures import ProcessPoolExecutor
+import os,sys
+import shutil
+import tempfile
+import time
+import numpy as np
+
+#set in every search worker by _init_search_worker: quantized train and validation matrices built from
+#memory mapped batches, so a worker holds the binned rows but never a float copy of the features
+_search_data = {}
+
+
+def sample_candidates(search_space:dict,n_candidates:int,random_state:int=42) -> list:
+    """
+    Draw hyperparameter candidates from a search space
+    search_space: dict parameter name to a list of choices or to {"low","high","log"} for a float range
+    n_candidates: int number of candidates
+    random_state: int seed
+    return: list of parameter dicts
+    """
+    try:
+        rng = np.random.default_rng(random_state)
+        candidates = []
+        for _ in range(n_candidates):
+            params = {}
+            for name,values in search_space.items():
+                if isinstance(values,dict):
+                    low,high = values["low"],values["high"]
+                    if values.get("log",False):
+                        params[name] = float(np.exp(rng.uniform(np.log(low),np.log(high))))
+                    else:
+                        params[name] = float(rng.uniform(low,high))
+                else:
+                    params[name] = values[rng.integers(len(values))]
+                    #numpy scalars do not survive yaml and xcom serialization
+                    params[name] = params[name].item() if hasattr(params[name],"item") else params[name]
+            candidates.append(params)
+        return candidates
+    except Exception as e:
+        raise SensorException(e, sys) from e
+
+
+def _init_search_worker(train_dir:str,train_index:np.ndarray,valid_index:np.ndarray,n_threads:int,
+    batch_rows:int=100000,resampled_train_dir:str=None) -> None:
+    import xgboost
+    from sensor.ml.external_memory import TransformedDataIter
+    from sensor.utils import load_transformed_target
+    #the bins only depend on the data, every trial of the worker reuses both matrices
+    train_iter = TransformedDataIter(dir_path=train_dir,batch_rows=batch_rows,index=train_index) \
+        if resampled_train_dir is None else TransformedDataIter(dir_path=resampled_train_dir,batch_rows=batch_rows)
+    _search_data["train"] = xgboost.QuantileDMatrix(train_iter,nthread=n_threads)
+    _search_data["valid"] = xgboost.QuantileDMatrix(TransformedDataIter(dir_path=train_dir,batch_rows=batch_rows,
+        index=valid_index),ref=_search_data["train"],nthread=n_threads)
+    _search_data["y_valid"] = load_transformed_target(dir_path=train_dir)[valid_index]
+
+
+def _run_trial(params:dict,n_rounds:int,n_threads:int,early_stopping_rounds:int,scale_pos_weight:float) -> dict:
+    import xgboost
+    from sklearn.metrics import f1_score
+    dtrain,dvalid = _search_data["train"],_search_data["valid"]
+    start_time = time.perf_counter()
+    train_params = {"objective":"binary:logistic","eval_metric":"aucpr","tree_method":"hist","nthread":n_threads,**params}
+    if scale_pos_weight is not None:
+        train_params["scale_pos_weight"] = scale_pos_weight
+    booster = xgboost.train(train_params,dtrain,num_boost_round=n_rounds,evals=[(dvalid,"valid")],
+        early_stopping_rounds=early_stopping_rounds,verbose_eval=False)
+    y_pred = booster.predict(dvalid,iteration_range=(0,booster.best_iteration+1))>0.5
+    return {
+        "params":params,
+        "n_rounds":n_rounds,
+        "best_iteration":int(booster.best_iteration),
+        "valid_aucpr":float(booster.best_score),
+        "valid_f1":float(f1_score(y_true=_search_data["y_valid"],y_pred=y_pred)),
+        "fit_seconds":round(time.perf_counter()-start_time,3),
+    }
+
+
+def successive_halving_search(train_dir:str,search_space:dict,n_candidates:int=27,min_rounds:int=50,
+    max_rounds:int=1000,eta:int=3,n_workers:int=1,threads_per_trial:int=1,validation_fraction:float=0.2,
+    early_stopping_rounds:int=20,time_budget_seconds:float=None,scale_pos_weight:float=None,random_state:int=42,
+    batch_rows:int=100000,resampling_params:dict=None):
+    """
+    Successive halving over the number of boosting rounds: every rung trains the surviving candidates
+    with eta times more rounds than the previous one and keeps the best 1/eta by validation aucpr
+    train_dir: str transformed train data directory before any resampling, a stratified validation split is taken from it
+    search_space: dict see sample_candidates
+    n_candidates: int candidates of the first rung
+    min_rounds, max_rounds: int boosting rounds of the first rung and cap of the last one
+    eta: int reduction factor between rungs
+    n_workers: int trial processes, threads_per_trial caps the threads of every trial
+    early_stopping_rounds: int rounds without validation improvement before a trial stops
+    time_budget_seconds: float no new rung is started after this time, None never stops early
+    scale_pos_weight: float passed to every trial
+    batch_rows: int rows copied at a time from the memory mapped features into the quantized matrices
+    resampling_params: dict get_resampler arguments, only the training part of the split is resampled
+    so the validation rows keep the real class ratio and no synthetic row is built from them
+    return: best trial dict and the list of every trial with its rung
+    """
+    from sensor.utils import load_transformed_target,load_transformed_data,save_transformed_data
+    from sensor.ml.resampling import get_resampler
+    from sklearn.model_selection import train_test_split
+    try:
+        start_time = time.perf_counter()
+        y = load_transformed_target(dir_path=train_dir)
+        train_index,valid_index = train_test_split(np.arange(len(y)),test_size=validation_fraction,
+            stratify=y,random_state=random_state)
+        #sorted indices keep reads of the memory mapped features sequential and are what the data iterator expects
+        train_index,valid_index = np.sort(train_index),np.sort(valid_index)
+
+        resampled_train_dir = None
+        resampler = None if resampling_params is None else get_resampler(**resampling_params)
+        if resampler is not None:
+            x,_ = load_transformed_data(dir_path=train_dir,mmap_mode="r")
+            x_train,y_train = resampler.fit_resample(x[train_index],y[train_index])
+            logging.info(f"Resampled the {len(train_index)} search training rows to {len(y_train)}")
+            resampled_train_dir = tempfile.mkdtemp(prefix="search_train_",dir=os.path.dirname(os.path.abspath(train_dir)))
+            save_transformed_data(dir_path=resampled_train_dir,input_feature_arr=x_train,target_feature_arr=y_train)
+            del x,x_train,y_train
+
+        candidates = sample_candidates(search_space=search_space,n_candidates=n_candidates,random_state=random_state)
+        trials = []
+        initargs = (train_dir,train_index,valid_index,threads_per_trial,batch_rows,resampled_train_dir)
+        executor = ProcessPoolExecutor(max_workers=n_workers,initializer=_init_search_worker,
+            initargs=initargs) if n_workers>1 else None
+        if executor is None:
+            _init_search_worker(*initargs)
+        try:
+            rung,n_rounds = 0,min_rounds
+            while True:
+                logging.info(f"Search rung {rung}: {len(candidates)} candidates with {n_rounds} rounds")
+                trial_args = [(params,n_rounds,threads_per_trial,early_stopping_rounds,scale_pos_weight) for params in candidates]
+                if executor is None:
+                    rung_trials = [_run_trial(*args) for args in trial_args]
+                else:
+                    rung_trials = list(executor.map(_run_trial,*zip(*trial_args)))
+                for trial in rung_trials:
+                    trial["rung"] = rung
+                trials.extend(rung_trials)
+
+                rung_trials.sort(key=lambda trial:trial["valid_aucpr"],reverse=True)
+                elapsed = time.perf_counter()-start_time
+                if len(rung_trials)<=1 or n_rounds>=max_rounds:
+                    break
+                if time_budget_seconds is not None and elapsed>time_budget_seconds:
+                    logging.info(f"Search time budget of {time_budget_seconds}s used after {elapsed:.0f}s, stopping at rung {rung}")
+                    break
+                candidates = [trial["params"] for trial in rung_trials[:max(1,len(rung_trials)//eta)]]
+                rung,n_rounds = rung+1,min(n_rounds*eta,max_rounds)
+        finally:
+            if executor is not None:
+                executor.shutdown()
+            _search_data.clear()
+            if resampled_train_dir is not None:
+                shutil.rmtree(resampled_train_dir,ignore_errors=True)
+
+        best_trial = rung_trials[0]
+        logging.info(f"Best trial after {len(trials)} trials in {time.perf_counter()-start_time:.0f}s: {best_trial}")
+        return best_trial,trials
+    except Exception as e:
+        raise SensorException(e, sys) from e
@@ -0,0 +1,308 @@
+from sensor.exception import SensorException
+import os,sys
+import json
+import numpy as np
+import pandas as pd
+
+
+class QuantileSketch:
+    """
+    Mergeable quantile sketch made of at most `max_size` weighted centroids
+
+    Values are merged into centroids of roughly equal weight, so ranks are kept within
+    about 1/max_size of the total count while the sketch stays a few kilobytes.
+    """
+
+    def __init__(self,max_size:int=256):
+        self.max_size = max_size
+        self.centroids = np.empty(0)
+        self.weights = np.empty(0)
+        self.min = np.nan
+        self.max = np.nan
+
+    @property
+    def count(self) -> float:
+        return float(self.weights.sum())
+
+    def update(self,values:np.ndarray) -> "QuantileSketch":
+        values = np.asarray(values,dtype=np.float64)
+        values = values[~np.isnan(values)]
+        if len(values):
+            self._add(centroids=values,weights=np.ones(len(values)),
+                min_value=values.min(),max_value=values.max())
+        return self
+
+    def merge(self,other:"QuantileSketch") -> "QuantileSketch":
+        if len(other.centroids):
+            self._add(centroids=other.centroids,weights=other.weights,min_value=other.min,max_value=other.max)
+        return self
+
+    def _add(self,centroids:np.ndarray,weights:np.ndarray,min_value:float,max_value:float) -> None:
+        self.min = np.fmin(self.min,min_value)
+        self.max = np.fmax(self.max,max_value)
+        #equal values collapse into one centroid so point masses (e.g. many zeros) are kept exact
+        centroids,inverse = np.unique(np.concatenate([self.centroids,centroids]),return_inverse=True)
+        weights = np.bincount(inverse,weights=np.concatenate([self.weights,weights]))
+        if len(centroids)>self.max_size:
+            #bucket every centroid by the middle of its rank range, buckets keep the weighted mean
+            cumulative_weight = np.cumsum(weights)
+            buckets = np.minimum(((cumulative_weight-weights/2)/cumulative_weight[-1]*self.max_size).astype(np.int64),
+                self.max_size-1)
+            bucket_weights = np.bincount(buckets,weights=weights,minlength=self.max_size)
+            bucket_sums = np.bincount(buckets,weights=weights*centroids,minlength=self.max_size)
+            is_used = bucket_weights>0
+            centroids,weights = bucket_sums[is_used]/bucket_weights[is_used],bucket_weights[is_used]
+        self.centroids,self.weights = centroids,weights
+
+    def _cdf_points(self):
+        #right continuous cdf: the whole weight of a centroid is counted at its value,
+        #linear in between so continuous columns are interpolated and point masses stay steps
+        values,positions = self.centroids,np.cumsum(self.weights)/self.weights.sum()
+        if self.min<values[0]:
+            values,positions = np.concatenate([[self.min],values]),np.concatenate([[0],positions])
+        return values,positions
+
+    def quantile(self,q) -> np.ndarray:
+        if not len(self.centroids):
+            return np.full(np.shape(q),np.nan)
+        values,positions = self._cdf_points()
+        return np.interp(q,positions,values)
+
+    def cdf(self,x) -> np.ndarray:
+        if not len(self.centroids):
+            return np.full(np.shape(x),np.nan)
+        values,positions = self._cdf_points()
+        return np.interp(x,values,positions,left=0,right=1)
+
+    def to_dict(self) -> dict:
+        return {"max_size":self.max_size,"centroids":self.centroids.tolist(),"weights":self.weights.tolist(),
+            "min":float(self.min),"max":float(self.max)}
+
+    @classmethod
+    def from_dict(cls,sketch_info:dict) -> "QuantileSketch":
+        sketch = cls(max_size=sketch_info["max_size"])
+        sketch.centroids = np.asarray(sketch_info["centroids"],dtype=np.float64)
+        sketch.weights = np.asarray(sketch_info["weights"],dtype=np.float64)
+        sketch.min,sketch.max = sketch_info["min"],sketch_info["max"]
+        return sketch
+
+
+class ColumnStatistics:
+    """
+    One pass, mergeable statistics of every column of a chunk stream:
+    row and null counts, min/max, mean and variance (Welford/Chan) and a quantile sketch
+    per numeric column
+    """
+
+    def __init__(self,sketch_size:int=256):
+        self.sketch_size = sketch_size
+        self.n_rows = 0
+        self.columns = []
+        self.dtypes = {}
+        self.null_count = pd.Series(dtype=np.int64)
+        self.numeric_columns = []
+        self.count = np.empty(0)
+        self.min = np.empty(0)
+        self.max = np.empty(0)
+        self.mean = np.empty(0)
+        self.m2 = np.empty(0)
+        self.sketches = {}
+
+    def update(self,df:pd.DataFrame) -> "ColumnStatistics":
+        try:
+            chunk_statistics = ColumnStatistics(sketch_size=self.sketch_size)
+            chunk_statistics.n_rows = len(df)
+            chunk_statistics.columns = list(df.columns)
+            chunk_statistics.dtypes = df.dtypes.astype(str).to_dict()
+            chunk_statistics.null_count = df.isna().sum()
+            chunk_statistics.numeric_columns = [column for column in df.columns
+                if pd.api.types.is_numeric_dtype(df[column])]
+
+            values = df[chunk_statistics.numeric_columns].to_numpy(dtype=np.float64)
+            count = (~np.isnan(values)).sum(axis=0)
+            with np.errstate(invalid="ignore",divide="ignore"):
+                chunk_statistics.count = count.astype(np.float64)
+                chunk_statistics.min = np.where(count>0,np.nanmin(np.where(np.isnan(values),np.inf,values),axis=0,initial=np.inf),np.nan)
+                chunk_statistics.max = np.where(count>0,np.nanmax(np.where(np.isnan(values),-np.inf,values),axis=0,initial=-np.inf),np.nan)
+                chunk_statistics.mean = np.where(count>0,np.nansum(values,axis=0)/count,0)
+                chunk_statistics.m2 = np.nansum((values-chunk_statistics.mean)**2,axis=0)
+            chunk_statistics.sketches = {column:QuantileSketch(max_size=self.sketch_size).update(values[:,index])
+                for index,column in enumerate(chunk_statistics.numeric_columns)}
+            return self.merge(chunk_statistics)
+        except Exception as e:
+            raise SensorException(e, sys) from e
+
+    def merge(self,other:"ColumnStatistics") -> "ColumnStatistics":
+        try:
+            if self.n_rows==0 and not self.columns:
+                self.__dict__.update(other.__dict__)
+                return self
+            if other.columns!=self.columns or other.numeric_columns!=self.numeric_columns:
+                raise Exception("Statistics of chunks with different columns can not be merged")
+            self.n_rows+=other.n_rows
+            self.null_count = self.null_count.add(other.null_count,fill_value=0)
+
+            #Chan et al. parallel update of mean and sum of squared deviations
+            count = self.count+other.count
+            with np.errstate(invalid="ignore",divide="ignore"):
+                delta = other.mean-self.mean
+                self.mean = np.where(count>0,self.mean+delta*np.where(count>0,other.count/count,0),0)
+                self.m2 = self.m2+other.m2+np.where(count>0,delta**2*self.count*other.count/count,0)
+            self.count = count
+            self.min = np.fmin(self.min,other.min)
+            self.max = np.fmax(self.max,other.max)
+            for column,sketch in other.sketches.items():
+                self.sketches[column].merge(sketch)
+            return self
+        except Exception as e:
+            raise SensorException(e, sys) from e
+
+    @property
+    def missing_percentage(self) -> pd.Series:
+        if self.n_rows==0:
+            return self.null_count.astype(np.float64)
+        return self.null_count*100/self.n_rows
+
+    @property
+    def variance(self) -> np.ndarray:
+        with np.errstate(invalid="ignore",divide="ignore"):
+            return np.where(self.count>0,self.m2/self.count,np.nan)
+
+    def get_numeric_summary(self) -> pd.DataFrame:
+        return pd.DataFrame({"count":self.count,"min":self.min,"max":self.max,
+            "mean":self.mean,"variance":self.variance},index=self.numeric_columns)
+
+    def select(self,columns:list) -> "ColumnStatistics":
+        """
+        Statistics restricted to the given columns, in their order
+        """
+        try:
+            selected = ColumnStatistics(sketch_size=self.sketch_size)
+            selected.n_rows = self.n_rows
+            selected.columns = [column for column in columns if column in self.columns]
+            selected.dtypes = {column:self.dtypes[column] for column in selected.columns}
+            selected.null_count = self.null_count[selected.columns]
+            selected.numeric_columns = [column for column in selected.columns if column in self.sketches]
+            index = [self.numeric_columns.index(column) for column in selected.numeric_columns]
+            for name in ("count","min","max","mean","m2"):
+                setattr(selected,name,getattr(self,name)[index])
+            selected.sketches = {column:self.sketches[column] for column in selected.numeric_columns}
+            return selected
+        except Exception as e:
+            raise SensorException(e, sys) from e
+
+    def get_histogram(self,column:str,n_bins:int=10) -> dict:
+        """
+        Histogram of a numeric column over quantile bin edges, counts are read from the sketch
+        return: dict with the inner bin edges and the row count of each of the len(edges)+1 bins
+        """
+        sketch = self.sketches[column]
+        edges = np.unique(sketch.quantile(np.linspace(0,1,n_bins+1)[1:-1]))
+        shares = np.diff(np.concatenate([[0],sketch.cdf(edges),[1]]))
+        return {"edges":edges.tolist(),"counts":np.round(shares*sketch.count).tolist()}
+
+    def to_dict(self,n_bins:int=10) -> dict:
+        return {
+            "sketch_size":self.sketch_size,
+            "n_rows":int(self.n_rows),
+            "columns":self.columns,
+            "dtypes":self.dtypes,
+            "null_count":{column:int(count) for column,count in self.null_count.items()},
+            "numeric_columns":self.numeric_columns,
+            "count":self.count.tolist(),
+            "min":self.min.tolist(),
+            "max":self.max.tolist(),
+            "mean":self.mean.tolist(),
+            "m2":self.m2.tolist(),
+            "sketches":{column:sketch.to_dict() for column,sketch in self.sketches.items()},
+            #kept for readers of the file, drift checks use the sketches
+            "histograms":{column:self.get_histogram(column=column,n_bins=n_bins) for column in self.numeric_columns},
+        }
+
+    @classmethod
+    def from_dict(cls,statistics_info:dict) -> "ColumnStatistics":
+        statistics = cls(sketch_size=statistics_info["sketch_size"])
+        statistics.n_rows = statistics_info["n_rows"]
+        statistics.columns = statistics_info["columns"]
+        statistics.dtypes = statistics_info["dtypes"]
+        statistics.null_count = pd.Series(statistics_info["null_count"],index=statistics.columns,dtype=np.int64)
+        statistics.numeric_columns = statistics_info["numeric_columns"]
+        for name in ("count","min","max","mean","m2"):
+            setattr(statistics,name,np.asarray(statistics_info[name],dtype=np.float64))
+        statistics.sketches = {column:QuantileSketch.from_dict(sketch_info)
+            for column,sketch_info in statistics_info["sketches"].items()}
+        return statistics
+
+
+def save_reference_profile(statistics:ColumnStatistics,file_path:str,n_bins:int=10) -> None:
+    """
+    Save column statistics, quantile sketches and histograms of the training data as json
+    statistics: ColumnStatistics of the reference data
+    file_path: str location of the json file
+    n_bins: int number of histogram bins per numeric column
+    """
+    try:
+        os.makedirs(os.path.dirname(file_path),exist_ok=True)
+        with open(file_path,"w") as file_obj:
+            json.dump(statistics.to_dict(n_bins=n_bins),file_obj)
+    except Exception as e:
+        raise SensorException(e, sys) from e
+
+
+def load_reference_profile(file_path:str) -> ColumnStatistics:
+    try:
+        with open(file_path) as file_obj:
+            return ColumnStatistics.from_dict(statistics_info=json.load(file_obj))
+    except Exception as e:
+        raise SensorException(e, sys) from e
+
+
+def _get_chunks_statistics(file_path:str,chunk_size:int,columns:list,sketch_size:int,fill_values:dict,
+    schema_info:dict=None,row_groups:list=None) -> ColumnStatistics:
+    from sensor.utils import iter_dataframe_chunks
+    statistics = ColumnStatistics(sketch_size=sketch_size)
+    if row_groups is None:
+        chunks = iter_dataframe_chunks(file_path=file_path,chunk_size=chunk_size,schema_info=schema_info,columns=columns)
+    else:
+        import pyarrow.parquet as pq
+        chunks = (batch.to_pandas() for batch in pq.ParquetFile(file_path,memory_map=True).iter_batches(
+            batch_size=chunk_size,row_groups=row_groups,columns=columns))
+    for df in chunks:
+        statistics.update(df=df if fill_values is None else df.fillna(fill_values))
+    return statistics
+
+
+def get_file_statistics(file_path:str,chunk_size:int,columns:list=None,n_workers:int=1,
+    sketch_size:int=256,fill_values:dict=None,schema_info:dict=None) -> ColumnStatistics:
+    """
+    Column statistics of a file read in chunks, parquet row groups are split across worker processes
+    and the statistics of every worker are merged
+    file_path: str location of a .csv, .parquet or .feather file
+    chunk_size: int number of rows per chunk
+    columns: list columns to read, None reads every column
+    n_workers: int processes used for parquet files with several row groups
+    sketch_size: int centroids per quantile sketch
+    fill_values: dict column to value used for missing values before updating the statistics
+    schema_info: dict parsed schema, csv files are parsed with its na values and dtypes
+    return: merged ColumnStatistics
+    """
+    try:
+        row_group_parts = []
+        if file_path.endswith(".parquet") and n_workers is not None and n_workers>1:
+            import pyarrow.parquet as pq
+            n_row_groups = pq.ParquetFile(file_path).num_row_groups
+            row_group_parts = [part.tolist() for part in np.array_split(np.arange(n_row_groups),min(n_workers,n_row_groups))]
+        if len(row_group_parts)<2:
+            return _get_chunks_statistics(file_path=file_path,chunk_size=chunk_size,columns=columns,
+                sketch_size=sketch_size,fill_values=fill_values,schema_info=schema_info)
+
+        from concurrent.futures import ProcessPoolExecutor
+        with ProcessPoolExecutor(max_workers=len(row_group_parts)) as executor:
+            futures = [executor.submit(_get_chunks_statistics,file_path,chunk_size,columns,sketch_size,fill_values,None,part)
+                for part in row_group_parts]
+            statistics = ColumnStatistics(sketch_size=sketch_size)
+            for future in futures:
+                statistics.merge(future.result())
+        return statistics
+    except Exception as e:
+        raise SensorException(e, sys) from e
@@ -0,0 +1,129 @@
+from sensor.exception import SensorException
+import os,sys
+import hashlib
+import numpy as np
+from sensor.utils import load_object
+
+
+class FusedTransform:
+    """
+    Fitted imputer and robust scaler compiled into one in-place float32 pass:
+    missing values are filled per column, then (x - center) / scale.
+    Same interface as the pipeline it was built from (feature_names_in_, transform).
+    """
+
+    def __init__(self,feature_names_in:np.ndarray,fill_values:np.ndarray,center:np.ndarray=None,
+        scale:np.ndarray=None,block_size:int=4096):
+        self.feature_names_in_ = np.asarray(feature_names_in,dtype=object)
+        self.fill_values = np.asarray(fill_values,dtype=np.float32)
+        #kept in the dtype sklearn fitted them with so the results match the pipeline
+        self.center = center
+        self.scale = scale
+        self.block_size = block_size
+
+    @classmethod
+    def from_pipeline(cls,pipeline:"Pipeline") -> "FusedTransform":
+        """
+        Compile a fitted Pipeline of a SimpleImputer optionally followed by a RobustScaler
+        """
+        #sklearn is only needed to compile a pipeline, serving a saved FusedTransform never imports it
+        from sklearn.impute import SimpleImputer
+        from sklearn.preprocessing import RobustScaler
+        try:
+            steps = [step for _,step in pipeline.steps]
+            imputer = steps[0]
+            if not isinstance(imputer,SimpleImputer) or len(steps)>2 or \
+                (len(steps)==2 and not isinstance(steps[1],RobustScaler)):
+                raise Exception(f"Only SimpleImputer followed by RobustScaler can be fused, got: {steps}")
+            if imputer.add_indicator or len(imputer.statistics_)!=len(pipeline.feature_names_in_):
+                raise Exception("Imputers adding or dropping columns can not be fused")
+            center,scale = None,None
+            if len(steps)==2:
+                scaler = steps[1]
+                center,scale = scaler.center_,scaler.scale_
+            return cls(feature_names_in=pipeline.feature_names_in_,
+                fill_values=imputer.statistics_.astype(np.float32),center=center,scale=scale)
+        except Exception as e:
+            raise SensorException(e, sys) from e
+
+    def transform(self,X) -> np.ndarray:
+        """
+        X: pd.DataFrame holding feature_names_in_ or a 2d array in that column order
+        return: C-contiguous float32 array, X is never modified
+        """
+        import pandas as pd
+        try:
+            if isinstance(X,pd.DataFrame):
+                X = X[list(self.feature_names_in_)].to_numpy(dtype=np.float32)
+            arr = np.ascontiguousarray(X,dtype=np.float32)
+            if np.shares_memory(arr,X):
+                arr = arr.copy()
+            #row blocks keep the nan mask small and every block in cache for fill and scaling
+            for start in range(0,len(arr),self.block_size):
+                block = arr[start:start+self.block_size]
+                np.copyto(block,self.fill_values,where=np.isnan(block))
+                if self.center is not None:
+                    block -= self.center
+                if self.scale is not None:
+                    block /= self.scale
+            return arr
+        except Exception as e:
+            raise SensorException(e, sys) from e
+
+    def fingerprint(self) -> str:
+        """
+        Content hash of the fitted parameters, equal for transforms producing the same features
+        """
+        digest = hashlib.sha256("\x00".join(map(str,self.feature_names_in_)).encode())
+        for arr in (self.fill_values,self.center,self.scale):
+            digest.update(b"none" if arr is None else np.ascontiguousarray(arr).tobytes())
+        return digest.hexdigest()[:16]
+
+
+def set_robust_scaler_quantiles(scaler:"RobustScaler",statistics,feature_names:list) -> "RobustScaler":
+    """
+    Replace the center and scale of a RobustScaler with the ones read from quantile sketches,
+    so a scaler fitted on one chunk ends up fitted on the whole stream
+    scaler: RobustScaler already fitted on a chunk of the same columns
+    statistics: sensor.ml.stats.ColumnStatistics of the imputed stream
+    feature_names: list columns in the order the scaler receives them
+    """
+    from scipy.stats import norm
+    try:
+        sketches = [statistics.sketches[column] for column in feature_names]
+        q_min,q_max = scaler.quantile_range
+        if scaler.with_centering:
+            center = np.array([sketch.quantile(0.5) for sketch in sketches])
+            scaler.center_ = center.astype(scaler.center_.dtype)
+        if scaler.with_scaling:
+            scale = np.array([sketch.quantile(q_max/100)-sketch.quantile(q_min/100) for sketch in sketches])
+            #same zero handling as sklearn: constant columns are left unscaled
+            scale[scale<10*np.finfo(scale.dtype).eps] = 1.0
+            if scaler.unit_variance:
+                scale = scale/(norm.ppf(q_max/100.0)-norm.ppf(q_min/100.0))
+            scaler.scale_ = scale.astype(scaler.scale_.dtype)
+        return scaler
+    except Exception as e:
+        raise SensorException(e, sys) from e
+
+def load_transformer(transformer_path:str,fused_transformer_path:str=None):
+    """
+    Load the fused transform when it was saved, else the sklearn pipeline (model versions saved before it)
+    """
+    try:
+        if fused_transformer_path is not None and os.path.exists(fused_transformer_path):
+            return load_object(file_path=fused_transformer_path)
+        return load_object(file_path=transformer_path)
+    except Exception as e:
+        raise SensorException(e, sys) from e
+
+def get_transformer_fingerprint(transformer) -> str:
+    """
+    FusedTransform.fingerprint of a fused transform or of a fitted pipeline it can be compiled from
+    """
+    try:
+        if not isinstance(transformer,FusedTransform):
+            transformer = FusedTransform.from_pipeline(pipeline=transformer)
+        return transformer.fingerprint()
+    except Exception as e:
+        raise SensorException(e, sys) from e
@@ -2,16 +2,17 @@ from sensor.entity.config_entity import BatchPredictionConfig
 from sensor.exception import SensorException
 from sensor.logger import logging
 import os,sys 
-from sensor.utils import load_object
+from sensor.utils import load_object,read_dataframe,write_yaml_file
+from sensor.entity.schema_entity import load_schema
 from sensor.ml.model_resolver import ModelResolver
-import pandas as pd
+from sensor.ml.transform import load_transformer
 from datetime import datetime
-import numpy as np
 import shutil
 import os 
 
 
 from glob import glob 
+import pandas as pd
 class SensorBatchPrediction:
 
     def __init__(self,batch_config:BatchPredictionConfig):
@@ -31,7 +32,8 @@ class SensorBatchPrediction:
             model_resolver = ModelResolver()
 
             logging.info("Loading transformer to transform dataset")
-            transformer = load_object(file_path=model_resolver.get_latest_transformer_path())
+            transformer = load_transformer(transformer_path=model_resolver.get_latest_transformer_path(),
+                fused_transformer_path=model_resolver.get_latest_fused_transformer_path())
 
             logging.info("Loading model to make prediction")
             model = load_object(file_path=model_resolver.get_latest_model_path())
@@ -39,18 +41,29 @@ class SensorBatchPrediction:
             logging.info("Target encoder to convert predicted column into categorical")
             target_encoder = load_object(file_path=model_resolver.get_latest_target_encoder_path())
 
+            schema = load_schema(file_path=self.batch_config.schema_file_path)
+
+            #models pushed before reference profiles existed are served without a drift check
+            reference_profile_path = model_resolver.get_latest_reference_profile_path()
+            reference_profile = None
+            if os.path.exists(reference_profile_path):
+                #imported here, scipy.stats and pandas would dominate the import time of batch prediction
+                from sensor.ml.stats import load_reference_profile
+                from sensor.ml.drift import get_reference_drift_report
+                logging.info("Loading reference profile to check drift of input files")
+                reference_profile = load_reference_profile(file_path=reference_profile_path)
+
             for file_path in input_files:
                 logging.info(f"Reading file : {file_path}")
-                df = pd.read_csv(file_path)
-                df.replace({"na":np.NAN},inplace=True)
+                df = read_dataframe(file_path=file_path, schema_info=schema.schema_info)
 
                 input_feature_names =  list(transformer.feature_names_in_)
                 input_arr = transformer.transform(df[input_feature_names])
 
                 prediction = model.predict(input_arr)
                 cat_prediction = target_encoder.inverse_transform(prediction)
-                df["prediction"]=prediction
-                df["cat_pred"]=cat_prediction
+                #one block per parsed column, the predictions are joined in one go instead of inserted
+                df = pd.concat([df,pd.DataFrame({"prediction":prediction,"cat_pred":cat_prediction},index=df.index)],axis=1)
 
                 file_name = os.path.basename(file_path)
                 file_name = file_name.replace(".csv", f"_{datetime.now().strftime('%m%d%Y__%H%M%S')}.csv")
@@ -59,6 +72,13 @@ class SensorBatchPrediction:
                 logging.info(f"Saving prediction  file : {prediction_file_path}")
                 df.to_csv(prediction_file_path,index=False,header=True)
 
+                if reference_profile is not None:
+                    drift_report = get_reference_drift_report(reference_statistics=reference_profile, data=df,
+                        method=self.batch_config.drift_method, threshold=self.batch_config.drift_threshold)
+                    drifted_columns = [column for column,result in drift_report.items() if not result["same_distribution"]]
+                    logging.info(f"Columns with a different distribution than the training data: {drifted_columns}")
+                    write_yaml_file(file_path=prediction_file_path.replace(".csv","_drift.yaml"), data=drift_report)
+
                 archive_file_path = os.path.join(self.batch_config.archive_dir,file_name)
 
 
@@ -4,7 +4,8 @@ from sensor.entity.config_entity import (TrainingPipelineConfig,
                                         DataTransformationConfig,
                                         ModelTrainerConfig,
                                         ModelEvaluationConfig,
-                                        ModelPusherConfig
+                                        ModelPusherConfig,
+                                        validate_incremental_config
                                         )
 from sensor.entity.artifact_entity import (DataIngestionArtifact,
                                         DataValidationArtifact,
@@ -29,6 +30,9 @@ class TrainingPipeline:
     def __init__(self,training_pipleine_config:TrainingPipelineConfig):
         try:
             self.training_pipleine_config=training_pipleine_config
+            validate_incremental_config(
+                data_ingestion_config=DataIngestionConfig(training_pipeline_config=training_pipleine_config),
+                data_transformation_config=DataTransformationConfig(training_pipeline_config=training_pipleine_config))
         except Exception as e:
             raise SensorException(e, sys) from e
 
@@ -90,12 +94,16 @@ class TrainingPipeline:
             raise SensorException(e, sys) from e
 
     def start_model_pusher(self,  data_transformation_artifact:DataTransformationArtifact,
-        model_trainer_artifact:ModelTrainerArtifact) -> ModelPusherArtifact:
+        model_trainer_artifact:ModelTrainerArtifact,
+        data_validation_artifact:DataValidationArtifact=None,
+        model_eval_artifact:ModelEvaluationArtifact=None) -> ModelPusherArtifact:
         try:
             model_pusher_config = ModelPusherConfig(training_pipeline_config=self.training_pipleine_config)
             model_pusher = ModelPusher(model_pusher_config=model_pusher_config,
              data_transformation_artifact=data_transformation_artifact, 
-             model_trainer_artifact=model_trainer_artifact)
+             model_trainer_artifact=model_trainer_artifact,
+             data_validation_artifact=data_validation_artifact,
+             model_eval_artifact=model_eval_artifact)
             return model_pusher.initiate_model_pusher()
         except Exception as e:
             raise SensorException(e, sys) from e
@@ -120,8 +128,13 @@ class TrainingPipeline:
                             data_transformation_artifact=data_transformation_artifact,
                             model_trainer_artifact=model_trainer_artifact)
 
+            if not model_eval_artifact.is_model_accepted:
+                logging.info("Model not accepted, the registry is left unchanged")
+                return
             model_pusher_artifact = self.start_model_pusher(data_transformation_artifact=data_transformation_artifact,
-                            model_trainer_artifact=model_trainer_artifact)
+                            model_trainer_artifact=model_trainer_artifact,
+                            data_validation_artifact=data_validation_artifact,
+                            model_eval_artifact=model_eval_artifact)
         except Exception as e:
             raise SensorException(e, sys) from e
 
@@ -1,27 +1,77 @@
-from .config import mongo_client
-import pandas as pd
+from __future__ import annotations
+from .config import get_mongo_client
 from .exception import SensorException
 import os,sys
 import json
-import yaml
-import dill
-import numpy as np
+import itertools
+import time
+from concurrent.futures import (ProcessPoolExecutor,ThreadPoolExecutor,
+                                as_completed,wait,FIRST_COMPLETED)
+from typing import TYPE_CHECKING
 import logging
+#pandas, numpy, yaml and dill are imported where they are used to keep `import sensor` cheap
+if TYPE_CHECKING:
+    import numpy as np
+    import pandas as pd
 def dump_csv_file_to_mongodb_collection(file_path:str,database_name:str,collection_name:str) -> None:
+    import pandas as pd
     try:
         #reading a csv file
         df = pd.read_csv(file_path)
         logging.info(f"Rows and Columns {df.shape} ")
         df.reset_index(drop=True,inplace=True)
         json_records = list(json.loads(df.T.to_json()).values())
-        mongo_client[database_name][collection_name].insert_many(json_records)
+        get_mongo_client()[database_name][collection_name].insert_many(json_records)
+    except Exception as e:
+        raise SensorException(e,sys) from e
+
+
+def _insert_records(database_name:str,collection_name:str,records:list) -> int:
+    get_mongo_client()[database_name][collection_name].insert_many(records,ordered=False)
+    return len(records)
+
+
+def bulk_load_csv_file_to_mongodb_collection(file_path:str,database_name:str,collection_name:str,
+    chunk_size:int=50000,batch_size:int=5000,n_threads:int=4) -> int:
+    """
+    Load a csv file into mongodb in chunks with unordered insert_many batches sent from a thread pool
+    file_path: str location of csv file
+    database_name: str mongo database
+    collection_name: str mongo collection
+    chunk_size: int number of csv rows parsed at a time
+    batch_size: int number of documents per insert_many call
+    n_threads: int number of concurrent insert_many calls
+    return: int number of inserted rows
+    """
+    import pandas as pd
+    try:
+        start_time = time.perf_counter()
+        n_inserted = 0
+        pending = set()
+        with ThreadPoolExecutor(max_workers=n_threads) as executor:
+            for chunk in pd.read_csv(file_path,chunksize=chunk_size,na_values=["na"]):
+                #object dtype boxes native python values, missing values become null
+                records = chunk.astype(object).where(chunk.notna(),None).to_dict("records")
+                for start in range(0,len(records),batch_size):
+                    if len(pending)>=2*n_threads:
+                        done,pending = wait(pending,return_when=FIRST_COMPLETED)
+                        n_inserted+=sum(future.result() for future in done)
+                    pending.add(executor.submit(_insert_records,database_name,collection_name,
+                        records[start:start+batch_size]))
+                logging.info(f"Queued {len(records)} rows from {file_path}")
+            n_inserted+=sum(future.result() for future in pending)
+
+        elapsed = time.perf_counter()-start_time
+        logging.info(f"Inserted {n_inserted} rows in {elapsed:.2f}s ({n_inserted/max(elapsed,1e-9):.0f} rows/s)")
+        return n_inserted
     except Exception as e:
         raise SensorException(e,sys) from e
 
 
 def export_collection_as_dataframe(database_name:str,collection_name:str) -> pd.DataFrame:
+    import pandas as pd
     try:
-        df = pd.DataFrame(list(mongo_client[database_name][collection_name].find()))
+        df = pd.DataFrame(list(get_mongo_client()[database_name][collection_name].find()))
         if "_id" in df.columns.to_list():
             df=df.drop("_id",axis=1)
         return df
@@ -29,7 +79,363 @@ def export_collection_as_dataframe(database_name:str,collection_name:str) -> pd.
         raise SensorException(e,sys) from e
 
 
+def get_collection_projection(schema_file_path:str) -> dict:
+    """
+    Build a mongo projection which keeps `_id` and the schema drop columns on the server
+    schema_file_path: str location of schema.yaml
+    return: dict projection to pass to find()
+    """
+    try:
+        schema_info = read_yaml_file(file_path=schema_file_path)
+        projection = {"_id":0}
+        projection.update({column:0 for column in schema_info["drop_columns"]})
+        return projection
+    except Exception as e:
+        raise SensorException(e, sys) from e
+
+
+def _fill_column_arrays(columns:dict,records:list,offset:int,n_rows:int,dtypes:dict) -> None:
+    import pandas as pd
+    for record in records:
+        for column_name in record:
+            if column_name not in columns:
+                columns[column_name] = _allocate_column(n_rows=n_rows,dtype=dtypes.get(column_name))
+    end = offset+len(records)
+    for column_name,column_arr in columns.items():
+        values = [record.get(column_name) for record in records]
+        if column_arr.dtype.kind=="f":
+            #na strings and nulls become NaN while parsing the batch
+            values = pd.to_numeric(pd.Series(values,dtype=object),errors="coerce").to_numpy()
+        column_arr[offset:end] = values
+
+
+def _allocate_column(n_rows:int,dtype:str=None) -> np.ndarray:
+    import numpy as np
+    import pandas as pd
+    if dtype is not None and pd.api.types.is_float_dtype(dtype):
+        return np.full(n_rows,np.nan,dtype=dtype)
+    return np.full(n_rows,None,dtype=object)
+
+
+def export_collection_as_dataframe_in_batches(database_name:str,collection_name:str,
+    schema_file_path:str,batch_size:int=10000,query:dict=None) -> pd.DataFrame:
+    """
+    Stream a collection into preallocated column arrays batch by batch
+    database_name: str mongo database
+    collection_name: str mongo collection
+    schema_file_path: str schema used to build the server side projection
+    batch_size: int number of documents fetched per cursor batch
+    query: dict optional filter on the collection
+    return: pd.DataFrame without `_id` and schema drop columns
+    """
+    try:
+        query = {} if query is None else query
+        collection = get_mongo_client()[database_name][collection_name]
+        projection = get_collection_projection(schema_file_path=schema_file_path)
+        n_rows = collection.count_documents(query)
+        logging.info(f"Exporting {n_rows} documents from {database_name}.{collection_name} in batches of {batch_size}")
+
+        schema_info = read_yaml_file(file_path=schema_file_path)
+        dtypes = get_schema_dtypes(schema_info=schema_info)
+        cursor = collection.find(query,projection,batch_size=batch_size)
+        columns = _read_cursor_into_columns(cursor=cursor,n_rows=n_rows,batch_size=batch_size,dtypes=dtypes)
+        return _columns_to_dataframe(columns=columns,dtypes=dtypes)
+    except Exception as e:
+        raise SensorException(e,sys) from e
+
+
+def _read_cursor_into_columns(cursor,n_rows:int,batch_size:int,dtypes:dict) -> dict:
+    import numpy as np
+    columns = {}
+    offset = 0
+    while True:
+        records = list(itertools.islice(cursor,batch_size))
+        if not records:
+            break
+        if offset+len(records)>n_rows:
+            #documents were inserted after counting, grow the arrays
+            n_rows = offset+len(records)
+            columns = {name:np.resize(arr,n_rows) for name,arr in columns.items()}
+        _fill_column_arrays(columns=columns,records=records,offset=offset,n_rows=n_rows,dtypes=dtypes)
+        offset+=len(records)
+    return {name:arr[:offset] for name,arr in columns.items()}
+
+
+def _columns_to_dataframe(columns:dict,dtypes:dict) -> pd.DataFrame:
+    import pandas as pd
+    df = pd.DataFrame(columns,copy=False)
+    #float columns are already typed, only the remaining ones (e.g. a categorical target) are cast
+    remaining_dtypes = {name:dtypes[name] for name in df.columns
+        if name in dtypes and not pd.api.types.is_float_dtype(df[name])}
+    return df.astype(remaining_dtypes) if remaining_dtypes else df
+
+
+def get_collection_watermark(database_name:str,collection_name:str,watermark_field:str="_id"):
+    """
+    Highest value of the watermark field in a collection
+    database_name: str mongo database
+    collection_name: str mongo collection
+    watermark_field: str monotonically increasing field such as `_id` or an insertion timestamp
+    return: highest value or None when the collection is empty
+    """
+    try:
+        collection = get_mongo_client()[database_name][collection_name]
+        cursor = collection.find({watermark_field:{"$exists":True}},{watermark_field:1}).sort(watermark_field,-1).limit(1)
+        for record in cursor:
+            return record[watermark_field]
+        return None
+    except Exception as e:
+        raise SensorException(e,sys) from e
+
+
+def get_id_partition_queries(database_name:str,collection_name:str,n_partitions:int) -> list:
+    """
+    Split a collection into contiguous `_id` ranges of roughly equal size
+    database_name: str mongo database
+    collection_name: str mongo collection
+    n_partitions: int number of ranges
+    return: list of mongo queries, one per range
+    """
+    try:
+        collection = get_mongo_client()[database_name][collection_name]
+        n_rows = collection.count_documents({})
+        n_partitions = max(1,min(n_partitions,n_rows))
+        #every split point is found by the server skipping along the _id index from the previous one,
+        #a covered query, so only the n_partitions-1 split ids cross the network
+        split_points,query,previous_position = [],{},0
+        for partition in range(1,n_partitions):
+            position = partition*n_rows//n_partitions
+            record = next(collection.find(query,{"_id":1}).sort("_id",1).skip(position-previous_position).limit(1),None)
+            if record is None:
+                break
+            split_points.append(record["_id"])
+            query,previous_position = {"_id":{"$gte":record["_id"]}},position
+
+        bounds = [None]+split_points+[None]
+        queries = []
+        for lower,upper in zip(bounds[:-1],bounds[1:]):
+            id_range = {}
+            if lower is not None:
+                id_range["$gte"]=lower
+            if upper is not None:
+                id_range["$lt"]=upper
+            queries.append({"_id":id_range} if id_range else {})
+        return queries
+    except Exception as e:
+        raise SensorException(e,sys) from e
+
+
+def _export_partition(database_name:str,collection_name:str,query:dict,projection:dict,
+    batch_size:int,dtypes:dict) -> dict:
+    #runs inside a worker process, get_mongo_client() opens a client per process
+    collection = get_mongo_client()[database_name][collection_name]
+    n_rows = collection.count_documents(query)
+    cursor = collection.find(query,projection,batch_size=batch_size)
+    return _read_cursor_into_columns(cursor=cursor,n_rows=n_rows,batch_size=batch_size,dtypes=dtypes)
+
+
+def export_collection_as_dataframe_in_partitions(database_name:str,collection_name:str,
+    schema_file_path:str,n_workers:int=None,batch_size:int=10000) -> pd.DataFrame:
+    """
+    Export `_id` ranges of a collection in parallel worker processes
+    database_name: str mongo database
+    collection_name: str mongo collection
+    schema_file_path: str schema used to build the server side projection
+    n_workers: int number of worker processes, defaults to the cpu count
+    batch_size: int number of documents fetched per cursor batch
+    return: pd.DataFrame without `_id` and schema drop columns
+    """
+    try:
+        n_workers = n_workers or os.cpu_count()
+        projection = get_collection_projection(schema_file_path=schema_file_path)
+        dtypes = get_schema_dtypes(schema_info=read_yaml_file(file_path=schema_file_path))
+        queries = get_id_partition_queries(database_name=database_name,
+            collection_name=collection_name,n_partitions=n_workers)
+        logging.info(f"Exporting {database_name}.{collection_name} in {len(queries)} partitions")
+
+        blocks = [None]*len(queries)
+        with ProcessPoolExecutor(max_workers=n_workers) as executor:
+            futures = {executor.submit(_export_partition,database_name,collection_name,
+                query,projection,batch_size,dtypes):index for index,query in enumerate(queries)}
+            for future in as_completed(futures):
+                blocks[futures[future]] = future.result()
+
+        column_names = list(dict.fromkeys(name for block in blocks for name in block))
+        block_sizes = [len(next(iter(block.values()))) if block else 0 for block in blocks]
+        n_rows = sum(block_sizes)
+
+        #write every block straight into its slice instead of concatenating frames
+        columns = {name:_allocate_column(n_rows=n_rows,dtype=dtypes.get(name)) for name in column_names}
+        offset = 0
+        for index,block_size in enumerate(block_sizes):
+            for name,block_arr in blocks[index].items():
+                columns[name][offset:offset+block_size] = block_arr
+            offset+=block_size
+            blocks[index] = None
+        return _columns_to_dataframe(columns=columns,dtypes=dtypes)
+    except Exception as e:
+        raise SensorException(e,sys) from e
+
+
+def read_dataframe(file_path:str,schema_info:dict=None) -> pd.DataFrame:
+    """
+    Read a dataframe with the codec matching the file extension
+    file_path: str location of a .csv, .parquet or .feather file
+    schema_info: dict parsed schema, csv files are parsed with its na values and dtypes
+    return: pd.DataFrame
+    """
+    import pandas as pd
+    try:
+        file_format = os.path.splitext(file_path)[1].lstrip(".")
+        if file_format=="csv":
+            if schema_info is None:
+                return pd.read_csv(file_path)
+            return pd.read_csv(file_path,na_values=schema_info.get("na_values"),
+                dtype=get_schema_dtypes(schema_info=schema_info))
+        if file_format=="parquet":
+            return pd.read_parquet(file_path)
+        if file_format=="feather":
+            return pd.read_feather(file_path)
+        raise Exception(f"Unsupported file format: {file_path}")
+    except Exception as e:
+        raise SensorException(e, sys) from e
+
+
+def write_dataframe(df:pd.DataFrame,file_path:str) -> None:
+    """
+    Write a dataframe with the codec matching the file extension
+    df: pd.DataFrame data to save
+    file_path: str location of a .csv, .parquet or .feather file
+    """
+    try:
+        os.makedirs(os.path.dirname(file_path),exist_ok=True)
+        file_format = os.path.splitext(file_path)[1].lstrip(".")
+        if file_format=="csv":
+            df.to_csv(file_path,index=False,header=True)
+        elif file_format=="parquet":
+            df.to_parquet(file_path,index=False)
+        elif file_format=="feather":
+            df.reset_index(drop=True).to_feather(file_path)
+        else:
+            raise Exception(f"Unsupported file format: {file_path}")
+    except Exception as e:
+        raise SensorException(e, sys) from e
+
+
+def iter_dataframe_chunks(file_path:str,chunk_size:int,schema_info:dict=None,columns:list=None):
+    """
+    Read a dataframe in chunks with the codec matching the file extension
+    file_path: str location of a .csv, .parquet or .feather file
+    chunk_size: int number of rows per chunk, feather files yield their stored record batches
+    schema_info: dict parsed schema, csv files are parsed with its na values and dtypes
+    columns: list columns to read, None reads every column
+    return: iterator of pd.DataFrame
+    """
+    import pandas as pd
+    try:
+        file_format = os.path.splitext(file_path)[1].lstrip(".")
+        if file_format=="csv":
+            csv_kwargs = {} if schema_info is None else {"na_values":schema_info.get("na_values"),
+                "dtype":get_schema_dtypes(schema_info=schema_info)}
+            with pd.read_csv(file_path,chunksize=chunk_size,usecols=columns,**csv_kwargs) as reader:
+                for df in reader:
+                    yield df if columns is None else df[columns]
+        elif file_format=="parquet":
+            import pyarrow.parquet as pq
+            #a memory mapped file keeps memory flat, the default read buffers every row group read so far
+            for batch in pq.ParquetFile(file_path,memory_map=True).iter_batches(batch_size=chunk_size,columns=columns):
+                yield batch.to_pandas()
+        elif file_format=="feather":
+            import pyarrow as pa
+            with pa.memory_map(file_path) as source:
+                reader = pa.ipc.open_file(source)
+                for index in range(reader.num_record_batches):
+                    batch = reader.get_batch(index)
+                    yield (batch if columns is None else batch.select(columns)).to_pandas()
+        else:
+            raise Exception(f"Unsupported file format: {file_path}")
+    except Exception as e:
+        raise SensorException(e, sys) from e
+
+
+class DataFrameChunkWriter:
+    """
+    Append dataframe chunks to one file, the codec is picked from the file extension
+    The file is created on the first write, even when that chunk is empty
+    """
+
+    def __init__(self,file_path:str):
+        try:
+            self.file_path = file_path
+            self.file_format = os.path.splitext(file_path)[1].lstrip(".")
+            if self.file_format not in ("csv","parquet","feather"):
+                raise Exception(f"Unsupported file format: {file_path}")
+            self.schema = None
+            self.writer = None
+            self.n_rows = 0
+        except Exception as e:
+            raise SensorException(e, sys) from e
+
+    def write(self,df:pd.DataFrame) -> None:
+        try:
+            if self.file_format=="csv":
+                if self.schema is None:
+                    os.makedirs(os.path.dirname(self.file_path),exist_ok=True)
+                    df.to_csv(self.file_path,index=False,header=True)
+                    self.schema = list(df.columns)
+                else:
+                    df.to_csv(self.file_path,mode="a",index=False,header=False)
+            else:
+                import pyarrow as pa
+                table = pa.Table.from_pandas(df,schema=self.schema,preserve_index=False)
+                if self.writer is None:
+                    os.makedirs(os.path.dirname(self.file_path),exist_ok=True)
+                    self.schema = table.schema
+                    if self.file_format=="parquet":
+                        import pyarrow.parquet as pq
+                        self.writer = pq.ParquetWriter(self.file_path,self.schema)
+                    else:
+                        self.writer = pa.ipc.new_file(self.file_path,self.schema)
+                self.writer.write_table(table)
+            self.n_rows+=len(df)
+        except Exception as e:
+            raise SensorException(e, sys) from e
+
+    def close(self) -> None:
+        try:
+            if self.writer is not None:
+                self.writer.close()
+                self.writer = None
+        except Exception as e:
+            raise SensorException(e, sys) from e
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self,exc_type,exc_value,traceback):
+        self.close()
+
+
+def get_row_hashes(df:pd.DataFrame,key_columns:list=None,sort_columns:bool=False) -> np.ndarray:
+    """
+    Stable 64 bit hash of every row, independent of the index and of the run
+    df: pd.DataFrame rows to hash
+    key_columns: list columns identifying a record, all columns when None
+    sort_columns: bool hash the columns by name so the hash does not depend on their order
+    return: np.ndarray of uint64
+    """
+    import pandas as pd
+    try:
+        key_df = df if key_columns is None else df[key_columns]
+        if sort_columns:
+            key_df = key_df[sorted(key_df.columns)]
+        return pd.util.hash_pandas_object(key_df,index=False).to_numpy()
+    except Exception as e:
+        raise SensorException(e, sys) from e
+
+
 def write_yaml_file(file_path,data:dict):
+    import yaml
     try:
         file_dir = os.path.dirname(file_path)
         os.makedirs(file_dir,exist_ok=True)
@@ -40,6 +446,7 @@ def write_yaml_file(file_path,data:dict):
 
 
 def read_yaml_file(file_path):
+    import yaml
     try:
         with open(file_path,"rb") as file_reader:
             return yaml.safe_load(file_reader)
@@ -48,20 +455,46 @@ def read_yaml_file(file_path):
 
 
 
-def convert_columns_float(df:pd.DataFrame, exclude_columns: list = None) -> pd.DataFrame:
-    if exclude_columns is None:
-        exclude_columns = []
+def get_schema_dtypes(schema_info:dict) -> dict:
+    """
+    Per column dtypes declared by the schema
+    schema_info: dict parsed schema.yaml
+    return: dict column name to dtype, features default to `feature_dtype`
+    """
+    feature_dtype = schema_info.get("feature_dtype","float64")
+    column_dtypes = schema_info.get("column_dtypes",{})
+    columns = schema_info["required_columns"]+schema_info["drop_columns"]
+    return {column:column_dtypes.get(column,feature_dtype) for column in columns}
+
+
+def convert_columns_float(df:pd.DataFrame, exclude_columns: list = None,
+    dtypes:dict = None, na_values:list = None) -> pd.DataFrame:
+    """
+    Cast columns in a single astype call
+    df: pd.DataFrame data to cast
+    exclude_columns: list columns left untouched
+    dtypes: dict per column dtype, usually get_schema_dtypes(), other columns become float32
+    na_values: list strings treated as missing in object columns
+    return: pd.DataFrame
+    """
+    import pandas as pd
+    exclude_columns = set(exclude_columns or [])
+    dtypes = dtypes or {}
     try:
-        for column in df.columns:
-            if column not in exclude_columns:
-                df[column]=df[column].astype('float')
-        return df
+        columns = [column for column in df.columns if column not in exclude_columns]
+        column_dtypes = {column:dtypes.get(column,"float32") for column in columns}
+        text_columns = [column for column in columns if not pd.api.types.is_numeric_dtype(df[column])
+            and pd.api.types.is_float_dtype(column_dtypes[column])]
+        if na_values and text_columns:
+            df[text_columns] = df[text_columns].mask(df[text_columns].isin(na_values))
+        return df.astype(column_dtypes)
     except Exception as e:
         raise e
 
 
 
 def save_object(file_path: str, obj: object) -> None:
+    import dill
     try:
         logging.info("Entered the save_object method of utils")
         os.makedirs(os.path.dirname(file_path), exist_ok=True)
@@ -72,6 +505,7 @@ def save_object(file_path: str, obj: object) -> None:
         raise SensorException(e, sys) from e
 
 def load_object(file_path: str, ) -> object:
+    import dill
     try:
         if not os.path.exists(file_path):
             raise Exception(f"The file: {file_path} is not exists")
@@ -86,6 +520,7 @@ def save_numpy_array_data(file_path: str, array: np.array):
     file_path: str location of file to save
     array: np.array data to save
     """
+    import numpy as np
     try:
         dir_path = os.path.dirname(file_path)
         os.makedirs(dir_path, exist_ok=True)
@@ -94,14 +529,191 @@ def save_numpy_array_data(file_path: str, array: np.array):
     except Exception as e:
         raise SensorException(e, sys) from e
 
-def load_numpy_array_data(file_path: str) -> np.array:
+def load_numpy_array_data(file_path: str, mmap_mode: str = None) -> np.array:
     """
     load numpy array data from file
     file_path: str location of file to load
+    mmap_mode: str None reads the array into memory, "r" maps an uncompressed .npy read only
+    so processes on the same host share the page cache instead of holding private copies
     return: np.array data loaded
     """
+    import numpy as np
     try:
+        if mmap_mode is not None:
+            return np.load(file_path, mmap_mode=mmap_mode)
         with open(file_path, "rb") as file_obj:
             return np.load(file_obj)
     except Exception as e:
-        raise SensorException(e, sys) from e
\ No newline at end of file
+        raise SensorException(e, sys) from e
+
+
+def open_numpy_array_data(file_path:str,shape:tuple,dtype="float32") -> np.memmap:
+    """
+    Create an uncompressed .npy file of a known shape and map it for writing, so rows can be
+    written chunk by chunk and the file is readable with load_numpy_array_data
+    file_path: str location of file to create
+    shape: tuple shape of the array
+    dtype: numpy dtype of the array
+    return: np.memmap writable view of the file, flush or delete it when done
+    """
+    import numpy as np
+    try:
+        os.makedirs(os.path.dirname(file_path), exist_ok=True)
+        return np.lib.format.open_memmap(file_path, mode="w+", dtype=dtype, shape=shape)
+    except Exception as e:
+        raise SensorException(e, sys) from e
+
+
+TRANSFORMED_FEATURE_FILE_NAME = "x.npy"
+TRANSFORMED_TARGET_FILE_NAME = "y.npy"
+#shards of a sharded transformed directory, x_00000.npy next to y_00000.npy
+TRANSFORMED_SHARD_FILE_NAME = "{}_{:05d}.npy"
+
+
+def get_transformed_file_paths(dir_path:str) -> list:
+    """
+    Feature and label files of a transformed data directory in row order
+    dir_path: str directory written by save_transformed_data
+    return: list of (features path, labels path), a single pair when it was saved without shards
+    """
+    try:
+        if os.path.exists(os.path.join(dir_path,TRANSFORMED_FEATURE_FILE_NAME)):
+            return [(os.path.join(dir_path,TRANSFORMED_FEATURE_FILE_NAME),os.path.join(dir_path,TRANSFORMED_TARGET_FILE_NAME))]
+        file_paths = []
+        while os.path.exists(os.path.join(dir_path,TRANSFORMED_SHARD_FILE_NAME.format("x",len(file_paths)))):
+            file_paths.append((os.path.join(dir_path,TRANSFORMED_SHARD_FILE_NAME.format("x",len(file_paths))),
+                os.path.join(dir_path,TRANSFORMED_SHARD_FILE_NAME.format("y",len(file_paths)))))
+        if len(file_paths)==0:
+            raise Exception(f"No transformed data in {dir_path}")
+        return file_paths
+    except Exception as e:
+        raise SensorException(e, sys) from e
+
+
+def _get_shard_offsets(n_rows:int,shard_rows:int=None) -> list:
+    shard_rows = shard_rows or max(n_rows,1)
+    return list(range(0,max(n_rows,1),shard_rows))
+
+
+def open_transformed_features(dir_path:str,n_rows:int,n_columns:int,shard_rows:int=None) -> list:
+    """
+    Create the float32 feature files of a transformed data directory and map them for writing
+    dir_path: str directory to write
+    n_rows, n_columns: int shape of all features
+    shard_rows: int rows per shard, None writes a single x.npy
+    return: list of (first row, np.memmap) in row order, flush or delete them when done
+    """
+    import numpy as np
+    try:
+        #files of an earlier layout or of more shards would be read back with the new ones
+        if os.path.isdir(dir_path):
+            for file_name in os.listdir(dir_path):
+                if file_name.endswith(".npy"):
+                    os.remove(os.path.join(dir_path,file_name))
+        offsets = _get_shard_offsets(n_rows=n_rows,shard_rows=shard_rows)
+        shards = []
+        for shard,offset in enumerate(offsets):
+            file_name = TRANSFORMED_FEATURE_FILE_NAME if shard_rows is None else TRANSFORMED_SHARD_FILE_NAME.format("x",shard)
+            end = offsets[shard+1] if shard+1<len(offsets) else n_rows
+            shards.append((offset,open_numpy_array_data(file_path=os.path.join(dir_path,file_name),
+                shape=(end-offset,n_columns),dtype=np.float32)))
+        return shards
+    except Exception as e:
+        raise SensorException(e, sys) from e
+
+
+def write_transformed_rows(shards:list,start:int,arr:np.ndarray) -> None:
+    """
+    Write rows starting at row start into the shards returned by open_transformed_features
+    """
+    try:
+        end = start+len(arr)
+        for offset,shard in shards:
+            low,high = max(start,offset),min(end,offset+len(shard))
+            if low<high:
+                shard[low-offset:high-offset] = arr[low-start:high-start]
+    except Exception as e:
+        raise SensorException(e, sys) from e
+
+
+def save_transformed_target(dir_path:str,target_feature_arr:np.ndarray,shard_rows:int=None) -> None:
+    """
+    Save int8 labels next to the features written with the same shard_rows
+    """
+    import numpy as np
+    try:
+        target_feature_arr = np.asarray(target_feature_arr,dtype=np.int8)
+        if shard_rows is None:
+            save_numpy_array_data(file_path=os.path.join(dir_path,TRANSFORMED_TARGET_FILE_NAME),array=target_feature_arr)
+            return
+        for shard,offset in enumerate(_get_shard_offsets(n_rows=len(target_feature_arr),shard_rows=shard_rows)):
+            save_numpy_array_data(file_path=os.path.join(dir_path,TRANSFORMED_SHARD_FILE_NAME.format("y",shard)),
+                array=target_feature_arr[offset:offset+shard_rows])
+    except Exception as e:
+        raise SensorException(e, sys) from e
+
+
+def save_transformed_data(dir_path:str,input_feature_arr:np.ndarray,target_feature_arr:np.ndarray,
+    shard_rows:int=None) -> None:
+    """
+    Save transformed features and labels side by side without concatenating them
+    dir_path: str directory receiving x.npy (C-contiguous float32) and y.npy (int8)
+    input_feature_arr: np.ndarray 2d features
+    target_feature_arr: np.ndarray encoded labels
+    shard_rows: int rows per x_00000.npy/y_00000.npy shard, None saves a single x.npy and y.npy
+    """
+    import numpy as np
+    try:
+        if shard_rows is None:
+            #no copy when the transformer already produced C-contiguous float32
+            save_numpy_array_data(file_path=os.path.join(dir_path,TRANSFORMED_FEATURE_FILE_NAME),
+                array=np.ascontiguousarray(input_feature_arr,dtype=np.float32))
+        else:
+            shards = open_transformed_features(dir_path=dir_path,n_rows=len(input_feature_arr),
+                n_columns=input_feature_arr.shape[1],shard_rows=shard_rows)
+            write_transformed_rows(shards=shards,start=0,arr=input_feature_arr)
+            for _,shard in shards:
+                shard.flush()
+            del shards
+        save_transformed_target(dir_path=dir_path,target_feature_arr=target_feature_arr,shard_rows=shard_rows)
+    except Exception as e:
+        raise SensorException(e, sys) from e
+
+
+def load_transformed_target(dir_path:str) -> np.ndarray:
+    """
+    load only the labels of a transformed data directory, concatenated across shards
+    """
+    import numpy as np
+    try:
+        return np.concatenate([load_numpy_array_data(file_path=y_path) for _,y_path in get_transformed_file_paths(dir_path=dir_path)])
+    except Exception as e:
+        raise SensorException(e, sys) from e
+
+
+def get_peak_rss_mb() -> float:
+    """
+    Peak resident set size of this process in MB
+    """
+    import resource
+    return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss/1024
+
+
+def load_transformed_data(dir_path:str,mmap_mode:str=None) -> tuple:
+    """
+    load features and labels saved with save_transformed_data
+    dir_path: str directory holding x.npy and y.npy or their shards
+    mmap_mode: str passed to load_numpy_array_data, "r" returns page cache backed views,
+    shards are always concatenated into memory
+    return: tuple of features and labels, used as loaded
+    """
+    import numpy as np
+    try:
+        file_paths = get_transformed_file_paths(dir_path=dir_path)
+        if os.path.basename(file_paths[0][0])==TRANSFORMED_FEATURE_FILE_NAME:
+            return (load_numpy_array_data(file_path=file_paths[0][0],mmap_mode=mmap_mode),
+                load_numpy_array_data(file_path=file_paths[0][1],mmap_mode=mmap_mode))
+        return (np.concatenate([load_numpy_array_data(file_path=x_path,mmap_mode="r") for x_path,_ in file_paths]),
+            load_transformed_target(dir_path=dir_path))
+    except Exception as e:
+        raise SensorException(e, sys) from e
@@ -0,0 +1,59 @@
+import os
+import pytest
+from types import SimpleNamespace
+from sensor.entity import config_entity
+from sensor.entity.artifact_entity import DataValidationArtifact
+from sensor.components.data_transformation import DataTransformation
+from sensor.pipeline.training_pipeline import TrainingPipeline
+
+
+@pytest.fixture
+def data_transformation_config(tmp_path,monkeypatch):
+    monkeypatch.chdir(tmp_path)
+    config = config_entity.DataTransformationConfig(training_pipeline_config=config_entity.TrainingPipelineConfig())
+    config.incremental = True
+    config.model_registry = str(tmp_path/"saved_models")
+    #a registry version holding a model is all get_training_kind needs to consider reusing it
+    model_dir = os.path.join(config.model_registry,"0","model")
+    os.makedirs(model_dir)
+    with open(os.path.join(model_dir,config_entity.MODEL_FILE_NAME),"wb") as file_obj:
+        file_obj.write(b"model")
+    return config
+
+
+def get_data_validation_artifact(incremental:bool) -> DataValidationArtifact:
+    return DataValidationArtifact(report_file_path="report.yaml",train_file_path="train.parquet",
+        test_file_path="test.parquet",status=True,file_format="parquet",new_train_file_path=None,
+        incremental=incremental)
+
+
+def test_no_new_rows_of_incremental_ingestion_reuses_the_registry_model(data_transformation_config):
+    data_transformation = DataTransformation(data_transformation_config=data_transformation_config,
+        data_validation_artifact=get_data_validation_artifact(incremental=True))
+    training_kind,_,metadata = data_transformation.get_training_kind()
+    assert training_kind=="reuse"
+    assert metadata["model_path"].endswith(config_entity.MODEL_FILE_NAME)
+
+
+def test_full_ingestion_is_a_full_retrain(data_transformation_config):
+    data_transformation = DataTransformation(data_transformation_config=data_transformation_config,
+        data_validation_artifact=get_data_validation_artifact(incremental=False))
+    assert data_transformation.get_training_kind()==("full",0,None)
+
+
+@pytest.mark.parametrize("ingestion,split_mode,split_stratify,transformation,message",[
+    (False,"hash",False,True,"DataIngestionConfig.incremental"),
+    (True,"random",False,True,"split_mode"),
+    (True,"hash",True,True,"split_stratify"),
+])
+def test_inconsistent_incremental_flags_are_rejected(ingestion,split_mode,split_stratify,transformation,message):
+    data_ingestion_config = SimpleNamespace(incremental=ingestion,split_mode=split_mode,split_stratify=split_stratify)
+    data_transformation_config = SimpleNamespace(incremental=transformation)
+    with pytest.raises(ValueError,match=message):
+        config_entity.validate_incremental_config(data_ingestion_config=data_ingestion_config,
+            data_transformation_config=data_transformation_config)
+
+
+def test_default_flags_are_consistent(tmp_path,monkeypatch):
+    monkeypatch.chdir(tmp_path)
+    TrainingPipeline(training_pipleine_config=config_entity.TrainingPipelineConfig())
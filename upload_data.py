@@ -1,4 +1,4 @@
-from sensor.utils import dump_csv_file_to_mongodb_collection
+from sensor.utils import bulk_load_csv_file_to_mongodb_collection
 from sensor.exception import SensorException
 from sensor.logger import logging
 import os,sys
@@ -7,7 +7,7 @@ def storing_record_in_mongo():
         file_path="aps_failure_training_set1.csv"
         database_name = "sensor"
         collection_name = "sensor_readings"
-        dump_csv_file_to_mongodb_collection(file_path, database_name, collection_name)
+        bulk_load_csv_file_to_mongodb_collection(file_path, database_name, collection_name)
     except Exception as e:
         raise e
 